@@ -1,47 +1,71 @@
 from fastapi import APIRouter, HTTPException, status, Request
 from fastapi.responses import JSONResponse
 from fastapi import Request
-from db.db import (get_user_by_username, remove_admin_session, validate_credentials, 
-                   create_session, get_session_by_session_str, 
+from db.db import (authenticate, remove_admin_session, 
+                   create_session, get_valid_session, 
                    remove_session, validate_admin_credentials, 
-                   create_admin_session, get_admin_session_by_field)
+                   create_admin_session, get_valid_admin_session)
 from db.schemas import AddUserSchema, PasswordSchema
+from db.passwords import PasswordPoolBusy
+from db.env import config
+from utils.ratelimit import MemoryBucketStore, RateLimiter, client_ip, parse_networks
+from utils.metrics import auth_attempts
 from time import time
 
+import math
+
 
 router = APIRouter(prefix='/auth', tags=['auth'])
 # app = FastAPI()
 
-async def is_session_expired(session):
-    if session.expires_at < int(time()):
-        return True
-    return False
+# Swap the store for a shared BucketStore when running several workers.
+login_store = MemoryBucketStore(config.RATE_LIMIT_MAX_KEYS)
+ip_limiter = RateLimiter(login_store, config.LOGIN_IP_RATE, config.LOGIN_IP_BURST)
+user_limiter = RateLimiter(login_store, config.LOGIN_USER_RATE, config.LOGIN_USER_BURST)
+trusted_proxies = parse_networks(config.TRUSTED_PROXIES)
+
+async def limit_login(request: Request, scope: str, username: str | None = None) -> None:
+    """Charges one attempt to the client IP (and username); 429 if either
+    is over its limit."""
+    ip = client_ip(request, trusted_proxies, config.FORWARDED_FOR_HEADER)
+    wait = await ip_limiter.check(f"{scope}:ip:{ip}")
+    if username is not None:
+        wait = max(wait, await user_limiter.check(f"{scope}:user:{username.lower()}"))
+    if wait:
+        auth_attempts.inc(scope, "rate_limited")
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many login attempts",
+                            headers={"Retry-After": str(math.ceil(wait))})
 
 @router.post('/login')
 async def login(credentials: AddUserSchema, request: Request):
+    await limit_login(request, "login", credentials.username)
     current_session = request.cookies.get("session")
-    is_valid = await validate_credentials(credentials.username, credentials.password)
 
-    session = await get_session_by_session_str(current_session)
-    if current_session and session:
-        if not await is_session_expired(session):
-            raise HTTPException(status_code=status.HTTP_208_ALREADY_REPORTED, detail="Already logged in")
+    if await get_valid_session(current_session):
+        auth_attempts.inc("login", "already_logged_in")
+        raise HTTPException(status_code=status.HTTP_208_ALREADY_REPORTED, detail="Already logged in")
 
-    if is_valid:
-        await remove_session(current_session)
+    try:
+        user = await authenticate(credentials.username, credentials.password)
+    except PasswordPoolBusy:
+        auth_attempts.inc("login", "busy")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many logins, try again",
+                            headers={"Retry-After": "1"})
+
+    if user:
+        auth_attempts.inc("login", "ok")
+        if current_session:
+            await remove_session(current_session)
 
         content = {"message": "Login successful"}
         response = JSONResponse(content=content)
-        
-        user = await get_user_by_username(credentials.username)
-        if not user:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password")
 
         # create a new session
-        new_session = await create_session(user.id, int(time()))
+        new_session = await create_session(user.id, int(time()), group_id=user.group_id)
         response.set_cookie(key="session", value=new_session.session, httponly=True)
         
         return response
+    auth_attempts.inc("login", "invalid")
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password")
 
 @router.get('/validate')
@@ -50,8 +74,8 @@ async def validate(request: Request):
     if not current_session:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No session cookie found")
     
-    session = await get_session_by_session_str(current_session)
-    if not session or session.expires_at < int(time()):
+    session = await get_valid_session(current_session)
+    if not session:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired session")
     
     return {"message": "Session is valid"}
@@ -62,8 +86,8 @@ async def validate_admin(request: Request):
     if not current_session:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No admin session cookie found")
 
-    session = await get_admin_session_by_field('session', current_session)
-    if not session or session.expires_at < int(time()):
+    session = await get_valid_admin_session(current_session)
+    if not session:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired admin session")
 
     return {"message": "Admin session is valid"}
@@ -83,16 +107,17 @@ async def logout(request: Request):
 
 @router.post('/admin-login')
 async def admin_login(request: Request, credentials: PasswordSchema):
+    await limit_login(request, "admin")
     current_session = request.cookies.get("admin_session")
     is_valid = await validate_admin_credentials(credentials.password)
 
-    session = await get_admin_session_by_field('session', current_session)
-    if current_session and session:
-        if not await is_session_expired(session):
-            raise HTTPException(status_code=status.HTTP_208_ALREADY_REPORTED, detail="Already logged in")
+    if await get_valid_admin_session(current_session):
+        auth_attempts.inc("admin", "already_logged_in")
+        raise HTTPException(status_code=status.HTTP_208_ALREADY_REPORTED, detail="Already logged in")
 
     if is_valid:
-        await remove_session(current_session)
+        auth_attempts.inc("admin", "ok")
+        await remove_admin_session(current_session)
 
         content = {"message": "Login successful"}
         response = JSONResponse(content=content)
@@ -102,6 +127,7 @@ async def admin_login(request: Request, credentials: PasswordSchema):
         response.set_cookie(key="admin_session", value=new_session.session, httponly=True)
 
         return response
+    auth_attempts.inc("admin", "invalid")
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password")
 
 @router.delete('/admin-logout')
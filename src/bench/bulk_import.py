@@ -0,0 +1,99 @@
+"""Bulk import throughput on a scratch SQLite database.
+
+Streams ``--servers`` virtual users (password-authenticated, so every row
+is encrypted) and then ``--links`` group-server links through the same
+parser and batch writer the /admin/import endpoints use, in 64 KiB
+chunks as a request body would arrive.
+
+    cd src && python -m bench.bulk_import --servers 50000 --links 200000
+"""
+import os
+import tempfile
+
+os.environ["DB_DIRECTORY"] = tempfile.mkdtemp(prefix="wst-bench-")
+
+from db import db
+from db.bulk import iter_lines, iter_jsonl, iter_csv, run_import
+from db.env import config
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import time
+
+
+async def chunked(lines, size: int = 65536):
+    buf = []
+    length = 0
+    for line in lines:
+        buf.append(line)
+        length += len(line)
+        if length >= size:
+            yield "".join(buf).encode()
+            buf, length = [], 0
+    if buf:
+        yield "".join(buf).encode()
+
+
+def server_rows(n: int, fmt: str):
+    if fmt == "csv":
+        yield "username,domain,port,ssh_key_type,password\n"
+    for i in range(n):
+        if fmt == "csv":
+            yield f"user{i},host{i}.example.com,22,password,secret{i}\n"
+        else:
+            yield json.dumps({
+                "username": f"user{i}", "domain": f"host{i}.example.com", "port": 22,
+                "ssh_key_type": "password", "password": f"secret{i}",
+            }) + "\n"
+
+
+def link_rows(n: int, groups: int, servers: int, fmt: str):
+    pairs = random.sample(range(groups * servers), n)
+    if fmt == "csv":
+        yield "group_id,server_id\n"
+    for p in pairs:
+        group_id, server_id = divmod(p, servers)
+        if fmt == "csv":
+            yield f"{group_id + 1},{server_id + 1}\n"
+        else:
+            yield f'{{"group_id":{group_id + 1},"server_id":{server_id + 1}}}\n'
+
+
+async def timed(label: str, name: str, rows, fmt: str) -> None:
+    lines = iter_lines(chunked(rows), config.IMPORT_MAX_LINE)
+    records = iter_csv(lines) if fmt == "csv" else iter_jsonl(lines)
+    start = time.perf_counter()
+    report = await run_import(name, records)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>8}: {report.written} rows in {elapsed:.2f}s "
+          f"({report.written / elapsed:,.0f} rows/s), {report.failed} failed")
+
+
+async def run(args):
+    await db.init_db()
+    await db.load_acl()
+    for i in range(1, args.groups):
+        await db.add_group(f"group{i}")
+
+    await timed("servers", "virtual_users", server_rows(args.servers, args.format), args.format)
+    await timed("links", "group_to_server",
+                link_rows(args.links, args.groups, args.servers, args.format), args.format)
+    print(f"acl: {db.acl.stats()}")
+    print(f"peak rss: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=50_000)
+    parser.add_argument("--links", type=int, default=200_000)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
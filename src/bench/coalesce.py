@@ -0,0 +1,107 @@
+"""Output throughput and frame rate with and without coalescing.
+
+A producer thread plays the part of paramiko's transport thread and feeds
+the fake channel in packet-sized pieces (a `cat bigfile` flood), then a
+short interactive phase checks that single keystroke echoes still leave as
+one frame each.  "legacy" is the old fixed 1024-byte read with one frame
+per read; --frame-cost-us adds a per-frame busy wait standing in for the
+socket write a real send_bytes pays.
+
+    cd src && python -m bench.coalesce --mb 50
+"""
+from bench.fakes import FakeChannel, FakeWebSocket
+from db.env import config
+from ssh import SSHSession
+
+import argparse
+import asyncio
+import random
+import threading
+import time
+
+
+# paramiko's default channel window: the server stops sending once this much
+# is buffered and unread.
+WINDOW = 2 * 2**20
+
+
+def produce(chan: FakeChannel, total: int):
+    rnd = random.Random(0)
+    sent = 0
+    while sent < total:
+        while len(chan.in_buffer) > WINDOW:
+            time.sleep(0.0005)
+        n = rnd.randint(200, 4096)
+        chan.feed(b"x" * n)
+        sent += n
+        if rnd.random() < 0.05:
+            time.sleep(0)
+
+
+class CostlyWebSocket(FakeWebSocket):
+    def __init__(self, cost: float):
+        super().__init__()
+        self.cost = cost
+
+    async def send_bytes(self, data):
+        end = time.perf_counter() + self.cost
+        while time.perf_counter() < end:
+            pass
+        await super().send_bytes(data)
+
+
+async def run(mode: str, total: int, cost: float):
+    chan = FakeChannel()
+    session = SSHSession(ws=CostlyWebSocket(cost), host="bench", port=22, username="bench")
+    session.attach_channel(chan)
+    if mode == "legacy":
+        session.recv_max = config.TERM_RECV_MIN
+    if mode != "coalesce":
+        session.coalesce_bytes = 0
+    session.start_reader()
+    writer = asyncio.create_task(session.ws_writer())
+
+    start = time.perf_counter()
+    producer = threading.Thread(target=produce, args=(chan, total))
+    producer.start()
+    while session.bytes_out < total:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    producer.join()
+    flood_frames = session.frames_out
+
+    echoes = 50
+    frames_before = session.frames_out
+    latencies = []
+    for _ in range(echoes):
+        t = time.perf_counter()
+        chan.feed(b"k")
+        while session.frames_out == frames_before + len(latencies):
+            await asyncio.sleep(0)
+        latencies.append(time.perf_counter() - t)
+
+    print(
+        f"{mode:>8}: "
+        f"MB/s={total / elapsed / 2**20:8.1f} frames={flood_frames:7d} "
+        f"frames/s={flood_frames / elapsed:9.0f} "
+        f"avg_frame={total / flood_frames / 1024:6.1f}KiB "
+        f"echo_frames={session.frames_out - frames_before}/{echoes} "
+        f"echo_p50={sorted(latencies)[echoes // 2] * 1e6:.0f}us"
+    )
+
+    session.stop_reader()
+    writer.cancel()
+    await asyncio.gather(writer, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=50)
+    parser.add_argument("--frame-cost-us", type=float, default=20.0)
+    args = parser.parse_args()
+    for mode in ("legacy", "adaptive", "coalesce"):
+        asyncio.run(run(mode, args.mb * 2**20, args.frame_cost_us / 1e6))
+
+
+if __name__ == "__main__":
+    main()
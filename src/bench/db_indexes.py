@@ -0,0 +1,117 @@
+"""Lookup latency on large tables before and after the index migration.
+
+Fills a scratch SQLite database with ``--sessions`` sessions and
+``--links`` group-server links, drops the lookup indexes to get the
+pre-migration schema, times the hot lookups, then applies the migrations
+and times them again.
+
+    cd src && python -m bench.db_indexes --sessions 1000000 --links 100000
+"""
+import os
+import tempfile
+
+os.environ["DB_DIRECTORY"] = tempfile.mkdtemp(prefix="wst-bench-")
+
+from sqlalchemy import exists, select, text
+from db import db
+from db.migrations import run_migrations
+
+import argparse
+import asyncio
+import random
+import sqlite3
+import statistics
+import time
+import uuid
+
+INDEXES = (
+    "ix_sessions_session", "ix_sessions_user_id", "ix_adminsessions_session",
+    "ux_grouptoservers_group_server", "ix_grouptoservers_server_id",
+)
+
+
+def fill(path: str, sessions: int, links: int, users: int, groups: int, servers: int) -> list[str]:
+    con = sqlite3.connect(path)
+    for ix in INDEXES:
+        con.execute(f"DROP INDEX IF EXISTS {ix}")
+    con.execute("UPDATE schemaversion SET version = 0")
+    con.executemany(
+        "INSERT INTO groups (id, name) VALUES (?, ?)",
+        ((g, f"group{g}") for g in range(2, groups + 1)),
+    )
+    con.executemany(
+        "INSERT INTO webusers (id, legacy_session, username, password, group_id) VALUES (?, '', ?, '', ?)",
+        ((u, f"user{u}", u % groups + 1) for u in range(1, users + 1)),
+    )
+    con.executemany(
+        "INSERT INTO virtualusers (id, username, password, ssh_key, ssh_key_type, passphrase, domain, port) "
+        "VALUES (?, 'root', '', '', 'RSA', '', ?, 22)",
+        ((s, f"host{s}.example") for s in range(1, servers + 1)),
+    )
+    pairs = random.sample(range(groups * servers), links)
+    con.executemany(
+        "INSERT INTO grouptoservers (group_id, server_id) VALUES (?, ?)",
+        ((p // servers + 1, p % servers + 1) for p in pairs),
+    )
+    cookies = [str(uuid.uuid4()) for _ in range(sessions)]
+    now = int(time.time())
+    con.executemany(
+        "INSERT INTO sessions (user_id, session, created_at, expires_at) VALUES (?, ?, ?, ?)",
+        ((i % users + 1, cookie, now, now + 3600) for i, cookie in enumerate(cookies)),
+    )
+    con.commit()
+    con.close()
+    return cookies
+
+
+async def measure(label: str, n: int, cookies: list[str], users: int, groups: int, servers: int):
+    lookups = {
+        "session by cookie": lambda: select(db.Sessions).where(
+            db.Sessions.session == random.choice(cookies)),
+        "sessions by user": lambda: select(db.Sessions.id).where(
+            db.Sessions.user_id == random.randint(1, users)),
+        "link exists": lambda: select(exists().where(
+            db.GroupToServer.group_id == random.randint(1, groups),
+            db.GroupToServer.server_id == random.randint(1, servers))),
+        "links by server": lambda: select(db.GroupToServer.group_id).where(
+            db.GroupToServer.server_id == random.randint(1, servers)),
+    }
+    print(label)
+    for name, stmt in lookups.items():
+        latencies = []
+        for _ in range(n):
+            start = time.perf_counter()
+            async with db.primary_session() as session:
+                (await session.execute(stmt())).all()
+            latencies.append(time.perf_counter() - start)
+        print(f"  {name:>18}: p50={statistics.median(latencies) * 1e3:8.3f}ms "
+              f"max={max(latencies) * 1e3:8.3f}ms")
+
+
+async def run(args):
+    await db.init_db()
+    start = time.perf_counter()
+    cookies = fill(db.DB_DIRECTORY, args.sessions, args.links, args.users, args.groups, args.servers)
+    print(f"filled in {time.perf_counter() - start:.1f}s")
+
+    await measure("without indexes", args.n, cookies, args.users, args.groups, args.servers)
+    start = time.perf_counter()
+    applied = await run_migrations(db.primary_engine, db.Base.metadata)
+    print(f"migrations {applied} in {time.perf_counter() - start:.1f}s")
+    await measure("with indexes", args.n, cookies, args.users, args.groups, args.servers)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=1_000_000)
+    parser.add_argument("--links", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--groups", type=int, default=500)
+    parser.add_argument("--servers", type=int, default=2_000)
+    parser.add_argument("-n", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+from paramiko.buffered_pipe import BufferedPipe, PipeTimeout
+from paramiko import pipe
+
+import socket
+import threading
+
+
+class FakeTransport:
+    """Just what SSHSession checks before sending: no rekey in progress
+    and a socket with room to write."""
+
+    def __init__(self):
+        self.clear_to_send = threading.Event()
+        self.clear_to_send.set()
+        self.sock, self._peer = socket.socketpair()
+
+    def is_active(self):
+        return True
+
+
+class FakeChannel:
+    """In-memory stand-in for paramiko.Channel built from the same
+    BufferedPipe/pipe pair paramiko uses, so fileno() readiness behaves
+    like the real thing."""
+
+    def __init__(self):
+        self.in_buffer = BufferedPipe()
+        self.sent = bytearray()
+        self.timeout = None
+        self.closed = False
+        self._pipe = None
+        self.transport = None
+
+    def get_transport(self):
+        if self.transport is None:
+            self.transport = FakeTransport()
+        return self.transport
+
+    def feed(self, data: bytes):
+        self.in_buffer.feed(data)
+
+    def eof(self):
+        self.in_buffer.close()
+
+    def fileno(self):
+        if self._pipe is None:
+            self._pipe = pipe.make_pipe()
+            self.in_buffer.set_event(self._pipe)
+        return self._pipe.fileno()
+
+    def setblocking(self, blocking):
+        self.timeout = None if blocking else 0.0
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv(self, nbytes):
+        try:
+            return self.in_buffer.read(nbytes, self.timeout)
+        except PipeTimeout:
+            raise socket.timeout()
+
+    def recv_ready(self):
+        return self.in_buffer.read_ready()
+
+    def recv_stderr_ready(self):
+        return False
+
+    def send(self, data):
+        self.sent += data
+        return len(data)
+
+    def sendall(self, data):
+        self.sent += data
+
+    def resize_pty(self, width=80, height=24):
+        pass
+
+    def close(self):
+        self.closed = True
+        self.in_buffer.close()
+        if self._pipe is not None:
+            self._pipe.close()
+            self._pipe = None
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.closed = False
+
+    async def send_bytes(self, data):
+        self.frames += 1
+        self.bytes += len(data)
+
+    async def send_text(self, data):
+        self.frames += 1
+        self.bytes += len(data)
+
+    async def close(self, code=1000, reason=None):
+        self.closed = True
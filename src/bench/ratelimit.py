@@ -0,0 +1,48 @@
+"""Per-request cost of the login rate limiter.
+
+Times limit checks (one IP bucket plus one username bucket, as
+/auth/login does) for a single hot client, for clients spread over a
+store at capacity, and for a stream of new keys that evict on every
+insert.
+
+    cd src && python -m bench.ratelimit -n 200000 --keys 100000
+"""
+from utils.ratelimit import MemoryBucketStore, RateLimiter
+
+import argparse
+import asyncio
+import time
+
+
+async def run(n: int, keys: int):
+    cases = {
+        "hot key": lambda i: 0,
+        "spread": lambda i: i % keys,
+        "evicting": lambda i: keys + i,
+    }
+    for name, key_of in cases.items():
+        store = MemoryBucketStore(keys)
+        ip_limiter = RateLimiter(store, 1e9, 10)
+        user_limiter = RateLimiter(store, 1e9, 10)
+        for i in range(keys):
+            await store.take(f"login:ip:{i}", 1.0, 10)
+
+        start = time.perf_counter()
+        for i in range(n):
+            k = key_of(i)
+            await ip_limiter.check(f"login:ip:{k}")
+            await user_limiter.check(f"login:user:user{k}")
+        total = time.perf_counter() - start
+        print(f"{name:>9}: {total / n * 1e6:6.2f}us/request  keys={len(store)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200000)
+    parser.add_argument("--keys", type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.run(run(args.n, args.keys))
+
+
+if __name__ == "__main__":
+    main()
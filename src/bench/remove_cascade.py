@@ -0,0 +1,79 @@
+"""Cascading removal of a heavily linked server and of a large group.
+
+Fills a scratch SQLite database with one server linked to ``--groups``
+groups, and one group with ``--members`` users holding a session each,
+then times remove_virtual_user and remove_group on them.
+
+    cd src && python -m bench.remove_cascade --groups 100000 --members 50000
+"""
+import os
+import tempfile
+
+os.environ["DB_DIRECTORY"] = tempfile.mkdtemp(prefix="wst-bench-")
+
+from sqlalchemy import func, select
+from db import db
+
+import argparse
+import asyncio
+import time
+import uuid
+
+
+async def fill(groups: int, members: int) -> tuple[int, int]:
+    server = await db.add_virtual_user("root", "example.com", password="secret", ssh_key_type="password")
+    big = await db.add_group("big")
+    await db.insert_rows(db.Groups, [{"name": f"group{i}"} for i in range(groups)])
+    async with db.read_session() as session:
+        group_ids = (await session.execute(select(db.Groups.id))).scalars().all()
+    await db.insert_rows(db.GroupToServer, [{"group_id": g, "server_id": server.id} for g in group_ids])
+
+    await db.insert_rows(db.WebUsers, [
+        {"username": f"user{i}", "password": "x", "legacy_session": "", "group_id": big.id}
+        for i in range(members)
+    ])
+    async with db.read_session() as session:
+        user_ids = (await session.execute(
+            select(db.WebUsers.id).where(db.WebUsers.group_id == big.id)
+        )).scalars().all()
+    now = int(time.time())
+    await db.insert_rows(db.Sessions, [
+        {"user_id": u, "session": str(uuid.uuid4()), "created_at": now, "expires_at": now + 3600}
+        for u in user_ids
+    ])
+    return server.id, big.id
+
+
+async def count(table_class) -> int:
+    async with db.read_session() as session:
+        return await session.scalar(select(func.count()).select_from(table_class))
+
+
+async def run(args):
+    await db.init_db()
+    await db.load_acl()
+    server_id, group_id = await fill(args.groups, args.members)
+    await db.load_acl()
+    print(f"links={await count(db.GroupToServer)} users={await count(db.WebUsers)} "
+          f"sessions={await count(db.Sessions)}")
+
+    start = time.perf_counter()
+    await db.remove_virtual_user(server_id)
+    print(f"remove_virtual_user: {time.perf_counter() - start:.3f}s, links left={await count(db.GroupToServer)}")
+
+    start = time.perf_counter()
+    await db.remove_group(group_id)
+    print(f"remove_group: {time.perf_counter() - start:.3f}s, users left={await count(db.WebUsers)} "
+          f"sessions left={await count(db.Sessions)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, default=100_000)
+    parser.add_argument("--members", type=int, default=50_000)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Bytes sent and CPU per session: raw output vs screen-delta mode.
+
+A producer thread floods the fake channel with coloured log lines (think
+`journalctl -f` during an incident) while the event loop runs one session
+in each mode.  CPU is process time for the whole run, so it includes
+pyte's parsing in screen mode; lag is the worst delay of a 10 ms timer on
+the same loop, i.e. what every other session in the worker would feel.
+
+    cd src && python -m bench.screen --mb 5
+"""
+from bench.fakes import FakeChannel, FakeWebSocket
+from ssh import SSHSession
+
+import argparse
+import asyncio
+import random
+import threading
+import time
+
+WINDOW = 2 * 2**20
+
+
+def flood(chan: FakeChannel, total: int):
+    rnd = random.Random(0)
+    sent = 0
+    n = 0
+    while sent < total:
+        while len(chan.in_buffer) > WINDOW:
+            time.sleep(0.0005)
+        lines = []
+        for _ in range(64):
+            n += 1
+            colour = 31 + n % 6
+            lines.append(
+                f"\x1b[{colour}m{n:>9}\x1b[0m host-{rnd.randint(1, 99):02d} "
+                f"{'x' * rnd.randint(20, 140)}\r\n"
+            )
+        chunk = "".join(lines).encode()
+        chan.feed(chunk)
+        sent += len(chunk)
+
+
+async def heartbeat(lags: list):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(0.01)
+        lags.append(loop.time() - start - 0.01)
+
+
+async def run(mode: str, total: int):
+    chan = FakeChannel()
+    session = SSHSession(
+        ws=FakeWebSocket(), host="bench", port=22, username="bench",
+        termsize={"cols": 200, "rows": 50}, mode=mode,
+    )
+    session.attach_channel(chan)
+    session.start_reader()
+    writer = asyncio.create_task(session.ws_writer())
+    lags = []
+    ticker = asyncio.create_task(heartbeat(lags))
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    producer = threading.Thread(target=flood, args=(chan, total))
+    producer.start()
+    while producer.is_alive() or len(chan.in_buffer):
+        await asyncio.sleep(0.005)
+    # Let the last frame go out.
+    await asyncio.sleep(session.frame_interval * 2)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    producer.join()
+
+    print(
+        f"{mode:>6}: input={total / 2**20:.1f}MiB sent={session.ws.bytes / 2**20:8.2f}MiB "
+        f"frames={session.ws.frames:6d} cpu={cpu:.2f}s wall={wall:.2f}s "
+        f"cpu/MiB_in={cpu / (total / 2**20) * 1000:.1f}ms max_lag={max(lags) * 1000:.1f}ms"
+    )
+
+    session.stop_reader()
+    writer.cancel()
+    ticker.cancel()
+    await asyncio.gather(writer, ticker, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=5)
+    args = parser.parse_args()
+    for mode in ("raw", "screen"):
+        asyncio.run(run(mode, args.mb * 2**20))
+
+
+if __name__ == "__main__":
+    main()
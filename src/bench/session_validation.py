@@ -0,0 +1,76 @@
+"""Cookie validation latency: database lookup vs session cache vs signed token.
+
+"db" is the uncached query every request used to make; "cached" is
+get_valid_session on a database-backed cookie (after the first hit);
+"token" is get_valid_session on a SESSION_MODE=token cookie, i.e. an HMAC
+check plus the in-memory revocation lookup.  Each mode runs ``-c``
+concurrent validators against a scratch SQLite database.
+
+    cd src && python -m bench.session_validation -n 20000 -c 50
+"""
+import os
+import tempfile
+
+os.environ["DB_DIRECTORY"] = tempfile.mkdtemp(prefix="wst-bench-")
+
+from db import db
+
+import argparse
+import asyncio
+import statistics
+import time
+
+
+async def validate_db(cookie: str):
+    sess = await db.get_session_by_session_str(cookie)
+    return sess if sess and sess.expires_at >= int(time.time()) else None
+
+
+async def run(n: int, concurrency: int):
+    await db.init_db()
+    await db.add_group("bench")
+    user = await db.add_user("bench", "bench")
+    now = int(time.time())
+
+    db_cookie = (await db.create_session(user.id, now)).session
+    token_cookie = db.token_signer.issue(user.id, user.group_id, now, now + 3600).session
+    await db.load_revocations()
+    # A realistic revocation list to look through.
+    for i in range(1000):
+        db.revocations.tokens[f"revoked-{i}"] = now + 3600
+
+    modes = (
+        ("db", validate_db, db_cookie),
+        ("cached", db.get_valid_session, db_cookie),
+        ("token", db.get_valid_session, token_cookie),
+    )
+    for name, fn, cookie in modes:
+        latencies = []
+
+        async def worker(count: int):
+            for _ in range(count):
+                start = time.perf_counter()
+                assert await fn(cookie) is not None
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(n // concurrency) for _ in range(concurrency)))
+        total = time.perf_counter() - start
+        latencies.sort()
+        print(
+            f"{name:>7}: {len(latencies) / total:9.0f} validations/s "
+            f"p50={statistics.median(latencies) * 1e6:8.1f}us "
+            f"p99={latencies[int(len(latencies) * 0.99)] * 1e6:8.1f}us"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20000)
+    parser.add_argument("-c", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.n, args.c))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Concurrent login/validate throughput with and without the SQLite profile.
+
+Each mode gets a scratch database and ``-p`` worker processes, like
+uvicorn workers sharing one file (the engines are built at import time
+from config, hence the processes).  Every process runs ``-c`` clients
+doing ``-n`` operations each: one login (credential check plus a new
+session row) for every ``--reads`` uncached session validations.
+Failed operations, e.g. "database is locked", are counted, not retried.
+
+    cd src && python -m bench.sqlite_profile -p 4 -c 50 -n 40
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+async def setup(users: int):
+    from db import db
+
+    await db.init_db()
+    for i in range(users):
+        await db.add_user(f"user{i}", "password")
+
+
+async def worker(clients: int, n: int, reads: int, start_at: float):
+    from db import db
+
+    users = [await db.get_user_by_username(f"user{i}") for i in range(clients)]
+    cookies = [(await db.create_session(user.id, int(time.time()))).session for user in users]
+    errors = 0
+
+    async def client(i: int):
+        nonlocal errors
+        for op in range(n):
+            try:
+                if op % (reads + 1) == 0:
+                    assert await db.validate_credentials(f"user{i}", "password")
+                    await db.create_session(users[i].id, int(time.time()))
+                else:
+                    assert await db.get_session_by_session_str(cookies[i])
+            except Exception:
+                errors += 1
+
+    # All processes start together.
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    print(f"{clients * n} {time.perf_counter() - start} {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", type=int, default=4)
+    parser.add_argument("-c", type=int, default=50)
+    parser.add_argument("-n", type=int, default=40)
+    parser.add_argument("--reads", type=int, default=4)
+    parser.add_argument("--setup", action="store_true")
+    parser.add_argument("--worker", type=float, default=None, metavar="START_AT")
+    args = parser.parse_args()
+
+    if args.setup:
+        asyncio.run(setup(args.c))
+        return
+    if args.worker is not None:
+        asyncio.run(worker(args.c, args.n, args.reads, args.worker))
+        return
+
+    cmd = [sys.executable, "-m", "bench.sqlite_profile", "-c", str(args.c)]
+    for profile in ("false", "true"):
+        env = dict(os.environ, SQLITE_PROFILE=profile, DB_DIRECTORY=tempfile.mkdtemp(prefix="wst-bench-"))
+        subprocess.run(cmd + ["--setup"], env=env, check=True)
+
+        start_at = time.time() + 2.0
+        procs = [
+            subprocess.Popen(
+                cmd + ["-n", str(args.n), "--reads", str(args.reads), "--worker", str(start_at)],
+                env=env, stdout=subprocess.PIPE, text=True,
+            )
+            for _ in range(args.p)
+        ]
+        results = [proc.communicate()[0].split() for proc in procs]
+        ops = sum(int(r[0]) for r in results)
+        wall = max(float(r[1]) for r in results)
+        errors = sum(int(r[2]) for r in results)
+        print(f"SQLITE_PROFILE={profile:>5}: {ops / wall:8.0f} ops/s  errors={errors}/{ops}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Idle-session capacity of the SSH read path.
+
+Opens N fake channels and compares the old design (one executor thread
+blocked in chan.recv per session) with the event-loop reader.  Every session
+gets one chunk of output after start-up; the report shows how many of them
+delivered it within the deadline, plus RSS and thread count.
+
+    cd src && python -m bench.ssh_io -n 2000
+"""
+from bench.fakes import FakeChannel, FakeWebSocket
+from ssh import SSHSession
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+
+
+def rss_kib() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def legacy_reader(chan, loop, queue):
+    while True:
+        data = chan.recv(1024)
+        if not data:
+            break
+        asyncio.run_coroutine_threadsafe(queue.put(data), loop)
+
+
+async def run(mode: str, n: int, deadline: float):
+    loop = asyncio.get_running_loop()
+    base_rss = rss_kib()
+    chans = []
+    writers = []
+    tasks = []
+
+    for _ in range(n):
+        chan = FakeChannel()
+        session = SSHSession(ws=FakeWebSocket(), host="bench", port=22, username="bench")
+        session.attach_channel(chan)
+        if mode == "threads":
+            chan.setblocking(True)
+            tasks.append(asyncio.create_task(
+                asyncio.to_thread(legacy_reader, chan, loop, session.queue)
+            ))
+        else:
+            session.start_reader()
+        writers.append(asyncio.create_task(session.ws_writer()))
+        chans.append((chan, session))
+
+    await asyncio.sleep(0.5)
+    start = time.perf_counter()
+    for chan, _ in chans:
+        chan.feed(b"$ ")
+    while time.perf_counter() - start < deadline:
+        if all(s.ws.frames for _, s in chans):
+            break
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    served = sum(1 for _, s in chans if s.ws.frames)
+    print(
+        f"{mode:>8}: sessions={n} served={served} "
+        f"rss_delta={(rss_kib() - base_rss) / 1024:.1f}MiB "
+        f"threads={threading.active_count()} elapsed={elapsed:.2f}s"
+    )
+
+    for chan, session in chans:
+        session.stop_reader()
+        chan.eof()
+    for w in writers:
+        w.cancel()
+    # Unblocked legacy readers exit on EOF; starved ones never started.
+    await asyncio.gather(*writers, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--sessions", type=int, default=2000)
+    parser.add_argument("--mode", choices=["threads", "loop"])
+    parser.add_argument("--deadline", type=float, default=3.0)
+    args = parser.parse_args()
+
+    if args.mode:
+        asyncio.run(run(args.mode, args.sessions, args.deadline))
+        return
+
+    # Each mode runs in its own interpreter so RSS numbers do not mix.
+    for mode in ("threads", "loop"):
+        subprocess.run(
+            [sys.executable, "-m", "bench.ssh_io", "--mode", mode,
+             "-n", str(args.sessions), "--deadline", str(args.deadline)],
+            check=False,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class ServerInfo:
+    """What listings need to know about a virtual user; no credentials."""
+
+    id: int
+    username: str
+    domain: str
+    port: int
+
+
+class AclIndex:
+    """In-memory copy of grouptoservers plus server metadata.
+
+    ``version`` mirrors the aclversion row, bumped by every change to links
+    or servers, so a worker can tell its copy is stale and reload it.
+    """
+
+    def __init__(self):
+        self.groups: dict[int, set[int]] = {}
+        self.servers: dict[int, ServerInfo] = {}
+        self.version = -1
+        self.checked_at = 0.0
+
+    def replace(self, links, servers, version: int) -> None:
+        groups: dict[int, set[int]] = {}
+        for group_id, server_id in links:
+            groups.setdefault(group_id, set()).add(server_id)
+        self.groups = groups
+        self.servers = {srv.id: srv for srv in servers}
+        self.version = version
+
+    def is_linked(self, group_id: int | None, server_id: int) -> bool:
+        return server_id in self.groups.get(group_id, ())
+
+    def servers_for_group(self, group_id: int | None) -> list[ServerInfo]:
+        ids = self.groups.get(group_id, ())
+        return [self.servers[sid] for sid in sorted(ids) if sid in self.servers]
+
+    def page(self, group_id: int | None, after: int = 0, limit: int = 50,
+             q: str = "", prefix: bool = False) -> tuple[list[ServerInfo], int | None]:
+        """One page of a group's servers in id order, starting after id
+        ``after``, optionally filtered by ``q`` on username and domain.
+
+        Returns the page and the ``after`` of the next one (None at the end).
+        """
+        q = q.lower()
+        items = []
+        for sid in sorted(self.groups.get(group_id, ())):
+            srv = self.servers.get(sid)
+            if sid <= after or srv is None:
+                continue
+            if q:
+                username, domain = srv.username.lower(), srv.domain.lower()
+                if prefix:
+                    matched = username.startswith(q) or domain.startswith(q)
+                else:
+                    matched = q in f"{username}@{domain}"
+                if not matched:
+                    continue
+            if len(items) == limit:
+                return items, items[-1].id
+            items.append(srv)
+        return items, None
+
+    def link(self, group_id: int, server_id: int) -> None:
+        self.groups.setdefault(group_id, set()).add(server_id)
+
+    def unlink(self, group_id: int, server_id: int) -> None:
+        self.groups.get(group_id, set()).discard(server_id)
+
+    def put_server(self, server: ServerInfo) -> None:
+        self.servers[server.id] = server
+
+    def drop_server(self, server_id: int) -> None:
+        self.drop_servers([server_id])
+
+    def drop_servers(self, server_ids) -> None:
+        server_ids = set(server_ids)
+        for server_id in server_ids:
+            self.servers.pop(server_id, None)
+        for ids in self.groups.values():
+            ids.difference_update(server_ids)
+
+    def drop_group(self, group_id: int) -> None:
+        self.groups.pop(group_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "groups": len(self.groups),
+            "servers": len(self.servers),
+            "links": sum(len(ids) for ids in self.groups.values()),
+        }
@@ -1,5 +1,5 @@
-from fastapi import APIRouter, FastAPI, Depends, HTTPException, status, Request
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query, status, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.exc import IntegrityError
 from utils.template import templates
 from db.schemas import (
@@ -11,17 +11,22 @@ from db.schemas import (
     LinkUserToServerSchema,
     ValidateCredentialsSchema,
     IsAccountLinkedSchema,
+    IdsSchema,
     useUserId,
 )
 from db.db import (
     add_user as db_add_user, 
     remove_admin_session,
     remove_user, 
+    remove_users,
     add_virtual_user, 
     link_group_to_server,
     add_group,
     remove_group,
+    remove_groups,
+    DefaultGroupRemoval,
     remove_virtual_user,
+    remove_virtual_users,
     remove_link_user_to_server,
     set_group_for_user,
     get_session_by_session_str,
@@ -32,7 +37,9 @@ from db.db import (
     get_server_by_id,
     validate_admin_credentials,
     get_admin_session_by_field,
-    get_full_table,
+    get_valid_admin_session,
+    stream_table,
+    count_table,
     create_admin_session,
     remove_admin_session,
     VirtualUsers,
@@ -41,12 +48,69 @@ from db.db import (
     Groups,
     GroupToServer,
     AdminSessions,
+    session_cache,
+    admin_session_cache,
+    acl,
+    sweeper_stats,
+    server_removed_hooks,
 )
-from time import time
+from ssh_pool import transport_pool
+from ssh import invalidate_pkeys, pkey_cache
+from detach import detached_sessions
+from utils.timing import terminal_open_stats
+from db.changes import admin_changes
+from db.env import config
+from db.bulk import IMPORTS, iter_lines, iter_jsonl, iter_csv, run_import
+from db.passwords import PasswordPoolBusy
+
+import json
+
+server_removed_hooks.extend((transport_pool.invalidate, invalidate_pkeys))
 
 app = FastAPI()
 # router = APIRouter(prefix='/admin', tags=['admin'])
 
+# Tables served by /tables/{name}: model, the columns that may be read
+# (never passwords, keys or session cookies) and the prefix-search column.
+ADMIN_TABLES = {
+    "virtual_users": (VirtualUsers, ("id", "username", "domain", "port", "ssh_key_type"), "username"),
+    "sessions": (Sessions, ("id", "user_id", "created_at", "expires_at", "ip"), None),
+    "web_users": (WebUsers, ("id", "username", "group_id"), "username"),
+    "groups": (Groups, ("id", "name"), "name"),
+    "group_to_server": (GroupToServer, ("id", "group_id", "server_id"), None),
+    "admin_sessions": (AdminSessions, ("id", "created_at", "expires_at", "ip"), None),
+}
+
+def row_of(name: str, obj) -> dict:
+    """The readable columns of ``obj``, as the change feed publishes them."""
+    return {col: getattr(obj, col) for col in ADMIN_TABLES[name][1]}
+
+# Bulk removals past this many ids are announced as a reload of the table.
+FEED_DELETE_LIMIT = 100
+
+def publish_deletes(table: str, column: str, ids) -> None:
+    if len(ids) > FEED_DELETE_LIMIT:
+        admin_changes.publish(table, "reload")
+        return
+    for value in ids:
+        admin_changes.publish(table, "delete", where={column: value})
+
+def users_removed(ids: list[int]) -> None:
+    publish_deletes("sessions", "user_id", ids)
+    publish_deletes("web_users", "id", ids)
+
+def groups_removed(ids: list[int]) -> None:
+    publish_deletes("web_users", "group_id", ids)
+    publish_deletes("group_to_server", "group_id", ids)
+    publish_deletes("groups", "id", ids)
+
+def servers_removed(ids: list[int]) -> None:
+    publish_deletes("group_to_server", "server_id", ids)
+    publish_deletes("virtual_users", "id", ids)
+
+def sse(event: str, data: dict, version: int) -> str:
+    return f"id: {admin_changes.epoch}:{version}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
 @app.middleware("http")
 async def admin_auth_middleware(request, call_next):
     current_session = request.cookies.get("admin_session")
@@ -56,8 +120,8 @@ async def admin_auth_middleware(request, call_next):
             content={"detail": "No admin session cookie found"}
         )
     
-    session = await get_admin_session_by_field('session', current_session)
-    if not session or session.expires_at < int(time()):
+    session = await get_valid_admin_session(current_session)
+    if not session:
         return JSONResponse(
             status_code=status.HTTP_401_UNAUTHORIZED,
             content={"detail": "Invalid or expired admin session"}
@@ -77,21 +141,142 @@ def admin_panel(
     )
 
 # Admin API
-@app.get('/view-tables')
-async def view_tables():
+@app.get('/tables/{name}')
+async def view_table(
+    name: str,
+    request: Request,
+    after: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    columns: str = "",
+    prefix: str = "",
+    count: bool = False,
+):
+    """One keyset page of a table, streamed as
+    {"items": [...], "next": <after for the next page>|null, "total": n|null}.
+
+    Any other query parameter named after a readable column filters on
+    equality, e.g. ?server_id=3.  ``total`` is only computed with count=true.
+    """
+    if name not in ADMIN_TABLES:
+        raise HTTPException(status_code=404, detail="Unknown table")
+    table_class, readable, prefix_column = ADMIN_TABLES[name]
+
+    selected = [c for c in columns.split(",") if c] or list(readable)
+    if any(c not in readable for c in selected):
+        raise HTTPException(status_code=400, detail=f"Readable columns: {', '.join(readable)}")
+    if "id" not in selected:
+        selected.insert(0, "id")
+
+    filters = {}
+    for key, value in request.query_params.items():
+        if key in readable:
+            try:
+                filters[key] = table_class.__table__.columns[key].type.python_type(value)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Bad value for {key}")
+    search = (prefix_column, prefix) if prefix and prefix_column else None
+
+    total = await count_table(table_class, filters, search) if count else None
+
+    async def body():
+        yield '{"items":['
+        sent = 0
+        last_id = None
+        async for rows in stream_table(table_class, selected, after, limit, filters, search):
+            chunk = ",".join(json.dumps(row, default=str) for row in rows)
+            yield ("," if sent else "") + chunk
+            sent += len(rows)
+            last_id = rows[-1]["id"]
+        next_after = last_id if sent == limit else None
+        yield f'],"next":{json.dumps(next_after)},"total":{json.dumps(total)}}}'
+
+    return StreamingResponse(body(), media_type="application/json")
+
+@app.get('/changes')
+async def changes_feed(request: Request, since: str = ""):
+    """Server-sent events: "change" for every row-level change made through
+    this API, "reset" when the client has to reload its tables first.
+
+    EventSource resumes by itself through Last-Event-ID; ``since`` takes
+    the same "<epoch>:<version>" value for other clients.
+    """
+    resume = request.headers.get("last-event-id") or since
+
+    async def stream():
+        epoch, _, version = resume.partition(":")
+        events = admin_changes.since(epoch, int(version)) if version.isdigit() else None
+        while True:
+            if events is None:
+                version = admin_changes.version
+                yield sse("reset", {"v": version}, version)
+                events = []
+            for event in events:
+                version = event["v"]
+                yield sse("change", event, version)
+            if not events:
+                yield ": keepalive\n\n"
+            if await request.is_disconnected():
+                return
+            await admin_changes.wait(int(version), 15.0)
+            events = admin_changes.since(admin_changes.epoch, int(version))
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post('/import/{name}')
+async def bulk_import(name: str, request: Request, format: str = ""):
+    """Streams JSON Lines (default) or CSV (format=csv or a text/csv body)
+    rows into web_users, virtual_users, group_to_server, or user_groups
+    (user_id, group_id: moves existing users).  Bad rows are reported by
+    line and skipped; the rest are written.
+    """
+    if name not in IMPORTS:
+        raise HTTPException(status_code=404, detail="Unknown import")
+    if not format:
+        format = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "jsonl"
+    if format not in ("jsonl", "csv"):
+        raise HTTPException(status_code=400, detail="format is jsonl or csv")
+
+    lines = iter_lines(request.stream(), config.IMPORT_MAX_LINE)
+    records = iter_csv(lines) if format == "csv" else iter_jsonl(lines)
+    report = await run_import(name, records)
+    if report.written:
+        # One event instead of one per row: panels reload the table.
+        admin_changes.publish(IMPORTS[name][4], "reload")
+    return report.result()
+
+@app.get('/detached_sessions')
+async def detached_sessions_stats():
+    return detached_sessions.stats()
+
+@app.get('/terminal_open_stats')
+async def terminal_open_timings():
+    return terminal_open_stats.stats()
+
+@app.get('/sweeper_stats')
+async def session_sweeper_stats():
+    return sweeper_stats
+
+@app.get('/cache_stats')
+async def cache_stats():
     return {
-        "virtual_users": await get_full_table(VirtualUsers),
-        "sessions": await get_full_table(Sessions),
-        "web_users": await get_full_table(WebUsers),
-        "groups": await get_full_table(Groups),
-        "group_to_server": await get_full_table(GroupToServer),
-        "admin_sessions": await get_full_table(AdminSessions)
+        "sessions": session_cache.stats(),
+        "admin_sessions": admin_session_cache.stats(),
+        "pkeys": pkey_cache.stats(),
+        "acl": acl.stats(),
     }
 
 @app.post('/add_user')
 async def add_user(user: AddUserSchema):
     # try:
-        user = await db_add_user(username=user.username, password=user.password)
+        try:
+            user = await db_add_user(username=user.username, password=user.password)
+        except PasswordPoolBusy:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Password hashing busy, try again",
+                                headers={"Retry-After": "1"})
+        admin_changes.publish("web_users", "insert", row_of("web_users", user))
         return {"user": user.username, "id": user.id}
     
     # except IntegrityError:
@@ -101,15 +286,27 @@ async def add_user(user: AddUserSchema):
 async def delete_user(id: int):
     try:
         await remove_user(id=id)
+        users_removed([id])
         return {"detail": "User removed successfully"}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete('/remove_users')
+async def delete_users(data: IdsSchema):
+    try:
+        await remove_users(data.ids)
+        users_removed(data.ids)
+        return {"detail": f"{len(data.ids)} users removed"}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post('/add_virtual_user')
 async def add_virtual_user_endpoint(v_user: AddVirtualUserSchema):
     try:
         v_user_result = await add_virtual_user(username=v_user.username, password=v_user.password, ssh_key=v_user.ssh_key, passphrase=v_user.passphrase, ssh_key_type=v_user.ssh_key_type, domain=v_user.domain, port=v_user.port)
+        admin_changes.publish("virtual_users", "insert", row_of("virtual_users", v_user_result))
         return {"virtual_user": v_user_result.username, "id": v_user_result.id}
 
     except IntegrityError:
@@ -119,6 +316,7 @@ async def add_virtual_user_endpoint(v_user: AddVirtualUserSchema):
 async def link_group_to_server_endpoint(link_data: LinkUserToServerSchema):
     try:
         link = await link_group_to_server(group_id=link_data.group_id, server_id=link_data.server_id)
+        admin_changes.publish("group_to_server", "insert", row_of("group_to_server", link))
         return {"detail": f"Group {link.group_id} linked to server {link.server_id}"}
     
     except IntegrityError:
@@ -128,6 +326,7 @@ async def link_group_to_server_endpoint(link_data: LinkUserToServerSchema):
 async def add_group_endpoint(group: AddGroupSchema):
     try:
         group_result = await add_group(name=group.name)
+        admin_changes.publish("groups", "insert", row_of("groups", group_result))
         return {"group": group_result.name, "id": group_result.id}
     
     except IntegrityError:
@@ -137,6 +336,7 @@ async def add_group_endpoint(group: AddGroupSchema):
 async def set_group_for_user_endpoint(data: SetGroupForUserSchema):
     try:
         user = await set_group_for_user(user_id=data.user_id, group_id=data.group_id)
+        admin_changes.publish("web_users", "update", row_of("web_users", user))
         return {"user": user.username, "id": user.id, "group_id": user.group_id}
     
     except Exception as e:
@@ -146,24 +346,53 @@ async def set_group_for_user_endpoint(data: SetGroupForUserSchema):
 async def delete_group(id: int):
     try:
         await remove_group(id=id)
+        groups_removed([id])
         return {"detail": "Group removed successfully"}
+
+    except DefaultGroupRemoval:
+        raise HTTPException(status_code=409, detail="The default group cannot be removed")
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete('/remove_groups')
+async def delete_groups(data: IdsSchema):
+    try:
+        await remove_groups(data.ids)
+        groups_removed(data.ids)
+        return {"detail": f"{len(data.ids)} groups removed"}
+
+    except DefaultGroupRemoval:
+        raise HTTPException(status_code=409, detail="The default group cannot be removed")
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete('/remove_virtual_user/{id}')
 async def delete_virtual_user(id: int):
     try:
         await remove_virtual_user(id=id)
+        servers_removed([id])
         return {"detail": "Virtual user removed successfully"}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete('/remove_virtual_users')
+async def delete_virtual_users(data: IdsSchema):
+    try:
+        await remove_virtual_users(data.ids)
+        servers_removed(data.ids)
+        return {"detail": f"{len(data.ids)} virtual users removed"}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete('/remove_link_user_to_server')
 async def delete_link_user_to_server(link_data: RemoveLinkUserToServerSchema):
     try:
         await remove_link_user_to_server(group_id=link_data.group_id, server_id=link_data.server_id)
+        admin_changes.publish("group_to_server", "delete", where={"group_id": link_data.group_id, "server_id": link_data.server_id})
         return {"detail": "Link removed successfully"}
     
     except Exception as e:
@@ -0,0 +1,285 @@
+"""Bulk imports for the admin API.
+
+The request body is a JSON Lines or CSV stream (CSV: a header row, then
+one record per row; empty fields count as missing).  Rows are parsed and
+validated as they arrive and written IMPORT_BATCH_SIZE at a time, so
+memory stays bounded by one batch whatever the size of the upload.  A row
+that fails validation or a constraint is reported by line number and the
+rest of the import carries on.
+"""
+from typing import AsyncIterator
+from db.env import config
+from db.schemas import ImportUserSchema, ImportVirtualUserSchema, LinkUserToServerSchema, SetGroupForUserSchema
+from db.db import (
+    crypto,
+    import_passwords,
+    insert_rows,
+    update_rows,
+    existing_ids,
+    get_default_group_id,
+    revoke_users_tokens,
+    bump_acl_version,
+    load_acl,
+    acl,
+    WebUsers,
+    Groups,
+    VirtualUsers,
+    GroupToServer,
+)
+from db.passwords import PasswordPoolBusy, is_bcrypt_hash
+
+import asyncio
+import csv
+import json
+import pydantic
+
+
+class ImportReport:
+    def __init__(self, max_errors: int):
+        self.rows = 0
+        self.written = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+        self.max_errors = max_errors
+
+    def fail(self, line: int, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "error": error})
+
+    def result(self) -> dict:
+        return {
+            "rows": self.rows,
+            "written": self.written,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda e: e["line"]),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line: int) -> AsyncIterator[tuple[int, bytes | None]]:
+    """(line number, line) pairs; the line is None when it was too long."""
+    buf = b""
+    lineno = 0
+    skipping = False
+    async for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            lineno += 1
+            if skipping:
+                skipping = False
+                continue
+            yield lineno, line if len(line) <= max_line else None
+        if len(buf) > max_line and not skipping:
+            # Report it now and drop the rest of it as it arrives.
+            skipping = True
+            yield lineno + 1, None
+        if skipping:
+            buf = b""
+    if buf and not skipping:
+        yield lineno + 1, buf if len(buf) <= max_line else None
+
+
+async def iter_jsonl(lines) -> AsyncIterator[tuple[int, dict | str]]:
+    """(line, record) pairs; a str record is the reason the line was rejected."""
+    async for lineno, line in lines:
+        if line is None:
+            yield lineno, "Line too long"
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield lineno, f"Invalid JSON: {e}"
+            continue
+        yield lineno, record if isinstance(record, dict) else "Expected a JSON object"
+
+
+async def iter_csv(lines) -> AsyncIterator[tuple[int, dict | str]]:
+    header = None
+    pending, start = [], 0
+    async for lineno, line in lines:
+        if line is None:
+            pending = []
+            yield lineno, "Line too long"
+            continue
+        try:
+            text = line.decode().rstrip("\r")
+        except UnicodeDecodeError:
+            pending = []
+            yield lineno, "Invalid UTF-8"
+            continue
+        if not pending:
+            start = lineno
+        pending.append(text)
+        record = "\n".join(pending)
+        # An odd number of quotes: a quoted field (an SSH key, say) goes on.
+        if record.count('"') % 2:
+            if len(record) > config.IMPORT_MAX_LINE:
+                pending = []
+                yield start, "Record too long"
+            continue
+        pending = []
+        if not record.strip():
+            continue
+        fields = next(csv.reader([record]))
+        if header is None:
+            header = [f.strip() for f in fields]
+            continue
+        if len(fields) != len(header):
+            yield start, f"Expected {len(header)} fields, got {len(fields)}"
+            continue
+        yield start, {k: v for k, v in zip(header, fields) if v != ""}
+    if pending:
+        yield start, "Unterminated quoted field"
+
+
+def _describe(error: pydantic.ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in e['loc']) or 'row'}: {e['msg']}" for e in error.errors()
+    )
+
+
+async def _check_refs(batch: list, report: ImportReport, refs: list[tuple[str, object]]) -> list:
+    """Drops (and reports) rows whose ``refs`` (field, table) point nowhere."""
+    for field, table_class in refs:
+        wanted = {getattr(row, field) for _, row in batch if getattr(row, field) is not None}
+        found = await existing_ids(table_class, wanted)
+        kept = []
+        for line, row in batch:
+            value = getattr(row, field)
+            if value is not None and value not in found:
+                report.fail(line, f"{field}: {value} does not exist")
+            else:
+                kept.append((line, row))
+        batch = kept
+    return batch
+
+
+async def _prepare_users(batch: list, report: ImportReport) -> list:
+    batch = await _check_refs(batch, report, [("group_id", Groups)])
+    default_group = await get_default_group_id()
+
+    rows, plain = [], []
+    for line, user in batch:
+        if user.password_hash is not None:
+            if not is_bcrypt_hash(user.password_hash):
+                report.fail(line, "password_hash: not a bcrypt hash")
+                continue
+        elif user.password is None:
+            report.fail(line, "password or password_hash is required")
+            continue
+        else:
+            plain.append(len(rows))
+        rows.append((line, {
+            "username": user.username,
+            "password": user.password_hash or user.password,
+            "legacy_session": "",
+            "group_id": user.group_id if user.group_id is not None else default_group,
+        }))
+
+    if plain:
+        try:
+            hashed = await import_passwords.hash_many([rows[i][1]["password"] for i in plain])
+        except PasswordPoolBusy:
+            for i in plain:
+                report.fail(rows[i][0], "Password hash pool busy, retry later")
+            busy = set(plain)
+            return [r for i, r in enumerate(rows) if i not in busy]
+        for i, password_hash in zip(plain, hashed):
+            rows[i][1]["password"] = password_hash
+    return rows
+
+
+def _encrypt_servers(batch: list) -> list:
+    rows = []
+    for line, server in batch:
+        password, ssh_key, passphrase = crypto.encrypt_many(server.password, server.ssh_key, server.passphrase)
+        row = {
+            "username": server.username,
+            "password": password,
+            "ssh_key": ssh_key,
+            "ssh_key_type": server.ssh_key_type,
+            "passphrase": passphrase,
+            "domain": server.domain,
+            "port": server.port,
+        }
+        if server.id is not None:
+            row["id"] = server.id
+        rows.append((line, row))
+    return rows
+
+
+async def _prepare_servers(batch: list, report: ImportReport) -> list:
+    return await asyncio.to_thread(_encrypt_servers, batch)
+
+
+async def _prepare_links(batch: list, report: ImportReport) -> list:
+    batch = await _check_refs(batch, report, [("group_id", Groups), ("server_id", VirtualUsers)])
+    return [(line, {"group_id": link.group_id, "server_id": link.server_id}) for line, link in batch]
+
+
+async def _prepare_user_groups(batch: list, report: ImportReport) -> list:
+    batch = await _check_refs(batch, report, [("user_id", WebUsers), ("group_id", Groups)])
+    # Signed cookies carry the group; make these users log in again.
+    await revoke_users_tokens([data.user_id for _, data in batch])
+    return [(line, {"id": data.user_id, "group_id": data.group_id}) for line, data in batch]
+
+
+# name: (row schema, prepare(batch, report) -> [(line, values)], table, write, table changed)
+IMPORTS = {
+    "web_users": (ImportUserSchema, _prepare_users, WebUsers, insert_rows, "web_users"),
+    "virtual_users": (ImportVirtualUserSchema, _prepare_servers, VirtualUsers, insert_rows, "virtual_users"),
+    "group_to_server": (LinkUserToServerSchema, _prepare_links, GroupToServer, insert_rows, "group_to_server"),
+    "user_groups": (SetGroupForUserSchema, _prepare_user_groups, WebUsers, update_rows, "web_users"),
+}
+
+
+async def run_import(name: str, records: AsyncIterator[tuple[int, dict | str]]) -> ImportReport:
+    schema, prepare, table_class, write, _ = IMPORTS[name]
+    report = ImportReport(config.IMPORT_MAX_ERRORS)
+
+    async def flush(batch: list) -> None:
+        rows = await prepare(batch, report)
+        errors = await write(table_class, [values for _, values in rows])
+        for i, error in errors:
+            report.fail(rows[i][0], error)
+        report.written += len(rows) - len(errors)
+        if table_class is GroupToServer:
+            failed = {i for i, _ in errors}
+            for i, (_, values) in enumerate(rows):
+                if i not in failed:
+                    acl.link(values["group_id"], values["server_id"])
+
+    # One batch is written while the next one is parsed.
+    batch, writing = [], None
+    try:
+        async for line, record in records:
+            report.rows += 1
+            if isinstance(record, str):
+                report.fail(line, record)
+                continue
+            try:
+                batch.append((line, schema.model_validate(record)))
+            except pydantic.ValidationError as e:
+                report.fail(line, _describe(e))
+                continue
+            if len(batch) >= config.IMPORT_BATCH_SIZE:
+                if writing is not None:
+                    await writing
+                writing = asyncio.create_task(flush(batch))
+                batch = []
+    finally:
+        if writing is not None:
+            await writing
+    if batch:
+        await flush(batch)
+
+    if report.written and table_class in (VirtualUsers, GroupToServer):
+        await bump_acl_version()
+        if table_class is VirtualUsers:
+            # Their ids came from the database; links are already in ``acl``.
+            await load_acl()
+    return report
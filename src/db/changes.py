@@ -0,0 +1,60 @@
+from collections import deque
+from db.env import config
+
+import asyncio
+import secrets
+
+
+class ChangeFeed:
+    """Row-level changes made through the admin API, for live admin panels.
+
+    Every event gets the next ``version``.  The last ``history`` events are
+    kept so a client that reconnects can resume from its last version; one
+    that is too far behind, or comes from before a restart (a different
+    ``epoch``), is told to reload instead.  Events are per process.
+    """
+
+    def __init__(self, history: int = 1000):
+        self.epoch = secrets.token_hex(4)
+        self.version = 0
+        self.events: deque[dict] = deque(maxlen=history)
+        self._changed = asyncio.Condition()
+
+    def publish(self, table: str, op: str, row: dict | None = None, where: dict | None = None) -> None:
+        """``op`` is insert, update, delete or reload.  Inserts and updates
+        carry the ``row``; deletes carry ``where``, column values every
+        deleted row matched (``{"id": 3}`` for a single row).  Reload means
+        too many rows changed to send: fetch the table again."""
+        self.version += 1
+        event = {"v": self.version, "table": table, "op": op}
+        if row is not None:
+            event["row"] = row
+        if where is not None:
+            event["where"] = where
+        self.events.append(event)
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    def since(self, epoch: str, version: int) -> list[dict] | None:
+        """Events after ``version``, or None if they can no longer be replayed."""
+        if epoch != self.epoch or version > self.version:
+            return None
+        if version < self.version and (not self.events or self.events[0]["v"] > version + 1):
+            return None
+        return [e for e in self.events if e["v"] > version]
+
+    async def wait(self, version: int, timeout: float) -> None:
+        """Returns once there is an event after ``version``, or on timeout."""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: self.version > version), timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+admin_changes = ChangeFeed(config.ADMIN_FEED_HISTORY)
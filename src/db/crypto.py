@@ -0,0 +1,54 @@
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+
+import asyncio
+import base64
+import hashlib
+
+
+def derive_key(secret: str) -> bytes:
+    return base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest())
+
+
+class CryptoService:
+    """Fernet cipher for the secrets stored on virtual users.
+
+    The key is derived once.  ``secret`` encrypts; ``old_secrets`` are still
+    accepted for decryption so stored values can be re-encrypted under the
+    new key in the background (see ``rotate``).
+    """
+
+    def __init__(self, secret: str, old_secrets: list[str] | None = None):
+        self.primary = Fernet(derive_key(secret))
+        self.fernet = MultiFernet(
+            [self.primary] + [Fernet(derive_key(s)) for s in old_secrets or []]
+        )
+        self.rotating = bool(old_secrets)
+
+    def encrypt(self, string: str) -> str:
+        return self.primary.encrypt(string.encode()).decode()
+
+    def decrypt(self, string: str) -> str:
+        return self.fernet.decrypt(string.encode()).decode()
+
+    def encrypt_many(self, *values: str | None) -> list[str]:
+        return [self.encrypt(v) if v else '' for v in values]
+
+    def decrypt_many(self, *values: str | None) -> list[str | None]:
+        return [self.decrypt(v) if v else None for v in values]
+
+    async def decrypt_fields(self, *values: str | None) -> list[str | None]:
+        """Decrypt several values in one hop off the event loop."""
+        return await asyncio.to_thread(self.decrypt_many, *values)
+
+    async def encrypt_fields(self, *values: str | None) -> list[str]:
+        return await asyncio.to_thread(self.encrypt_many, *values)
+
+    def needs_rotation(self, string: str) -> bool:
+        try:
+            self.primary.decrypt(string.encode())
+            return False
+        except InvalidToken:
+            return True
+
+    def rotate(self, string: str) -> str:
+        return self.fernet.rotate(string.encode()).decode()
@@ -1,14 +1,27 @@
-from sqlalchemy import ForeignKey, exists, select, inspect
+from sqlalchemy import ForeignKey, Index, event, func, select, inspect, insert, update, delete
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from cryptography.fernet import Fernet
+from db.crypto import CryptoService
+from db.tokens import TokenSigner, TokenSession, RevocationList
+from db.acl import AclIndex, ServerInfo
 from db.env import config
-
-import base64
+from db.migrations import run_migrations
+from db.passwords import PasswordHasher
+from utils.cache import TTLCache
+from utils.metrics import db_query_seconds
+from time import time, monotonic
+from dataclasses import dataclass
+
+import asyncio
+import contextvars
+import functools
+import logging
 import uuid
-import hashlib
 import os
 
+log = logging.getLogger(__name__)
+
 DB_DIRECTORY = config.DB_DIRECTORY + '/wst.db'
 
 db_url = {
@@ -16,9 +29,91 @@ db_url = {
     'postgresql': f'postgresql+asyncpg://{config.DB_USER}:{config.DB_PASSWORD}@{config.DB_HOST}:{config.DB_PORT}/{config.DB_NAME}',
 }
 
-encryption_key = config.SECRET
-primary_engine = create_async_engine(db_url[config.DB_TYPE])
+crypto = CryptoService(config.SECRET, [s for s in config.OLD_SECRETS.split(',') if s])
+passwords = PasswordHasher(config.PASSWORD_HASH_ROUNDS, config.PASSWORD_HASH_WORKERS, config.PASSWORD_HASH_QUEUE)
+# Bulk imports hash on their own threads so a large one cannot queue
+# ahead of logins; a few imports may wait their turn, more get row errors.
+import_passwords = PasswordHasher(config.PASSWORD_HASH_ROUNDS, config.IMPORT_HASH_WORKERS,
+                                  4 * config.IMPORT_HASH_WORKERS, name="bcrypt-import")
+
+def sqlite_pragmas(read_only: bool = False) -> list[str]:
+    pragmas = [
+        f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT)}",
+        f"PRAGMA cache_size={int(config.SQLITE_CACHE_SIZE)}",
+        f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}",
+        f"PRAGMA temp_store={config.SQLITE_TEMP_STORE}",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+    return pragmas
+
+def apply_pragmas(engine, pragmas: list[str]) -> None:
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+if config.DB_TYPE == 'sqlite' and config.SQLITE_PROFILE:
+    # SQLite allows one writer at a time: writes queue for the single
+    # writer connection here instead of failing with "database is locked",
+    # while WAL lets the read pool run alongside.
+    primary_engine = create_async_engine(db_url[config.DB_TYPE], pool_size=1, max_overflow=0)
+    read_engine = create_async_engine(
+        db_url[config.DB_TYPE], pool_size=config.SQLITE_READ_POOL_SIZE, max_overflow=0
+    )
+    apply_pragmas(primary_engine, sqlite_pragmas())
+    apply_pragmas(read_engine, sqlite_pragmas(read_only=True))
+else:
+    primary_engine = create_async_engine(db_url[config.DB_TYPE])
+    read_engine = primary_engine
 primary_session = async_sessionmaker(primary_engine, expire_on_commit=False)
+read_session = async_sessionmaker(read_engine, expire_on_commit=False)
+
+# Validated, unexpired sessions by cookie value.  Entries never outlive the
+# session's own expires_at and are dropped as soon as it is removed.
+session_cache = TTLCache(config.SESSION_CACHE_SIZE, config.SESSION_CACHE_TTL)
+admin_session_cache = TTLCache(config.SESSION_CACHE_SIZE, config.SESSION_CACHE_TTL)
+
+# SESSION_MODE=token: user sessions are signed cookies checked without a
+# query; only revocations are stored (and mirrored in memory).
+token_signer = TokenSigner(
+    config.SECRET, config.SESSION_KEY_ID,
+    [k for k in config.SESSION_OLD_KEY_IDS.split(',') if k],
+)
+revocations = RevocationList()
+
+# Which group may open which server, loaded by load_acl() at startup.
+acl = AclIndex()
+
+# Row counts for the admin table API, keyed by table and filters.
+table_count_cache = TTLCache(256, config.ADMIN_COUNT_TTL)
+
+# Totals and the last run of session_sweeper().
+sweeper_stats = {"runs": 0, "rows": 0, "seconds": 0.0, "last_run": None, "last": None,
+                 "errors": 0, "last_error": None}
+
+_timing = contextvars.ContextVar("_timing", default=False)
+
+def timed_query(fn):
+    """Records ``fn``'s latency in wst_db_call_seconds.  Only for functions
+    whose time is spent in the database; a timed function called from
+    another is part of the caller's time and not recorded twice."""
+    timed = db_query_seconds.timed(fn, fn.__name__)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if _timing.get():
+            return await fn(*args, **kwargs)
+        token = _timing.set(True)
+        try:
+            return await timed(*args, **kwargs)
+        finally:
+            _timing.reset(token)
+    return wrapper
 
 async def table_exists(table_name: str) -> bool:
     async with primary_engine.connect() as conn:
@@ -48,21 +143,30 @@ class Sessions(Base):
     __tablename__ = 'sessions'
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey('webusers.id'), nullable=False)
-    session: Mapped[str] = mapped_column(default=lambda: str(uuid.uuid4()))
+    user_id: Mapped[int] = mapped_column(ForeignKey('webusers.id'), nullable=False, index=True)
+    session: Mapped[str] = mapped_column(default=lambda: str(uuid.uuid4()), unique=True, index=True)
     created_at: Mapped[int] = mapped_column()
-    expires_at: Mapped[int] = mapped_column(nullable=False)
+    expires_at: Mapped[int] = mapped_column(nullable=False, index=True)
     ip: Mapped[str] = mapped_column(nullable=True)
 
 class AdminSessions(Base):
     __tablename__ = 'adminsessions'
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    session: Mapped[str] = mapped_column(default=lambda: str(uuid.uuid4()))
+    session: Mapped[str] = mapped_column(default=lambda: str(uuid.uuid4()), unique=True, index=True)
     created_at: Mapped[int] = mapped_column()
-    expires_at: Mapped[int] = mapped_column(nullable=False)
+    expires_at: Mapped[int] = mapped_column(nullable=False, index=True)
     ip: Mapped[str] = mapped_column(nullable=True)
 
+class RevokedTokens(Base):
+    __tablename__ = 'revokedtokens'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    jti: Mapped[str] = mapped_column(nullable=True)
+    user_id: Mapped[int] = mapped_column(nullable=True)
+    revoked_ms: Mapped[int] = mapped_column(nullable=False)
+    expires_at: Mapped[int] = mapped_column(nullable=False, index=True)
+
 class VirtualUsers(Base):
     __tablename__ = 'virtualusers'
 
@@ -77,27 +181,32 @@ class VirtualUsers(Base):
 
 class GroupToServer(Base):
     __tablename__ = 'grouptoservers'
+    __table_args__ = (
+        Index('ux_grouptoservers_group_server', 'group_id', 'server_id', unique=True),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     group_id: Mapped[int] = mapped_column(ForeignKey('groups.id'), nullable=False)
-    server_id: Mapped[int] = mapped_column(ForeignKey('virtualusers.id'), nullable=False)
+    server_id: Mapped[int] = mapped_column(ForeignKey('virtualusers.id'), nullable=False, index=True)
 
-async def encrypt_string(string: str) -> str:
-    key = hashlib.sha256(encryption_key.encode()).digest()
-    key_b64 = base64.urlsafe_b64encode(key)
-    fernet = Fernet(key_b64)
+class AclVersion(Base):
+    __tablename__ = 'aclversion'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(nullable=False, default=0)
 
-    return fernet.encrypt(string.encode()).decode()
+async def encrypt_string(string: str) -> str:
+    return crypto.encrypt(string)
 
 async def decrypt_string(string: str) -> str:
-    key = hashlib.sha256(encryption_key.encode()).digest()
-    key_b64 = base64.urlsafe_b64encode(key)
-    fernet = Fernet(key_b64)
+    return crypto.decrypt(string)
 
-    return fernet.decrypt(string.encode()).decode()
-
-def hex_pswd(pswd: str) -> str:
-    return hashlib.sha256(pswd.encode()).hexdigest()
+async def decrypt_virtual_user(virt_usr: VirtualUsers) -> tuple[str | None, str | None, str | None]:
+    """Password, SSH key and passphrase of ``virt_usr`` in one off-loop call."""
+    password, ssh_key, passphrase = await crypto.decrypt_fields(
+        virt_usr.password, virt_usr.ssh_key, virt_usr.passphrase
+    )
+    return password, ssh_key, passphrase
 
 ###########
 # Setters #
@@ -107,7 +216,7 @@ async def setup():
     async with primary_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
-        await add_group("default")
+    await add_group("default")
 
 async def init_db():
     if config.DB_TYPE == 'sqlite':
@@ -116,8 +225,11 @@ async def init_db():
             os.makedirs(db_dir, exist_ok=True)
     if not await table_exists('sessions'):
         await setup()
+    await run_migrations(primary_engine, Base.metadata)
+    await load_revocations()
 
 async def add_user(username: str, password: str, legacy_session: str = "", group_id: int = None) -> WebUsers:
+    password_hash = await passwords.hash(password)
     async with primary_session() as session:
         if group_id is None:
             result = await session.execute(
@@ -126,16 +238,22 @@ async def add_user(username: str, password: str, legacy_session: str = "", group
             group = result.scalars().first()
             group_id = group.id
 
-        user = WebUsers(username=username, password=hex_pswd(password), legacy_session=legacy_session, group_id=group_id)
+        user = WebUsers(username=username, password=password_hash, legacy_session=legacy_session, group_id=group_id)
         session.add(user)
         await session.commit()
         await session.refresh(user)
 
         return user
 
-async def create_session(user_id: int, created_at: int) -> Sessions:
+async def create_session(user_id: int, created_at: int, group_id: int = None) -> Sessions | TokenSession:
+    expires_at = created_at + 3600 * 24  * 7  # 7 days
+    if config.SESSION_MODE == 'token':
+        return token_signer.issue(user_id, group_id, created_at, expires_at)
+    return await _insert_session(user_id, created_at, expires_at)
+
+@timed_query
+async def _insert_session(user_id: int, created_at: int, expires_at: int) -> Sessions:
     async with primary_session() as session:
-        expires_at = created_at + 3600 * 24  * 7  # 7 days
         sess = Sessions(user_id=user_id, created_at=created_at, expires_at=expires_at)
         session.add(sess)
         await session.commit()
@@ -143,6 +261,7 @@ async def create_session(user_id: int, created_at: int) -> Sessions:
         
         return sess
 
+@timed_query
 async def add_group(name: str) -> Groups:
     async with primary_session() as session:
         group = Groups(name=name)
@@ -154,16 +273,9 @@ async def add_group(name: str) -> Groups:
 
 async def add_virtual_user(username: str, domain: str, password: str = None, 
                            ssh_key: str = None, ssh_key_type: str = None, passphrase: str = None, port: int = 22) -> VirtualUsers:
-    password_encrypted = ''
-    ssh_key_encrypted = ''
-    passphrase_encrypted = ''
-    
-    if password:
-        password_encrypted = await encrypt_string(password)
-    if ssh_key:
-        ssh_key_encrypted = await encrypt_string(ssh_key)
-    if passphrase:
-        passphrase_encrypted = await encrypt_string(passphrase)
+    password_encrypted, ssh_key_encrypted, passphrase_encrypted = await crypto.encrypt_fields(
+        password, ssh_key, passphrase
+    )
 
     async with primary_session() as session:
         user = VirtualUsers(username=username, 
@@ -177,9 +289,14 @@ async def add_virtual_user(username: str, domain: str, password: str = None,
         await session.commit()
         await session.refresh(user)
 
-        return user
+    await bump_acl_version()
+    acl.put_server(ServerInfo(user.id, user.username, user.domain, user.port))
+    return user
 
+@timed_query
 async def set_group_for_user(user_id: int, group_id: int) -> WebUsers:
+    # Signed cookies carry the group; make the user log in again.
+    await revoke_user_tokens(user_id)
     async with primary_session() as session:
         result = await session.execute(
             select(WebUsers).where(WebUsers.id == user_id)
@@ -192,6 +309,7 @@ async def set_group_for_user(user_id: int, group_id: int) -> WebUsers:
 
         return user
 
+@timed_query
 async def link_group_to_server(group_id: int, server_id: int) -> GroupToServer:
     async with primary_session() as session:
         link = GroupToServer(group_id=group_id, server_id=server_id)
@@ -199,8 +317,11 @@ async def link_group_to_server(group_id: int, server_id: int) -> GroupToServer:
         await session.commit()
         await session.refresh(link)
 
-        return link
+    await bump_acl_version()
+    acl.link(group_id, server_id)
+    return link
 
+@timed_query
 async def create_admin_session(created_at: int) -> AdminSessions:
     async with primary_session() as session:
         expires_at = created_at + 3600 * 24 * 7  # 7 days
@@ -211,130 +332,443 @@ async def create_admin_session(created_at: int) -> AdminSessions:
         
         return admin_sess
 
+async def rotate_secrets(batch_size: int = 200) -> int:
+    """Re-encrypt virtual user secrets still under an OLD_SECRETS key.
+
+    Walks the table in id order, one short transaction per batch, and
+    returns the number of rows rewritten.
+    """
+    rotated = 0
+    last_id = 0
+    fields = ('password', 'ssh_key', 'passphrase')
+    while True:
+        # Read and re-encrypt off the writer connection; it is only held
+        # for the UPDATEs of each batch.
+        async with read_session() as session:
+            result = await session.execute(
+                select(VirtualUsers.id, VirtualUsers.password, VirtualUsers.ssh_key, VirtualUsers.passphrase)
+                .where(VirtualUsers.id > last_id)
+                .order_by(VirtualUsers.id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+        if not rows:
+            return rotated
+
+        def rotate_batch():
+            changes = []
+            for row in rows:
+                values = {
+                    field: (getattr(row, field), crypto.rotate(getattr(row, field)))
+                    for field in fields
+                    if getattr(row, field) and crypto.needs_rotation(getattr(row, field))
+                }
+                if values:
+                    changes.append((row.id, values))
+            return changes
+
+        changes = await asyncio.to_thread(rotate_batch)
+        if changes:
+            async with primary_session() as session:
+                for row_id, values in changes:
+                    # A secret changed since it was read is already under
+                    # the current key; leave it.
+                    result = await session.execute(
+                        update(VirtualUsers)
+                        .where(VirtualUsers.id == row_id,
+                               *[getattr(VirtualUsers, field) == old for field, (old, _) in values.items()])
+                        .values(**{field: new for field, (_, new) in values.items()})
+                    )
+                    rotated += result.rowcount
+                await session.commit()
+        last_id = rows[-1].id
+
 ############
 # removers #
 ############
 
-async def remove_session(session_str: str) -> None:
+@timed_query
+async def remove_expired(table_class, batch_size: int = 500) -> int:
+    """Deletes up to ``batch_size`` expired rows of ``table_class``."""
     async with primary_session() as session:
-        result = await session.execute(
-            select(Sessions).where(Sessions.session == session_str)
+        expired = (
+            select(table_class.id)
+            .where(table_class.expires_at < int(time()))
+            .limit(batch_size)
+            .scalar_subquery()
         )
-        sess = result.scalars().first()
+        result = await session.execute(delete(table_class).where(table_class.id.in_(expired)))
+        await session.commit()
+        return result.rowcount
+
+async def sweep_expired_sessions(batch_size: int = 500, pause: float = 0.05) -> dict[str, int]:
+    """Deletes every expired session, admin session and token revocation,
+    one short transaction per batch.  Returns the rows deleted per table."""
+    deleted = {}
+    for table_class in (Sessions, AdminSessions, RevokedTokens):
+        total = 0
+        while True:
+            n = await remove_expired(table_class, batch_size)
+            total += n
+            if n < batch_size:
+                break
+            # Other writers get the database between batches.
+            await asyncio.sleep(pause)
+        deleted[table_class.__tablename__] = total
+    return deleted
+
+async def session_sweeper() -> None:
+    """Runs sweep_expired_sessions every SESSION_SWEEP_INTERVAL seconds
+    until cancelled."""
+    while True:
+        start = monotonic()
+        try:
+            deleted = await sweep_expired_sessions(config.SESSION_SWEEP_BATCH, config.SESSION_SWEEP_PAUSE)
+        except Exception as e:
+            # A locked or briefly unavailable database must not end the
+            # sweeper for the life of the process; try again next interval.
+            log.exception("session sweep failed")
+            sweeper_stats["errors"] += 1
+            sweeper_stats["last_error"] = {"at": int(time()), "error": repr(e)}
+        else:
+            seconds = monotonic() - start
+            sweeper_stats["runs"] += 1
+            sweeper_stats["rows"] += sum(deleted.values())
+            sweeper_stats["seconds"] = round(sweeper_stats["seconds"] + seconds, 3)
+            sweeper_stats["last_run"] = int(time())
+            sweeper_stats["last"] = {"deleted": deleted, "seconds": round(seconds, 3)}
+        await asyncio.sleep(config.SESSION_SWEEP_INTERVAL)
+
+@timed_query
+async def revoke_token(sess: TokenSession) -> None:
+    revocations.tokens[sess.jti] = sess.expires_at
+    async with primary_session() as session:
+        session.add(RevokedTokens(jti=sess.jti, revoked_ms=int(time() * 1000), expires_at=sess.expires_at))
+        await session.commit()
+
+async def revoke_user_tokens(user_id: int) -> None:
+    """Revoke every signed cookie issued to ``user_id`` so far."""
+    await revoke_users_tokens([user_id])
+
+@timed_query
+async def revoke_users_tokens(user_ids: list[int]) -> None:
+    async with primary_session() as session:
+        await _revoke_users_tokens(session, user_ids)
+        await session.commit()
+
+async def _revoke_users_tokens(session, user_ids) -> None:
+    """Adds the revocations to ``session``; the caller commits."""
+    if config.SESSION_MODE != 'token' or not user_ids:
+        return
+    now_ms = int(time() * 1000)
+    ids = set(user_ids)
+    for user_id in ids:
+        revocations.users[user_id] = now_ms
+    session_cache.discard_where(lambda _, sess: sess.user_id in ids)
+    await session.execute(delete(RevokedTokens).where(RevokedTokens.user_id.in_(ids)))
+    # Outlives any token issued before now.
+    expires_at = int(time()) + 3600 * 24 * 7
+    await session.execute(insert(RevokedTokens), [
+        {"user_id": user_id, "revoked_ms": now_ms, "expires_at": expires_at} for user_id in ids
+    ])
+
+@timed_query
+async def remove_session(session_str: str) -> None:
+    session_cache.discard(session_str)
+    if session_str and TokenSigner.looks_like_token(session_str):
+        sess = token_signer.verify(session_str)
         if sess:
-            await session.delete(sess)
-            await session.commit()
+            await revoke_token(sess)
+        return
+    async with primary_session() as session:
+        await session.execute(delete(Sessions).where(Sessions.session == session_str))
+        await session.commit()
 
+@timed_query
 async def remove_admin_session(session_str: str) -> None:
+    admin_session_cache.discard(session_str)
     async with primary_session() as session:
-        result = await session.execute(
-            select(AdminSessions).where(AdminSessions.session == session_str)
-        )
-        admin_sess = result.scalars().first()
-        if admin_sess:
-            await session.delete(admin_sess)
-            await session.commit()
+        await session.execute(delete(AdminSessions).where(AdminSessions.session == session_str))
+        await session.commit()
+
+# The removers below are set-based: one transaction of DELETE ... WHERE
+# statements, nothing loaded first.  Never nest sessions inside them: the
+# writer pool has a single connection.
+
+class DefaultGroupRemoval(Exception):
+    """New users go to the "default" group, so it cannot be removed."""
 
 async def remove_user(id: int) -> None:
+    await remove_users([id])
+
+@timed_query
+async def remove_users(ids: list[int]) -> None:
+    """Users with all their sessions."""
+    ids = set(ids)
+    if not ids:
+        return
     async with primary_session() as session:
-        result = await session.execute(
-            select(Sessions.session).where(Sessions.user_id == id)
-        )
-        await remove_session(result.scalars().first())
-        
-        result = await session.execute(
-            select(WebUsers).where(WebUsers.id == id)
-        )
-        user = result.scalars().first()
-        if user:
-            await session.delete(user)
-            await session.commit()
+        await _revoke_users_tokens(session, ids)
+        await session.execute(delete(Sessions).where(Sessions.user_id.in_(ids)))
+        await session.execute(delete(WebUsers).where(WebUsers.id.in_(ids)))
+        await session.commit()
+    session_cache.discard_where(lambda _, sess: sess.user_id in ids)
+    table_count_cache.clear()
 
 async def remove_group(id: int) -> None:
+    await remove_groups([id])
+
+@timed_query
+async def remove_groups(ids: list[int]) -> None:
+    """Groups with their members (and the members' sessions) and links.
+    Raises DefaultGroupRemoval, removing nothing, if ``ids`` include the
+    default group."""
+    ids = set(ids)
+    if not ids:
+        return
+    members = select(WebUsers.id).where(WebUsers.group_id.in_(ids))
     async with primary_session() as session:
-        result = await session.execute(
-            select(Groups).where(Groups.id == id)
-        )
-        await remove_user(result.scalars().first().id)
+        if await session.scalar(select(Groups.id).where(Groups.name == "default", Groups.id.in_(ids))):
+            raise DefaultGroupRemoval()
+        member_ids = set((await session.execute(members)).scalars().all())
+        await _revoke_users_tokens(session, member_ids)
+        await session.execute(delete(Sessions).where(Sessions.user_id.in_(members)))
+        await session.execute(delete(WebUsers).where(WebUsers.group_id.in_(ids)))
+        await session.execute(delete(GroupToServer).where(GroupToServer.group_id.in_(ids)))
+        await session.execute(delete(Groups).where(Groups.id.in_(ids)))
+        await session.commit()
+    session_cache.discard_where(lambda _, sess: sess.user_id in member_ids)
+    table_count_cache.clear()
 
-        group = result.scalars().first()
-        if group:
-            await session.delete(group)
-            await session.commit()
+    await bump_acl_version()
+    for group_id in ids:
+        acl.drop_group(group_id)
+
+# Called with the id of each removed server, after the commit, so caches
+# kept outside the database (pooled transports, parsed keys) drop it too.
+server_removed_hooks: list = []
 
 async def remove_virtual_user(id: int) -> None:
+    await remove_virtual_users([id])
+
+@timed_query
+async def remove_virtual_users(ids: list[int]) -> None:
+    """Servers with every link to them."""
+    ids = set(ids)
+    if not ids:
+        return
     async with primary_session() as session:
-        result = await session.execute(
-            select(GroupToServer).where(GroupToServer.server_id == id)
-        )
-        links = result.scalars().all()
-        for link in links:
-            await session.delete(link)
-        
-        result = await session.execute(
-            select(VirtualUsers).where(VirtualUsers.id == id)
-        )
-        user = result.scalars().first()
-        if user:
-            await session.delete(user)
-            await session.commit()    
+        await session.execute(delete(GroupToServer).where(GroupToServer.server_id.in_(ids)))
+        await session.execute(delete(VirtualUsers).where(VirtualUsers.id.in_(ids)))
+        await session.commit()
+    table_count_cache.clear()
 
-async def remove_link_user_to_server(user_id: int, server_id: int) -> None:
-    async with primary_session() as session:
-        result = await session.execute(
-            select(GroupToServer).where(GroupToServer.group_id == user_id, GroupToServer.server_id == server_id)
-        )
-        link = result.scalars().first()
-        if link:
-            await session.delete(link)
-            await session.commit()
+    for id in ids:
+        for hook in server_removed_hooks:
+            hook(id)
 
-async def remove_admin_session(session_str: str) -> None:
+    await bump_acl_version()
+    acl.drop_servers(ids)
+
+@timed_query
+async def remove_link_user_to_server(group_id: int, server_id: int) -> None:
     async with primary_session() as session:
-        result = await session.execute(
-            select(AdminSessions).where(AdminSessions.session == session_str)
+        await session.execute(
+            delete(GroupToServer).where(GroupToServer.group_id == group_id, GroupToServer.server_id == server_id)
         )
-        admin_sess = result.scalars().first()
-        if admin_sess:
-            await session.delete(admin_sess)
+        await session.commit()
+    table_count_cache.clear()
+
+    await bump_acl_version()
+    acl.unlink(group_id, server_id)
+
+########
+# Bulk #
+########
+
+@timed_query
+async def insert_rows(table_class, rows: list[dict]) -> list[tuple[int, str]]:
+    """Inserts ``rows`` in one executemany transaction.
+
+    If the batch breaks a constraint it is retried row by row, each in its
+    own transaction, so only the offending rows are lost.  Returns
+    (index in ``rows``, error) for those.
+    """
+    # A Core executemany wants the same keys in every row.
+    by_keys = {}
+    for i, row in enumerate(rows):
+        by_keys.setdefault(tuple(row), []).append(i)
+    errors = []
+    for indexes in by_keys.values():
+        failed = await _write_rows(insert(table_class.__table__), [rows[i] for i in indexes])
+        errors.extend((indexes[i], error) for i, error in failed)
+    return errors
+
+@timed_query
+async def update_rows(table_class, rows: list[dict]) -> list[tuple[int, str]]:
+    """Like insert_rows, for UPDATEs by primary key: every row carries ``id``."""
+    return await _write_rows(update(table_class), rows)
+
+async def _write_rows(stmt, rows: list[dict]) -> list[tuple[int, str]]:
+    if not rows:
+        return []
+    async with primary_session() as session:
+        try:
+            await session.execute(stmt, rows)
             await session.commit()
+            return []
+        except IntegrityError:
+            await session.rollback()
+
+    errors = []
+    for i, row in enumerate(rows):
+        async with primary_session() as session:
+            try:
+                await session.execute(stmt, [row])
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                errors.append((i, str(e.orig)))
+    return errors
+
+@timed_query
+async def existing_ids(table_class, ids: set[int]) -> set[int]:
+    """The subset of ``ids`` present in the table."""
+    found = set()
+    ids = list(ids)
+    async with read_session() as session:
+        # Stay under SQLite's bound parameter limit.
+        for start in range(0, len(ids), 900):
+            result = await session.execute(
+                select(table_class.id).where(table_class.id.in_(ids[start:start + 900]))
+            )
+            found.update(result.scalars().all())
+    return found
+
+@timed_query
+async def get_default_group_id() -> int | None:
+    async with read_session() as session:
+        return await session.scalar(select(Groups.id).where(Groups.name == "default"))
+
+#######
+# ACL #
+#######
+
+@timed_query
+async def load_acl() -> None:
+    # Full scans, so they go through the read pool; one read transaction
+    # keeps the version, links and servers consistent with each other.
+    async with read_session() as session:
+        version = await session.scalar(select(AclVersion.version).where(AclVersion.id == 1))
+        links = (await session.execute(select(GroupToServer.group_id, GroupToServer.server_id))).all()
+        servers = (await session.execute(
+            select(VirtualUsers.id, VirtualUsers.username, VirtualUsers.domain, VirtualUsers.port)
+        )).all()
+    if version is None:
+        async with primary_session() as session:
+            row = await session.get(AclVersion, 1)
+            if row is None:
+                row = AclVersion(id=1, version=0)
+                session.add(row)
+                await session.commit()
+            version = row.version
+    acl.replace(links, [ServerInfo(*row) for row in servers], version)
+    acl.checked_at = monotonic()
+
+@timed_query
+async def bump_acl_version() -> None:
+    """Call after committing a change to links or servers, before applying
+    it to ``acl``."""
+    async with primary_session() as session:
+        await session.execute(update(AclVersion).where(AclVersion.id == 1).values(version=AclVersion.version + 1))
+        version = await session.scalar(select(AclVersion.version).where(AclVersion.id == 1))
+        await session.commit()
+    if version != acl.version + 1:
+        # Another worker changed something since we last looked.
+        await load_acl()
+    else:
+        acl.version = version
+
+async def ensure_acl_fresh() -> None:
+    if monotonic() - acl.checked_at < config.ACL_VERSION_CHECK:
+        return
+    acl.checked_at = monotonic()
+    if await _read_acl_version() != acl.version:
+        await load_acl()
+
+@timed_query
+async def _read_acl_version() -> int | None:
+    async with read_session() as session:
+        return await session.scalar(select(AclVersion.version).where(AclVersion.id == 1))
+
 
 ###########
 # Getters #
 ###########
 
-async def get_full_table(table_class) -> list:
-    async with primary_session() as session:
-        result = await session.execute(
-            select(table_class)
+def _table_filters(table_class, filters: dict | None, prefix: tuple[str, str] | None) -> list:
+    clauses = [getattr(table_class, col) == value for col, value in (filters or {}).items()]
+    if prefix:
+        col, value = prefix
+        clauses.append(getattr(table_class, col).startswith(value, autoescape=True))
+    return clauses
+
+async def stream_table(table_class, columns: list[str], after: int = 0, limit: int = 100,
+                       filters: dict = None, prefix: tuple[str, str] = None, batch: int = 200):
+    """Yields lists of up to ``batch`` rows (as dicts of ``columns``) with
+    id > ``after`` in id order, straight off the cursor."""
+    stmt = (
+        select(*[getattr(table_class, col) for col in columns])
+        .where(table_class.id > after, *_table_filters(table_class, filters, prefix))
+        .order_by(table_class.id)
+        .limit(limit)
+    )
+    async with read_session() as session:
+        result = await session.stream(stmt)
+        async for rows in result.mappings().partitions(batch):
+            yield [dict(row) for row in rows]
+
+async def count_table(table_class, filters: dict = None, prefix: tuple[str, str] = None) -> int:
+    """Row count, reused for ADMIN_COUNT_TTL seconds per table and filters."""
+    key = (table_class.__tablename__, tuple(sorted((filters or {}).items())), prefix)
+    total = table_count_cache.get(key)
+    if total is None:
+        total = await _count_rows(table_class, filters, prefix)
+        table_count_cache.set(key, total)
+    return total
+
+@timed_query
+async def _count_rows(table_class, filters: dict | None, prefix: tuple[str, str] | None) -> int:
+    async with read_session() as session:
+        return await session.scalar(
+            select(func.count()).select_from(table_class)
+            .where(*_table_filters(table_class, filters, prefix))
         )
-        objects = result.scalars().all()
-        
-        return [
-            {col.name: getattr(obj, col.name) for col in table_class.__table__.columns}
-            for obj in objects
-        ]
 
+@timed_query
 async def get_server_by_id(server_id: int) -> VirtualUsers | None:
-    async with primary_session() as session:
+    async with read_session() as session:
         result = await session.execute(
             select(VirtualUsers).where(VirtualUsers.id == server_id)
         )
         return result.scalars().first()
 
+@timed_query
 async def get_session_by_field(field: str, value) -> Sessions | None:
-    async with primary_session() as session:
+    async with read_session() as session:
         stmt = select(Sessions).where(getattr(Sessions, field) == value)
         result = await session.execute(stmt)
         sess = result.scalars().first()
         return sess
 
-async def get_servers_by_user_id(user_id: int) -> list[VirtualUsers]:
-    async with primary_session() as session:
-        result = await session.execute(
-            select(VirtualUsers).join(GroupToServer).where(GroupToServer.group_id == user_id)
-        )
-        return result.scalars().all()
+async def get_servers_by_group_id(group_id: int) -> list[ServerInfo]:
+    await ensure_acl_fresh()
+    return acl.servers_for_group(group_id)
+
+async def get_servers_page(group_id: int, after: int = 0, limit: int = 50,
+                           q: str = "", prefix: bool = False) -> tuple[list[ServerInfo], int | None]:
+    await ensure_acl_fresh()
+    return acl.page(group_id, after, limit, q, prefix)
 
 async def get_session_by_session_str(session_str: str) -> Sessions | None:
     return await get_session_by_field("session", session_str)
@@ -342,32 +776,36 @@ async def get_session_by_session_str(session_str: str) -> Sessions | None:
 async def get_session_by_user_id(user_id: int) -> Sessions | None:
     return await get_session_by_field("user_id", user_id)
 
+@timed_query
 async def get_user_by_username(username: str) -> WebUsers | None:
-    async with primary_session() as session:
+    async with read_session() as session:
         result = await session.execute(
             select(WebUsers).where(WebUsers.username == username)
         )
         
         return result.scalars().first()
 
+@timed_query
 async def get_user_by_id(user_id: int) -> WebUsers | None:
-    async with primary_session() as session:
+    async with read_session() as session:
         result = await session.execute(
             select(WebUsers).where(WebUsers.id == user_id)
         )
         
         return result.scalars().first()
 
+@timed_query
 async def get_virtual_user_by_id(virtual_user_id: int) -> VirtualUsers | None:
-    async with primary_session() as session:
+    async with read_session() as session:
         result = await session.execute(
             select(VirtualUsers).where(VirtualUsers.id == virtual_user_id)
         )
         
         return result.scalars().first()
     
+@timed_query
 async def get_group_by_user_id(user_id: int) -> Groups | None:
-    async with primary_session() as session:
+    async with read_session() as session:
         result = await session.execute(
             select(WebUsers).where(WebUsers.id == user_id)
         )
@@ -377,8 +815,9 @@ async def get_group_by_user_id(user_id: int) -> Groups | None:
 
         return user.group_id
 
+@timed_query
 async def get_admin_session_by_field(field: str, value) -> AdminSessions | None:
-    async with primary_session() as session:
+    async with read_session() as session:
         stmt = select(AdminSessions).where(getattr(AdminSessions, field) == value)
         result = await session.execute(stmt)
         admin_sess = result.scalars().first()
@@ -387,29 +826,176 @@ async def get_admin_session_by_field(field: str, value) -> AdminSessions | None:
 async def get_admin_session_by_session_str(session_str: str) -> AdminSessions | None:
     return await get_admin_session_by_field("session", session_str)
 
+@timed_query
+async def load_revocations() -> None:
+    now = int(time())
+    async with read_session() as session:
+        result = await session.execute(
+            select(RevokedTokens.jti, RevokedTokens.user_id, RevokedTokens.revoked_ms, RevokedTokens.expires_at)
+            .where(RevokedTokens.expires_at >= now)
+        )
+        rows = result.all()
+    revocations.tokens = {row.jti: row.expires_at for row in rows if row.jti}
+    revocations.users = {row.user_id: row.revoked_ms for row in rows if row.user_id is not None}
+    revocations.loaded_at = monotonic()
+
+async def get_token_session(token: str) -> TokenSession | None:
+    sess = token_signer.verify(token)
+    if sess is None:
+        return None
+    # Other workers revoke too; pick their revocations up periodically.
+    if monotonic() - revocations.loaded_at > config.TOKEN_REVOCATION_REFRESH:
+        revocations.loaded_at = monotonic()  # one reload, not one per request
+        await load_revocations()
+    if revocations.is_revoked(sess):
+        return None
+    return sess
+
+async def get_valid_session(session_str: str | None) -> Sessions | TokenSession | None:
+    """The unexpired session for a cookie value, served from session_cache
+    when possible."""
+    if not session_str:
+        return None
+    if TokenSigner.looks_like_token(session_str):
+        return await get_token_session(session_str)
+    now = int(time())
+    sess = session_cache.get(session_str)
+    if sess is None:
+        sess = await get_session_by_session_str(session_str)
+        if not sess or sess.expires_at < now:
+            return None
+        session_cache.set(session_str, sess, ttl=sess.expires_at - now)
+    elif sess.expires_at < now:
+        session_cache.discard(session_str)
+        return None
+    return sess
+
+async def get_valid_admin_session(session_str: str | None) -> AdminSessions | None:
+    if not session_str:
+        return None
+    now = int(time())
+    admin_sess = admin_session_cache.get(session_str)
+    if admin_sess is None:
+        admin_sess = await get_admin_session_by_session_str(session_str)
+        if not admin_sess or admin_sess.expires_at < now:
+            return None
+        admin_session_cache.set(session_str, admin_sess, ttl=admin_sess.expires_at - now)
+    elif admin_sess.expires_at < now:
+        admin_session_cache.discard(session_str)
+        return None
+    return admin_sess
+
+# Reasons check_terminal_access refuses a terminal, used as close reasons.
+ACCESS_NO_SERVER = "Virtual user not found"
+ACCESS_NO_SESSION = "Invalid session"
+ACCESS_EXPIRED = "Session expired"
+ACCESS_NO_USER = "User not found"
+ACCESS_DENIED = "Access denied"
+
+@dataclass
+class TerminalAccess:
+    virtual_user: VirtualUsers | None = None
+    user_id: int | None = None
+    denied: str | None = None  # one of the ACCESS_* reasons
+
+@timed_query
+async def check_terminal_access(virtual_user_id: int, session_str: str = None,
+                                user_id: int = None) -> TerminalAccess:
+    """Resolves cookie -> session -> user -> group -> link -> virtual user
+    in one query.
+
+    Pass ``user_id`` instead of ``session_str`` for a session that was
+    validated already.  Cached and signed-token sessions are resolved in
+    memory and only the rest of the chain is queried; a signed token also
+    carries the group, leaving just the server to load.
+    """
+    now = int(time())
+    if session_str is not None:
+        if TokenSigner.looks_like_token(session_str):
+            sess = await get_token_session(session_str)
+            if sess is None:
+                return TerminalAccess(denied=ACCESS_NO_SESSION)
+            if sess.group_id is not None:
+                return await _token_terminal_access(virtual_user_id, sess)
+        else:
+            sess = session_cache.get(session_str)
+        if sess is not None:
+            if sess.expires_at < now:
+                session_cache.discard(session_str)
+                return TerminalAccess(denied=ACCESS_EXPIRED)
+            user_id = sess.user_id
+
+    stmt = select(VirtualUsers, WebUsers.id, WebUsers.group_id).select_from(VirtualUsers)
+    if user_id is None:
+        stmt = stmt.add_columns(Sessions).outerjoin(Sessions, Sessions.session == session_str)
+        user_on = WebUsers.id == Sessions.user_id
+    else:
+        user_on = WebUsers.id == user_id
+    stmt = (
+        stmt.outerjoin(WebUsers, user_on)
+        .where(VirtualUsers.id == virtual_user_id)
+        .limit(1)
+    )
+    async with read_session() as session:
+        row = (await session.execute(stmt)).first()
+
+    if row is None:
+        return TerminalAccess(denied=ACCESS_NO_SERVER)
+    virt_usr, found_user_id, group_id = row[0], row[1], row[2]
+
+    if user_id is None:
+        sess = row[3]
+        if sess is None:
+            return TerminalAccess(denied=ACCESS_NO_SESSION)
+        if sess.expires_at < now:
+            return TerminalAccess(denied=ACCESS_EXPIRED)
+        session_cache.set(session_str, sess, ttl=sess.expires_at - now)
+    if found_user_id is None:
+        return TerminalAccess(denied=ACCESS_NO_USER)
+    if not await is_group_linked(group_id, virtual_user_id):
+        return TerminalAccess(denied=ACCESS_DENIED)
+    return TerminalAccess(virtual_user=virt_usr, user_id=found_user_id)
+
+async def _token_terminal_access(virtual_user_id: int, sess: TokenSession) -> TerminalAccess:
+    # The group is signed into the cookie, and removing the user or moving
+    # it to another group revokes the cookie, so only the server is loaded.
+    virt_usr = await get_virtual_user_by_id(virtual_user_id)
+    if virt_usr is None:
+        return TerminalAccess(denied=ACCESS_NO_SERVER)
+    if not await is_group_linked(sess.group_id, virtual_user_id):
+        return TerminalAccess(denied=ACCESS_DENIED)
+    return TerminalAccess(virtual_user=virt_usr, user_id=sess.user_id)
+
 #############
 # Validator #
 #############
 
-async def validate_credentials(username: str, password: str) -> bool:
-    async with primary_session() as session:
-        result = await session.execute(
-            select(WebUsers).where(WebUsers.username == username, WebUsers.password == hex_pswd(password))
-        )
+async def authenticate(username: str, password: str) -> WebUsers | None:
+    """The user if ``password`` is right, with one lookup.  Legacy SHA-256
+    hashes are replaced with bcrypt on the way."""
+    user = await get_user_by_username(username)
+    if not user:
+        await passwords.verify_missing(password)
+        return None
+    ok, rehash = await passwords.verify(password, user.password)
+    if not ok:
+        return None
+    if rehash:
+        user.password = await passwords.hash(password)
+        async with primary_session() as session:
+            await session.execute(
+                update(WebUsers).where(WebUsers.id == user.id).values(password=user.password)
+            )
+            await session.commit()
+    return user
 
-        user = result.scalars().first()
-        if user:
-            return True
-        return False
+async def validate_credentials(username: str, password: str) -> bool:
+    return await authenticate(username, password) is not None
 
 async def validate_admin_credentials(password: str) -> bool:
     """Validates admin password against config.ADMIN_PASSWORD without hashing"""
     return password == config.ADMIN_PASSWORD
 
 async def is_group_linked(group_id: int, virtual_user_id: int) -> bool:
-    async with primary_session() as session:
-        result = await session.execute(
-            select(exists().where(GroupToServer.group_id == group_id, GroupToServer.server_id == virtual_user_id))
-        )
-        
-        return result.scalar()
+    await ensure_acl_fresh()
+    return acl.is_linked(group_id, virtual_user_id)
@@ -3,6 +3,7 @@ import pydantic_settings
 
 class Config(pydantic_settings.BaseSettings):
     SECRET: str = 'WSTestSecretKey'
+    OLD_SECRETS: str = ''  # comma-separated, still accepted for decryption
     ADMIN_PASSWORD: str = 'WSTestAdminPass'
     PORT: int = 2280
     DB_DIRECTORY: str = 'database/wst.db'
@@ -12,6 +13,71 @@ class Config(pydantic_settings.BaseSettings):
     DB_NAME: str = 'wstdb'
     DB_USER: str = 'wstuser'
     DB_PASSWORD: str = 'wstpass'
+    TERM_RECV_MIN: int = 1024
+    TERM_RECV_MAX: int = 32768
+    TERM_COALESCE_BYTES: int = 65536  # 0 disables output coalescing
+    TERM_COALESCE_WINDOW_MS: float = 3.0
+    TERM_SESSION_BUFFER_BYTES: int = 1048576
+    TERM_GLOBAL_BUFFER_BYTES: int = 67108864
+    TERM_SLOW_CLIENT_TIMEOUT: float = 30.0
+    TERM_SLOW_CLIENT_POLICY: str = 'pause'  # pause | drop | disconnect
+    TERM_INPUT_BUFFER_BYTES: int = 1048576
+    SSH_CONNECT_TIMEOUT: float = 120.0
+    SSH_KEEPALIVE: int = 30
+    TERM_POOL_IDLE_TTL: float = 300.0
+    TERM_POOL_MAX_IDLE: int = 64
+    TERM_POOL_MAX_CHANNELS: int = 8
+    TERM_SCROLLBACK_BYTES: int = 262144
+    TERM_DETACH_TTL: float = 600.0  # 0 closes the shell as soon as the socket drops
+    TERM_DETACH_MAX: int = 256
+    TERM_SCREEN_FPS: float = 20.0
+    TERM_SCREEN_PARSE_BYTES: int = 8192  # per frame interval and session
+    TERM_MUX_WINDOW: int = 262144
+    TERM_MUX_MAX_CHANNELS: int = 64  # per /ws/mux socket
+    TERM_MUX_INPUT_WINDOW: int = 65536  # input bytes a channel may have in flight
+    # Login attempts: token buckets per client IP and per username.
+    LOGIN_IP_RATE: float = 30.0  # per minute
+    LOGIN_IP_BURST: int = 10
+    LOGIN_USER_RATE: float = 10.0  # per minute
+    LOGIN_USER_BURST: int = 5
+    RATE_LIMIT_MAX_KEYS: int = 100000
+    # Reverse proxies (IPs or CIDRs, comma-separated) whose forwarded
+    # header names the client.  Empty: the limiter keys on the peer address
+    # (which uvicorn already rewrites for proxies in --forwarded-allow-ips).
+    TRUSTED_PROXIES: str = ''
+    FORWARDED_FOR_HEADER: str = 'X-Forwarded-For'
+    PASSWORD_HASH_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE: int = 64  # logins waiting beyond this get a 503
+    IMPORT_HASH_WORKERS: int = 1  # bcrypt threads for plaintext passwords in imports, apart from logins
+    SESSION_MODE: str = 'db'  # db | token (signed stateless cookies)
+    SESSION_KEY_ID: str = '1'
+    SESSION_OLD_KEY_IDS: str = ''  # comma-separated, still accepted
+    TOKEN_REVOCATION_REFRESH: float = 30.0
+    # SQLite only: PRAGMAs for every new connection, and a single writer
+    # connection next to a pool of read-only ones for the getters.
+    SQLITE_PROFILE: bool = True
+    SQLITE_JOURNAL_MODE: str = 'WAL'
+    SQLITE_SYNCHRONOUS: str = 'NORMAL'
+    SQLITE_BUSY_TIMEOUT: int = 5000  # ms
+    SQLITE_CACHE_SIZE: int = -65536  # negative: KiB
+    SQLITE_MMAP_SIZE: int = 268435456
+    SQLITE_TEMP_STORE: str = 'MEMORY'
+    SQLITE_READ_POOL_SIZE: int = 8
+    SESSION_SWEEP_INTERVAL: float = 300.0  # seconds; 0 disables the sweeper
+    SESSION_SWEEP_BATCH: int = 500
+    SESSION_SWEEP_PAUSE: float = 0.05  # between batches, lets writers in
+    ADMIN_FEED_HISTORY: int = 1000  # change events kept for resuming clients
+    ADMIN_COUNT_TTL: float = 5.0  # seconds a table count is reused
+    IMPORT_BATCH_SIZE: int = 1000  # rows per insert transaction
+    IMPORT_MAX_LINE: int = 65536  # bytes; longer lines are rejected
+    IMPORT_MAX_ERRORS: int = 1000  # row errors listed in the response
+    ACL_VERSION_CHECK: float = 2.0  # seconds between staleness checks
+    METRICS_TOKEN: str = ''  # /metrics wants "Authorization: Bearer <token>"; unset, an admin session
+    SESSION_CACHE_SIZE: int = 10000
+    SESSION_CACHE_TTL: float = 300.0
+    PKEY_CACHE_SIZE: int = 256
+    PKEY_CACHE_TTL: float = 3600.0
 
     class Config:
         env_file = '.env'
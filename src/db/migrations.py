@@ -0,0 +1,73 @@
+"""Versioned schema migrations, applied in order by init_db at startup.
+
+The schemaversion table holds the number of the last migration applied.
+A fresh database is created from the current models and then runs every
+migration too, so each one must be a no-op against a schema that already
+has its change (IF NOT EXISTS, checkfirst and the like).
+
+To change the schema of a live database, append a new migration; never
+edit one that has shipped.
+"""
+from sqlalchemy import MetaData, text
+
+
+def _create_missing_tables(conn, metadata: MetaData) -> None:
+    # revokedtokens and aclversion were added after the first release.
+    metadata.create_all(conn)
+
+
+def _lookup_indexes(conn, metadata: MetaData) -> None:
+    # Duplicate links would block the unique index; keep the oldest.
+    conn.execute(text(
+        "DELETE FROM grouptoservers WHERE id NOT IN "
+        "(SELECT MIN(id) FROM grouptoservers GROUP BY group_id, server_id)"
+    ))
+    for statement in (
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_sessions_session ON sessions (session)",
+        "CREATE INDEX IF NOT EXISTS ix_sessions_user_id ON sessions (user_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_adminsessions_session ON adminsessions (session)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_grouptoservers_group_server ON grouptoservers (group_id, server_id)",
+        "CREATE INDEX IF NOT EXISTS ix_grouptoservers_server_id ON grouptoservers (server_id)",
+    ):
+        conn.execute(text(statement))
+
+
+def _expiry_indexes(conn, metadata: MetaData) -> None:
+    # For the expired-session sweeper.
+    for table in ("sessions", "adminsessions", "revokedtokens"):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_expires_at ON {table} (expires_at)"))
+
+
+MIGRATIONS = [
+    (1, "create missing tables", _create_missing_tables),
+    (2, "lookup indexes", _lookup_indexes),
+    (3, "expiry indexes", _expiry_indexes),
+]
+
+
+def _current_version(conn) -> int:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schemaversion (version INTEGER NOT NULL)"))
+    version = conn.execute(text("SELECT version FROM schemaversion")).scalar()
+    if version is None:
+        conn.execute(text("INSERT INTO schemaversion (version) VALUES (0)"))
+        return 0
+    return version
+
+
+async def run_migrations(engine, metadata: MetaData) -> list[str]:
+    """Applies pending migrations, each in its own transaction.
+
+    Returns the names of the migrations applied.
+    """
+    async with engine.begin() as conn:
+        version = await conn.run_sync(_current_version)
+
+    applied = []
+    for number, name, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        async with engine.begin() as conn:
+            await conn.run_sync(migrate, metadata)
+            await conn.execute(text("UPDATE schemaversion SET version = :v"), {"v": number})
+        applied.append(name)
+    return applied
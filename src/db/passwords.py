@@ -0,0 +1,92 @@
+from utils.metrics import TrackedExecutor
+
+import asyncio
+import bcrypt
+import hashlib
+import hmac
+import re
+import secrets
+
+
+class PasswordPoolBusy(Exception):
+    """More logins are waiting for the hash pool than it may queue."""
+
+
+BCRYPT_HASH = re.compile(r"\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}")
+
+
+def is_bcrypt_hash(value: str) -> bool:
+    return BCRYPT_HASH.fullmatch(value) is not None
+
+
+def _is_legacy(stored: str) -> bool:
+    # Before bcrypt, passwords were stored as unsalted SHA-256 hex.
+    return not stored.startswith("$2")
+
+
+class PasswordHasher:
+    """bcrypt on a small dedicated thread pool.
+
+    bcrypt releases the GIL, so hashing never blocks the event loop, and
+    with at most ``workers`` hashes running and ``queue`` more waiting a
+    login flood cannot take more than those threads from terminal traffic.
+    """
+
+    def __init__(self, rounds: int = 12, workers: int = 2, queue: int = 64, name: str = "bcrypt"):
+        self.rounds = rounds
+        self.workers = workers
+        self.limit = workers + queue
+        self.pending = 0
+        self._dummy: str | None = None
+        self.executor = TrackedExecutor(workers, thread_name_prefix=name)
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.limit:
+            raise PasswordPoolBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def _hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(self.rounds)).decode()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._hash, password)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        """For bulk imports: one slice per worker, so a big batch takes
+        ``workers`` queue slots instead of one per password."""
+        size = -(-len(passwords) // self.workers) or 1
+        slices = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        hashed = await asyncio.gather(*(
+            self._run(lambda chunk: [self._hash(p) for p in chunk], chunk) for chunk in slices
+        ))
+        return [h for chunk in hashed for h in chunk]
+
+    async def verify(self, password: str, stored: str) -> tuple[bool, bool]:
+        """Whether ``password`` matches ``stored`` and whether ``stored``
+        should be rehashed (a legacy hash or fewer rounds than configured)."""
+        if _is_legacy(stored):
+            legacy = hashlib.sha256(password.encode()).hexdigest()
+            ok = hmac.compare_digest(legacy.encode(), stored.encode())
+            return ok, ok
+        if not is_bcrypt_hash(stored):
+            # A corrupt or hand-imported value: no password matches it.
+            return False, False
+        try:
+            ok = await self._run(bcrypt.checkpw, password.encode(), stored.encode())
+        except ValueError:
+            return False, False
+        return ok, ok and int(stored.split("$")[2]) < self.rounds
+
+    async def verify_missing(self, password: str) -> None:
+        """Costs what verify() does, for a username that does not exist, so
+        response times do not tell which usernames do."""
+        if self._dummy is None:
+            self._dummy = await self._run(self._hash, secrets.token_urlsafe())
+        await self._run(bcrypt.checkpw, password.encode(), self._dummy.encode())
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "limit": self.limit}
@@ -14,6 +14,15 @@ class AddVirtualUserSchema(pydantic.BaseModel):
     domain: str
     port: int = 22
 
+class ImportUserSchema(pydantic.BaseModel):
+    username: str
+    password: str = None
+    password_hash: str = None  # bcrypt, stored as is
+    group_id: int = None
+
+class ImportVirtualUserSchema(AddVirtualUserSchema):
+    id: int = None
+
 class AddGroupSchema(pydantic.BaseModel):
     name: str
 
@@ -42,3 +51,6 @@ class IsAccountLinkedSchema(pydantic.BaseModel):
 
 class useUserId(pydantic.BaseModel):
     id: int
+
+class IdsSchema(pydantic.BaseModel):
+    ids: list[int]
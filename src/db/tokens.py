@@ -0,0 +1,110 @@
+from dataclasses import dataclass
+from time import time
+
+import base64
+import hashlib
+import hmac
+import json
+import uuid
+
+
+@dataclass
+class TokenSession:
+    """Quacks like a Sessions row for the code that validates cookies."""
+
+    session: str
+    user_id: int
+    group_id: int | None
+    created_at: int
+    expires_at: int
+    jti: str
+    issued_ms: int
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class TokenSigner:
+    """HMAC-SHA256 signed session cookies: ``v1.<kid>.<payload>.<signature>``.
+
+    Each key id gets its own key derived from SECRET, so retiring a key id
+    (dropping it from the accepted list) invalidates every token signed
+    with it.
+    """
+
+    PREFIX = "v1"
+
+    def __init__(self, secret: str, key_id: str, old_key_ids: list[str] | None = None):
+        self.key_id = key_id
+        self._keys = {
+            kid: hmac.new(secret.encode(), f"wst-session/{kid}".encode(), hashlib.sha256).digest()
+            for kid in [key_id] + (old_key_ids or [])
+        }
+
+    @classmethod
+    def looks_like_token(cls, value: str) -> bool:
+        return value.startswith(cls.PREFIX + ".")
+
+    def issue(self, user_id: int, group_id: int | None, created_at: int, expires_at: int) -> TokenSession:
+        jti = uuid.uuid4().hex
+        issued_ms = int(time() * 1000)
+        payload = _b64encode(json.dumps(
+            {"u": user_id, "g": group_id, "c": created_at, "e": expires_at, "j": jti, "i": issued_ms},
+            separators=(",", ":"),
+        ).encode())
+        signed = f"{self.PREFIX}.{self.key_id}.{payload}"
+        token = f"{signed}.{self._sign(self.key_id, signed)}"
+        return TokenSession(token, user_id, group_id, created_at, expires_at, jti, issued_ms)
+
+    def verify(self, token: str) -> TokenSession | None:
+        """Signature and expiry check only; revocation is the caller's job."""
+        try:
+            prefix, kid, payload, signature = token.split(".")
+        except ValueError:
+            return None
+        if prefix != self.PREFIX or kid not in self._keys:
+            return None
+        # As bytes: compare_digest refuses non-ASCII str, and cookies are
+        # whatever the client sends.
+        expected = self._sign(kid, f"{prefix}.{kid}.{payload}")
+        if not hmac.compare_digest(signature.encode(), expected.encode()):
+            return None
+
+        try:
+            claims = json.loads(_b64decode(payload))
+            sess = TokenSession(
+                token, int(claims["u"]), claims["g"], int(claims["c"]),
+                int(claims["e"]), claims["j"], int(claims["i"]),
+            )
+        except (ValueError, KeyError, TypeError):
+            return None
+        if sess.expires_at < int(time()):
+            return None
+        return sess
+
+    def _sign(self, kid: str, signed: str) -> str:
+        return _b64encode(hmac.new(self._keys[kid], signed.encode(), hashlib.sha256).digest())
+
+
+class RevocationList:
+    """In-memory copy of the revokedtokens table.
+
+    Holds single revoked token ids (logout) and per-user cut-offs: every
+    token a user was issued before the cut-off is revoked (user removed or
+    moved to another group).
+    """
+
+    def __init__(self):
+        self.tokens: dict[str, int] = {}
+        self.users: dict[int, int] = {}
+        self.loaded_at = 0.0
+
+    def is_revoked(self, sess: TokenSession) -> bool:
+        if sess.jti in self.tokens:
+            return True
+        return sess.issued_ms <= self.users.get(sess.user_id, -1)
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from db.env import config
+
+import asyncio
+
+
+class RingBuffer:
+    """Byte buffer that keeps the most recent ``capacity`` bytes.
+
+    The storage grows with the output until it first reaches ``capacity``
+    and then wraps in place, so a quiet session costs only what it printed
+    and a busy one never more than its capacity.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buf = bytearray()
+        self._pos = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def write(self, data: bytes) -> None:
+        n = len(data)
+        if not n or not self.capacity:
+            return
+        if n >= self.capacity:
+            self._buf[:] = memoryview(data)[n - self.capacity:]
+            self._pos = 0
+            self._size = self.capacity
+            return
+        if self._size < self.capacity:
+            # Still filling: append, and on overflow keep the newest bytes,
+            # which leaves exactly ``capacity`` of them with the oldest first.
+            self._buf += data
+            if len(self._buf) > self.capacity:
+                del self._buf[:len(self._buf) - self.capacity]
+            self._size = len(self._buf)
+            self._pos = self._size % self.capacity
+            return
+
+        end = self._pos + n
+        if end <= self.capacity:
+            self._buf[self._pos:end] = data
+        else:
+            first = self.capacity - self._pos
+            view = memoryview(data)
+            self._buf[self._pos:] = view[:first]
+            self._buf[:n - first] = view[first:]
+        self._pos = end % self.capacity
+        self._size = min(self._size + n, self.capacity)
+
+    def getvalue(self) -> bytes:
+        if self._size < self.capacity:
+            return bytes(self._buf[:self._pos])
+        return bytes(self._buf[self._pos:]) + bytes(self._buf[:self._pos])
+
+
+class DetachedSessions:
+    """SSH sessions whose browser went away but whose shell is kept running.
+
+    A detached session keeps reading its channel into its scrollback ring
+    for TERM_DETACH_TTL seconds, waiting for a browser to come back with
+    the session token.  At most TERM_DETACH_MAX sessions are held; the
+    oldest is closed to make room.
+    """
+
+    def __init__(self):
+        self._sessions: OrderedDict[str, tuple] = OrderedDict()
+
+    def detach(self, session) -> bool:
+        """Take over ``session`` after its WebSocket closed.
+
+        Returns False when the session should just be closed instead
+        (detaching disabled, or the shell already exited).
+        """
+        if config.TERM_DETACH_TTL <= 0 or session.stop_event.is_set():
+            return False
+
+        session.detach()
+        loop = asyncio.get_running_loop()
+        timer = loop.call_later(config.TERM_DETACH_TTL, self._expire, session.token)
+        session.on_eof = lambda: self._expire(session.token)
+        self._sessions[session.token] = (session, timer)
+
+        while len(self._sessions) > config.TERM_DETACH_MAX:
+            oldest = next(iter(self._sessions))
+            self._expire(oldest)
+        return True
+
+    def reattach(self, token: str, owner_id: int, virtual_user_id: int, ws):
+        entry = self._sessions.get(token)
+        if entry is None:
+            return None
+        session, timer = entry
+        if session.owner_id != owner_id or session.virtual_user_id != virtual_user_id:
+            return None
+
+        del self._sessions[token]
+        timer.cancel()
+        session.on_eof = None
+        session.reattach(ws)
+        return session
+
+    def stats(self) -> dict:
+        return {
+            "detached_sessions": len(self._sessions),
+            "scrollback_bytes": sum(s.scrollback.capacity for s, _ in self._sessions.values()),
+            "buffered_bytes": sum(len(s.scrollback) for s, _ in self._sessions.values()),
+        }
+
+    def _expire(self, token: str) -> None:
+        entry = self._sessions.pop(token, None)
+        if entry is None:
+            return
+        session, timer = entry
+        timer.cancel()
+        asyncio.ensure_future(session.close())
+
+
+detached_sessions = DetachedSessions()
@@ -2,12 +2,14 @@ from fastapi import FastAPI, Request
 from contextlib import asynccontextmanager
 from term import router as ssh_router
 from auth import router as auth_router
+from metrics import router as metrics_router, default_executor
 from db.admin_routers import app as admin_app
 from utils.template import app as template_app
 from utils.template import templates
 from fastapi.staticfiles import StaticFiles
 
 
+import asyncio
 import uvicorn
 import db.db
 import db.env
@@ -15,10 +17,34 @@ import db.env
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Counted thread pool for asyncio.to_thread, reported on /metrics.
+    asyncio.get_running_loop().set_default_executor(default_executor)
     # Startup: initialize database
     await db.db.init_db()
+    await db.db.load_acl()
+    rotation = None
+    if db.db.crypto.rotating:
+        # Re-encrypt secrets still under an old key without holding up startup.
+        rotation = asyncio.create_task(db.db.rotate_secrets())
+    sweeper = None
+    if db.env.config.SESSION_SWEEP_INTERVAL > 0:
+        sweeper = asyncio.create_task(db.db.session_sweeper())
     yield
     # Shutdown: cleanup if needed
+    if rotation is not None:
+        # Each batch commits on its own; the rest is picked up next start.
+        rotation.cancel()
+        try:
+            await rotation
+        except asyncio.CancelledError:
+            pass
+    if sweeper is not None:
+        # Batches are separate transactions; stopping mid-sweep loses nothing.
+        sweeper.cancel()
+        try:
+            await sweeper
+        except asyncio.CancelledError:
+            pass
 
 app = FastAPI(lifespan=lifespan)
 
@@ -35,6 +61,7 @@ app.mount(
 
 app.include_router(ssh_router)
 app.include_router(auth_router)
+app.include_router(metrics_router)
 app.mount('/term', template_app)
 app.mount('/admin', admin_app)
 
@@ -0,0 +1,94 @@
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
+from db.db import passwords, import_passwords, get_valid_admin_session
+from db.env import config
+from ssh import live_sessions, closed_totals
+from ssh_pool import transport_pool
+from utils.metrics import registry, Sampled, TrackedExecutor
+
+import hmac
+
+
+router = APIRouter(tags=['metrics'])
+
+
+def _sessions() -> dict:
+    attached = sum(1 for s in live_sessions if s.ws is not None)
+    return {("attached",): attached, ("detached",): len(live_sessions) - attached}
+
+
+def _traffic(kind: str) -> dict:
+    return {
+        (direction,): closed_totals[f"{kind}_{direction}"]
+        + sum(getattr(s, f"{kind}_{direction}") for s in live_sessions)
+        for direction in ("in", "out")
+    }
+
+
+def _queues() -> dict:
+    depths = [s.queue.qsize() for s in live_sessions if s.queue is not None]
+    return {("sum",): sum(depths), ("max",): max(depths, default=0)}
+
+
+# Installed as the loop's default executor (asyncio.to_thread: SSH
+# connects, encryption, key parsing) in main.lifespan.
+default_executor = TrackedExecutor(thread_name_prefix="asyncio")
+
+
+def _executors() -> dict:
+    pools = {
+        "default": default_executor,
+        "bcrypt": passwords.executor,
+        "bcrypt_import": import_passwords.executor,
+    }
+    return {
+        (pool, state): value
+        for pool, executor in pools.items()
+        for state, value in executor.stats().items()
+    }
+
+
+registry.register(Sampled(
+    "wst_terminal_sessions", "Open SSH shells by WebSocket state.", _sessions, labels=("state",),
+))
+registry.register(Sampled(
+    "wst_terminal_bytes_total", "Terminal bytes; in is browser to SSH, out is SSH to browser.",
+    lambda: _traffic("bytes"), kind="counter", labels=("direction",),
+))
+registry.register(Sampled(
+    "wst_terminal_frames_total", "WebSocket messages carrying terminal data.",
+    lambda: _traffic("frames"), kind="counter", labels=("direction",),
+))
+registry.register(Sampled(
+    "wst_terminal_queue_depth", "Output chunks waiting in SSHSession.queue.", _queues, labels=("stat",),
+))
+registry.register(Sampled(
+    "wst_terminal_pending_bytes", "Output bytes read from SSH but not yet sent.",
+    lambda: sum(s.pending_bytes for s in live_sessions),
+))
+registry.register(Sampled(
+    "wst_ssh_transports", "Pooled SSH transports.",
+    lambda: {(k,): v for k, v in transport_pool.stats().items()}, labels=("state",),
+))
+registry.register(Sampled(
+    "wst_executor_threads", "Worker pool size (max) and calls running (busy) or waiting (queued).",
+    _executors, labels=("pool", "state"),
+))
+registry.register(Sampled(
+    "wst_password_hash_pending", "Hashes running or queued on the bcrypt pool.",
+    lambda: passwords.pending,
+))
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """With METRICS_TOKEN set, scrapers send it as a bearer token.  Without
+    it the endpoint is not public: only an admin session may read it."""
+    if config.METRICS_TOKEN:
+        supplied = request.headers.get("authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied.encode(), config.METRICS_TOKEN.encode()):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Bad metrics token")
+    elif not await get_valid_admin_session(request.cookies.get("admin_session")):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Set METRICS_TOKEN to scrape without an admin session")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
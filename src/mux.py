@@ -0,0 +1,273 @@
+"""Many terminals over one WebSocket.
+
+Every binary message is a 3-byte header followed by a payload::
+
+    !H channel id   (chosen by the client)
+    !B message type
+
+Client -> server
+    OPEN    JSON {"server_id", "cols", "rows", "token"?, "mode"?}
+    DATA    terminal input, never more than the channel's input credit
+    RESIZE  !HH cols, rows
+    CLOSE   empty; ends the channel's shell
+    CREDIT  !I bytes of output the client is ready for
+
+Server -> client
+    OPENED  JSON {"token", "input_window"} once the shell is attached
+    DATA    terminal output, never more than the channel's credit
+    CLOSE   UTF-8 reason; the channel is gone
+    CREDIT  !I bytes of input passed on to the shell
+
+Each channel starts with TERM_MUX_WINDOW bytes of credit.  A channel that
+runs out stops sending, its session's backpressure stops reading the SSH
+channel, and the other channels carry on.
+
+Input is credited the same way in the other direction: the client may have
+"input_window" bytes in flight and gets them back as the shell takes
+them, so a long paste waits in the browser instead of piling up here.
+Input beyond the credit is dropped.
+
+A malformed frame, or an OPEN past TERM_MUX_MAX_CHANNELS, closes that
+channel with a reason; the socket and its other channels stay up.
+"""
+from time import time
+from db.db import check_terminal_access
+from db.env import config
+from utils.timing import PhaseTimer, terminal_open_stats
+from utils.metrics import terminal_access
+
+import asyncio
+import json
+import logging
+import struct
+
+
+log = logging.getLogger(__name__)
+
+HEADER = struct.Struct("!HB")
+RESIZE = struct.Struct("!HH")
+CREDIT = struct.Struct("!I")
+
+MSG_OPEN = 1
+MSG_DATA = 2
+MSG_RESIZE = 3
+MSG_CLOSE = 4
+MSG_CREDIT = 5
+MSG_OPENED = 6
+
+
+class ChannelSink:
+    """What an SSHSession sees as its WebSocket on a multiplexed socket."""
+
+    def __init__(self, mux: "MuxConnection", chan_id: int):
+        self.mux = mux
+        self.chan_id = chan_id
+        self.credit = config.TERM_MUX_WINDOW
+        self._credit_available = asyncio.Event()
+        self._credit_available.set()
+        self.closed = False
+
+    def grant(self, n: int) -> None:
+        self.credit += n
+        if self.credit > 0:
+            self._credit_available.set()
+
+    async def send_bytes(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            while self.credit <= 0:
+                self._credit_available.clear()
+                await self._credit_available.wait()
+            n = min(len(view), self.credit)
+            await self.mux.send_frame(self.chan_id, MSG_DATA, view[:n])
+            self.credit -= n
+            view = view[n:]
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.mux.send_frame(self.chan_id, MSG_CLOSE, reason.encode())
+        except Exception:
+            pass
+        self.mux.channel_closed(self.chan_id, detach=code != 1000)
+
+
+class MuxChannel:
+    def __init__(self, sink: ChannelSink):
+        self.sink = sink
+        self.session = None
+        self.writer: asyncio.Task | None = None
+        self.opener: asyncio.Task | None = None
+        self.input: asyncio.Queue = asyncio.Queue()
+        self.input_credit = config.TERM_MUX_INPUT_WINDOW
+        self.input_pump: asyncio.Task | None = None
+
+
+class MuxConnection:
+    def __init__(self, ws, web_user_id: int, expires_at: int,
+                 open_session, end_session):
+        self.ws = ws
+        self.web_user_id = web_user_id
+        self.expires_at = expires_at
+        self._open_session = open_session
+        self._end_session = end_session
+        self.channels: dict[int, MuxChannel] = {}
+        self._send_lock = asyncio.Lock()
+
+    async def send_frame(self, chan_id: int, msg_type: int, payload=b"") -> None:
+        async with self._send_lock:
+            await self.ws.send_bytes(HEADER.pack(chan_id, msg_type) + payload)
+
+    async def run(self) -> None:
+        while True:
+            message = await self.ws.receive_bytes()
+            if len(message) < HEADER.size:
+                continue
+            chan_id, msg_type = HEADER.unpack_from(message)
+            payload = message[HEADER.size:]
+
+            if msg_type == MSG_OPEN:
+                if chan_id in self.channels:
+                    continue
+                if len(self.channels) >= config.TERM_MUX_MAX_CHANNELS:
+                    await self._reject(chan_id, "Too many channels")
+                    continue
+                channel = MuxChannel(ChannelSink(self, chan_id))
+                self.channels[chan_id] = channel
+                # Connecting can take a while; other channels keep flowing.
+                channel.opener = asyncio.create_task(self._open(chan_id, channel, payload))
+                continue
+
+            channel = self.channels.get(chan_id)
+            if channel is None:
+                continue
+
+            if msg_type == MSG_CREDIT:
+                if len(payload) != CREDIT.size:
+                    await self._reject(chan_id, "Bad credit frame")
+                    continue
+                channel.sink.grant(CREDIT.unpack(payload)[0])
+            elif channel.session is None:
+                continue
+            elif msg_type == MSG_DATA:
+                # No waiting here: one pasting channel must not stall the
+                # others.  The channel's pump waits on the shell instead.
+                if len(payload) > channel.input_credit:
+                    log.warning("Mux channel %d sent input beyond its credit; dropped", chan_id)
+                    continue
+                channel.input_credit -= len(payload)
+                channel.input.put_nowait(payload)
+            elif msg_type == MSG_RESIZE:
+                if len(payload) != RESIZE.size:
+                    await self._reject(chan_id, "Bad resize frame")
+                    continue
+                cols, rows = RESIZE.unpack(payload)
+                channel.session.resize(cols, rows)
+            elif msg_type == MSG_CLOSE:
+                await self._drop(chan_id, detach=False)
+
+    async def _open(self, chan_id: int, channel: MuxChannel, payload: bytes) -> None:
+        # Runs as its own task: nothing else would see its exceptions, and
+        # the client would wait on the channel forever.
+        try:
+            await self._connect(chan_id, channel, payload)
+        except Exception:
+            log.exception("Opening mux channel %d failed", chan_id)
+            if self.channels.get(chan_id) is channel:
+                await self._reject(chan_id, "Could not open terminal")
+
+    async def _connect(self, chan_id: int, channel: MuxChannel, payload: bytes) -> None:
+        timer = PhaseTimer(terminal_open_stats)
+        try:
+            request = json.loads(payload)
+            server_id = int(request["server_id"])
+            termsize = {"cols": int(request["cols"]), "rows": int(request["rows"])}
+        except (ValueError, KeyError, TypeError):
+            await self._reject(chan_id, "Bad open request")
+            return
+
+        if self.expires_at < int(time()):
+            await self._reject(chan_id, "Invalid or expired session")
+            return
+        access = await check_terminal_access(server_id, user_id=self.web_user_id)
+        timer.mark("auth")
+        terminal_access.inc(access.denied or "ok")
+        if access.denied:
+            await self._reject(chan_id, access.denied)
+            return
+
+        session = await self._open_session(
+            channel.sink, access.virtual_user, termsize, self.web_user_id,
+            token=request.get("token"), mode=request.get("mode", "raw"),
+            timer=timer,
+        )
+        if session is None:
+            # The sink already told the client why.
+            if self.channels.get(chan_id) is channel:
+                del self.channels[chan_id]
+            return
+        if self.channels.get(chan_id) is not channel:
+            # Closed (or the socket dropped) while connecting.
+            await self._end_session(session, None, detach=False)
+            return
+
+        channel.session = session
+        opened = {"token": session.token, "input_window": config.TERM_MUX_INPUT_WINDOW}
+        await self.send_frame(chan_id, MSG_OPENED, json.dumps(opened).encode())
+        channel.writer = asyncio.create_task(session.ws_writer())
+        channel.input_pump = asyncio.create_task(self._pump_input(chan_id, channel))
+
+    async def _pump_input(self, chan_id: int, channel: MuxChannel) -> None:
+        """Hands the channel's input to its shell in order, waiting while
+        the session's input buffer is full, and returns the credit."""
+        try:
+            while True:
+                data = await channel.input.get()
+                await channel.session.write(data)
+                channel.input_credit += len(data)
+                await self.send_frame(chan_id, MSG_CREDIT, CREDIT.pack(len(data)))
+        except Exception:
+            # The socket is gone; close() or _drop() ends the session.
+            pass
+
+    async def _reject(self, chan_id: int, reason: str) -> None:
+        channel = self.channels.get(chan_id)
+        if channel is not None:
+            channel.sink.closed = True
+        try:
+            await self.send_frame(chan_id, MSG_CLOSE, reason.encode())
+        except Exception:
+            pass
+        await self._drop(chan_id, detach=False)
+
+    def channel_closed(self, chan_id: int, detach: bool) -> None:
+        channel = self.channels.get(chan_id)
+        if channel is None or channel.session is None:
+            # Still connecting; _open cleans up when connect() returns.
+            return
+        # Called from inside the session's own writer task, which must not
+        # await its own cancellation.
+        if channel.writer is asyncio.current_task():
+            channel.writer = None
+        asyncio.ensure_future(self._drop(chan_id, detach=detach))
+
+    async def _drop(self, chan_id: int, detach: bool) -> None:
+        channel = self.channels.pop(chan_id, None)
+        if channel is None:
+            return
+        if channel.input_pump is not None:
+            channel.input_pump.cancel()
+        # A channel still connecting is left to its opener task, which sees
+        # the channel gone and closes the session itself.
+        if channel.session is not None:
+            await self._end_session(channel.session, channel.writer, detach=detach)
+
+    async def close(self) -> None:
+        # The socket is gone: every live shell is detached, not killed.
+        for chan_id in list(self.channels):
+            channel = self.channels.get(chan_id)
+            if channel is not None:
+                channel.sink.closed = True
+            await self._drop(chan_id, detach=True)
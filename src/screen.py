@@ -0,0 +1,124 @@
+from pyte import graphics
+
+import pyte
+
+
+def _reverse(*tables: dict) -> dict:
+    names = {}
+    for table in tables:
+        for code, name in table.items():
+            names.setdefault(name, code)
+    return names
+
+
+FG_CODES = _reverse(graphics.FG_ANSI, graphics.FG_AIXTERM)
+BG_CODES = _reverse(graphics.BG_ANSI, graphics.BG_AIXTERM)
+# pyte's own table misspells this one.
+BG_CODES.setdefault("brightmagenta", 105)
+
+DEFAULT_ATTRS = ("default", "default", False, False, False, False, False)
+
+
+def _color(value: str, codes: dict, extended: int) -> str:
+    if value in codes:
+        return str(codes[value])
+    # 256-colour and truecolour cells come back as "rrggbb".
+    try:
+        r, g, b = int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16)
+    except ValueError:
+        return str(extended + 1)
+    return f"{extended};2;{r};{g};{b}"
+
+
+def _sgr(attrs: tuple) -> str:
+    fg, bg, bold, italics, underscore, reverse, strikethrough = attrs
+    params = ["0"]
+    if bold:
+        params.append("1")
+    if italics:
+        params.append("3")
+    if underscore:
+        params.append("4")
+    if reverse:
+        params.append("7")
+    if strikethrough:
+        params.append("9")
+    if fg != "default":
+        params.append(_color(fg, FG_CODES, 38))
+    if bg != "default":
+        params.append(_color(bg, BG_CODES, 48))
+    return "\x1b[" + ";".join(params) + "m"
+
+
+class ScreenRenderer:
+    """Terminal screen model fed with raw SSH output.
+
+    Instead of forwarding the byte stream, the session sends ``render()``
+    output: escape sequences that repaint only the rows that changed since
+    the previous frame, so anything that scrolled past in between is never
+    sent at all.
+    """
+
+    def __init__(self, cols: int, rows: int):
+        self.screen = pyte.Screen(cols, rows)
+        self.stream = pyte.ByteStream(self.screen)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.screen.dirty)
+
+    def feed(self, data: bytes) -> None:
+        self.stream.feed(data)
+
+    def resize(self, cols: int, rows: int) -> None:
+        self.screen.resize(lines=rows, columns=cols)
+        self.screen.dirty.update(range(self.screen.lines))
+
+    def render(self, full: bool = False) -> bytes:
+        screen = self.screen
+        if full:
+            rows = range(screen.lines)
+            out = ["\x1b[0m\x1b[H\x1b[2J"]
+        else:
+            rows = sorted(y for y in screen.dirty if y < screen.lines)
+            out = []
+        screen.dirty.clear()
+
+        for y in rows:
+            out.append(f"\x1b[{y + 1};1H")
+            out.append(self._render_line(screen.buffer[y]))
+
+        cursor = screen.cursor
+        out.append(f"\x1b[{cursor.y + 1};{cursor.x + 1}H")
+        out.append("\x1b[?25l" if cursor.hidden else "\x1b[?25h")
+        return "".join(out).encode()
+
+    def _render_line(self, line) -> str:
+        cols = self.screen.columns
+        default = self.screen.default_char
+
+        # Trailing blank default cells are cleared with EL instead of sent.
+        end = cols
+        while end > 0 and line[end - 1] == default:
+            end -= 1
+
+        out = []
+        current = DEFAULT_ATTRS
+        out.append("\x1b[0m")
+        for x in range(end):
+            char = line[x]
+            if not char.data:
+                # Second half of a wide character.
+                continue
+            attrs = (char.fg, char.bg, char.bold, char.italics,
+                     char.underscore, char.reverse, char.strikethrough)
+            if attrs != current:
+                out.append(_sgr(attrs))
+                current = attrs
+            out.append(char.data)
+
+        if current != DEFAULT_ATTRS:
+            out.append("\x1b[0m")
+        if end < cols:
+            out.append("\x1b[K")
+        return "".join(out)
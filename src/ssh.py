@@ -1,8 +1,18 @@
 from fastapi import WebSocket
 from io import StringIO
+from functools import partial
+from db.env import config
+from ssh_pool import PooledTransport, transport_pool, open_transport, open_shell
+from detach import RingBuffer
+from screen import ScreenRenderer
+from utils.cache import TTLCache
 
 import paramiko
 import asyncio
+import hashlib
+import secrets
+import select
+import socket
 
 
 k_types = {
@@ -12,6 +22,93 @@ k_types = {
     "ed25519": paramiko.Ed25519Key,
 }
 
+# Parsed private keys, keyed by (virtual user id, content fingerprint).
+# Parsing a passphrase-protected key runs a deliberately slow KDF, so it is
+# paid once per key rather than once per terminal.
+pkey_cache = TTLCache(config.PKEY_CACHE_SIZE, config.PKEY_CACHE_TTL)
+_pkey_loading: dict[tuple, asyncio.Future] = {}
+
+
+def _parse_pkey(pem: str, key_type: str, passphrase: str | None) -> paramiko.PKey:
+    if key_type not in k_types:
+        raise ValueError("Unsupported key type")
+    return k_types[key_type](
+        file_obj=StringIO(pem),
+        password=passphrase.encode() if passphrase else None,
+    )
+
+
+async def load_pkey(virtual_user_id: int | None, pem: str, key_type: str,
+                    passphrase: str | None) -> paramiko.PKey:
+    fingerprint = hashlib.sha256(
+        "\0".join((key_type or "", pem, passphrase or "")).encode()
+    ).hexdigest()
+    key = (virtual_user_id, fingerprint)
+
+    pkey = pkey_cache.get(key)
+    if pkey is not None:
+        return pkey
+
+    # Tabs opened at the same moment share one parse.
+    loading = _pkey_loading.get(key)
+    if loading is not None:
+        return await asyncio.shield(loading)
+
+    loading = asyncio.ensure_future(asyncio.to_thread(_parse_pkey, pem, key_type, passphrase))
+    _pkey_loading[key] = loading
+    try:
+        pkey = await asyncio.shield(loading)
+    finally:
+        _pkey_loading.pop(key, None)
+    pkey_cache.set(key, pkey)
+    return pkey
+
+
+def invalidate_pkeys(virtual_user_id: int) -> None:
+    pkey_cache.discard_where(lambda key, _: key[0] == virtual_user_id)
+
+
+DROPPED_NOTICE = b"\r\n[output dropped: client too slow]\r\n"
+# Close code for the "disconnect" slow-client policy.  Not 1008: the shell
+# is detached, not ended, and the browser should reconnect to it.
+CLOSE_TOO_SLOW = 4000
+INPUT_CHUNK = 32768
+INPUT_RETRY_DELAY = 0.01
+SCREEN_RECV_MAX = 4096
+
+
+class OutputBudget:
+    """Bytes read from SSH channels but not yet sent to a WebSocket,
+    summed over every session in this worker."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.waiting: set = set()
+
+    def acquire(self, n: int) -> None:
+        self.used += n
+
+    def release(self, n: int) -> None:
+        self.used -= n
+        if self.waiting and self.used < self.limit:
+            waiting, self.waiting = self.waiting, set()
+            for session in waiting:
+                session.maybe_resume()
+
+    def exhausted(self) -> bool:
+        return self.used >= self.limit
+
+
+output_budget = OutputBudget(config.TERM_GLOBAL_BUFFER_BYTES)
+
+# Sessions with an open channel, attached or detached.  Their byte and
+# frame counters are plain attributes, summed for /metrics on scrape and
+# folded into closed_totals when they close.
+live_sessions: set = set()
+closed_totals = {"bytes_in": 0, "frames_in": 0, "bytes_out": 0, "frames_out": 0}
+
+
 class SSHSession:
     def __init__(
         self,
@@ -24,8 +121,14 @@ class SSHSession:
         key_type: str = None,
         passphrase: str = None,
         termsize: dict | None = None,
+        virtual_user_id: int | None = None,
+        owner_id: int | None = None,
+        mode: str = "raw",
     ):
         self.ws = ws
+        self.virtual_user_id = virtual_user_id
+        self.owner_id = owner_id
+        self.token = secrets.token_urlsafe(24)
         self.host = host
         self.port = port
         self.username = username
@@ -35,92 +138,511 @@ class SSHSession:
         self.passphrase = passphrase
         self.termsize = termsize or {"cols": 80, "rows": 24}
 
-        self.ssh: paramiko.SSHClient | None = None
+        self.pooled: PooledTransport | None = None
         self.chan = None
         self.loop = None
         self.stop_event: asyncio.Event | None = None
         self.queue: asyncio.Queue | None = None
+        self._reader_fd: int | None = None
+        self._reading = False
+        self._eof = False
+        self._held = 0
+        self.on_eof = None
 
-    async def connect(self) -> bool:
-        self.ssh = paramiko.SSHClient()
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.scrollback = RingBuffer(config.TERM_SCROLLBACK_BYTES)
 
-        try:
-            kwargs = {
-                "hostname": self.host,
-                "port": self.port,
-                "username": self.username,
-                "timeout": 120,
-                "password": self.password,
-                "pkey": None,
-                "passphrase": self.passphrase.encode() if self.passphrase else None,
-            }
+        # "screen" mode sends rendered screen diffs instead of raw output.
+        self.renderer = None
+        self.frame_interval = 1 / config.TERM_SCREEN_FPS
+        self._next_frame = 0.0
+        self._frame_timer: asyncio.TimerHandle | None = None
+
+        self.pending_bytes = 0
+        self.buffer_limit = config.TERM_SESSION_BUFFER_BYTES
+        self.slow_policy = config.TERM_SLOW_CLIENT_POLICY
+        self._slow_timer: asyncio.TimerHandle | None = None
+
+        self.recv_size = config.TERM_RECV_MIN
+        self.recv_max = config.TERM_RECV_MAX
+        self.coalesce_bytes = config.TERM_COALESCE_BYTES
+        self.coalesce_window = config.TERM_COALESCE_WINDOW_MS / 1000
 
+        self.input_buffer = bytearray()
+        self._input_drained: asyncio.Event | None = None
+        self._input_retry: asyncio.Handle | None = None
+
+        self.bytes_in = 0
+        self.frames_in = 0
+        self.bytes_out = 0
+        # PhaseTimer of the terminal open in progress, finished by the
+        # first frame sent.
+        self.timer = None
+        self.frames_out = 0
+
+        # Bytes fed to the renderer in the current frame interval; reading
+        # pauses once it reaches TERM_SCREEN_PARSE_BYTES.
+        self._parsed = 0
+        self._parse_window = 0.0
+        self._parse_timer: asyncio.TimerHandle | None = None
+
+        if mode == "screen":
+            self.renderer = ScreenRenderer(self.termsize["cols"], self.termsize["rows"])
+            self.coalesce_bytes = 0
+            # pyte parses in pure Python; small reads keep one flooding
+            # session from holding the loop for long in a single callback.
+            self.recv_max = min(self.recv_max, SCREEN_RECV_MAX)
+
+    async def connect(self) -> bool:
+        try:
+            pkey = None
             if self.pkey:
-                if self.key_type not in k_types:
-                    raise ValueError("Unsupported key type")
-                key_file = StringIO(self.pkey)
-                kwargs["pkey"] = k_types[self.key_type](
-                    file_obj=key_file,
-                    password=self.passphrase.encode() if self.passphrase else None,
+                pkey = await load_pkey(
+                    self.virtual_user_id, self.pkey, self.key_type, self.passphrase
                 )
+            self._mark("pkey")
 
-            await asyncio.to_thread(self.ssh.connect, **kwargs)
-
-            self.chan = self.ssh.invoke_shell(term="xterm")
-            self.chan.setblocking(True)
-            self.chan.resize_pty(self.termsize["cols"], self.termsize["rows"])
+            key = (self.virtual_user_id, self.host, self.port, self.username)
+            opener = partial(
+                open_transport, self.host, self.port, self.username,
+                password=self.password, pkey=pkey,
+            )
+            self.pooled = await transport_pool.acquire(key, opener)
+            self._mark("transport")
 
-            self.loop = asyncio.get_running_loop()
-            self.stop_event = asyncio.Event()
-            self.queue = asyncio.Queue(maxsize=100)
+            try:
+                chan = await asyncio.to_thread(
+                    open_shell, self.pooled.transport,
+                    self.termsize["cols"], self.termsize["rows"],
+                )
+            except Exception:
+                # A pooled transport that can no longer open channels (dead
+                # connection, server-side session limit) is retired and the
+                # connect retried once on a fresh one.
+                transport_pool.discard(self.pooled)
+                transport_pool.release(self.pooled)
+                # Released: the handler below must not release it again
+                # if the retry fails before holding a new entry.
+                self.pooled = None
+                self.pooled = await transport_pool.acquire(key, opener)
+                chan = await asyncio.to_thread(
+                    open_shell, self.pooled.transport,
+                    self.termsize["cols"], self.termsize["rows"],
+                )
 
+            self._mark("shell")
+            self.attach_channel(chan)
             return True
 
-        except Exception as e:
+        except Exception:
             try:
                 await self.ws.close(code=1011, reason="SSH connection failed")
             except Exception:
                 pass
-            if self.ssh:
-                try:
-                    self.ssh.close()
-                except Exception:
-                    pass
+            if self.pooled:
+                transport_pool.release(self.pooled)
+                self.pooled = None
             return False
 
-    def ssh_reader(self):
+    def _mark(self, phase: str) -> None:
+        if self.timer is not None:
+            self.timer.mark(phase)
+
+    def attach_channel(self, chan) -> None:
+        self.chan = chan
+        self.chan.setblocking(False)
+
+        self.loop = asyncio.get_running_loop()
+        live_sessions.add(self)
+        self.stop_event = asyncio.Event()
+        self.queue = asyncio.Queue()
+        self._input_drained = asyncio.Event()
+        self._input_drained.set()
+
+    def resize(self, cols: int, rows: int) -> None:
+        self.termsize = {"cols": cols, "rows": rows}
         try:
-            while not self.stop_event.is_set():
-                data = self.chan.recv(1024)
-                
-                if not data:
-                    break
+            self.chan.resize_pty(cols, rows)
+        except Exception:
+            pass
+        if self.renderer is not None:
+            self.renderer.resize(cols, rows)
+            self._schedule_frame()
+
+    def detach(self) -> None:
+        """Drop the WebSocket but keep the shell running.
+
+        Queued output is discarded (it is already in the scrollback) and
+        reading continues into the scrollback ring only.
+        """
+        self.ws = None
+        self._cancel_slow_timer()
+        output_budget.waiting.discard(self)
+        discarded = 0
+        while not self.queue.empty():
+            data = self.queue.get_nowait()
+            if data is not None:
+                discarded += len(data)
+        self._release(discarded)
+        self._resume_reading()
+
+    def reattach(self, ws) -> None:
+        """Attach a new WebSocket and queue the scrollback tail (or, in
+        screen mode, one full screen) for it, ahead of any live output."""
+        self.ws = ws
+        if self.renderer is not None:
+            snapshot = self.renderer.render(full=True)
+        else:
+            snapshot = self.scrollback.getvalue()
+        if snapshot:
+            self._enqueue(snapshot)
+
+    def _enqueue(self, data: bytes) -> None:
+        self.queue.put_nowait(data)
+        self.pending_bytes += len(data)
+        output_budget.acquire(len(data))
 
-                asyncio.run_coroutine_threadsafe(self.queue.put(data), self.loop)
+    def _schedule_frame(self) -> None:
+        if self._frame_timer is None and self.ws is not None:
+            delay = max(0.0, self._next_frame - self.loop.time())
+            self._frame_timer = self.loop.call_later(delay, self._emit_frame)
 
+    def _emit_frame(self) -> None:
+        self._frame_timer = None
+        if self.ws is None or not self.renderer.dirty:
+            return
+        if self.pending_bytes:
+            # The previous frame has not gone out yet.  Skip this one; the
+            # next frame renders whatever the screen looks like by then.
+            self._frame_timer = self.loop.call_later(self.frame_interval, self._emit_frame)
+            return
+        self._next_frame = self.loop.time() + self.frame_interval
+        self._enqueue(self.renderer.render())
+
+    def start_reader(self) -> None:
+        # Channel.fileno() is a pipe paramiko keeps readable while the
+        # channel buffer holds data (or the channel hit EOF), so the event
+        # loop can wait on it instead of a thread blocked in recv().
+        self._reader_fd = self.chan.fileno()
+        self._resume_reading()
+
+    def stop_reader(self) -> None:
+        self._pause_reading()
+        self._reader_fd = None
+        if self._parse_timer is not None:
+            self._parse_timer.cancel()
+            self._parse_timer = None
+        self._cancel_slow_timer()
+        output_budget.waiting.discard(self)
+
+    def _resume_reading(self) -> None:
+        if self._parse_timer is not None:
+            # Screen mode is over its parse budget; the timer resumes.
+            return
+        if self._reader_fd is not None and not self._reading:
+            self.loop.add_reader(self._reader_fd, self._on_readable)
+            self._reading = True
+
+    def _pause_reading(self) -> None:
+        if self._reading:
+            self.loop.remove_reader(self._reader_fd)
+            self._reading = False
+
+    def _over_budget(self) -> bool:
+        return self.pending_bytes >= self.buffer_limit or output_budget.exhausted()
+
+    def _apply_backpressure(self) -> None:
+        # Not reading the channel leaves data in paramiko's buffer, which
+        # stops window adjustments, so the remote end blocks once the SSH
+        # window is full.  Memory per session is bounded by our buffer limit
+        # plus that window.
+        self._pause_reading()
+        if output_budget.exhausted():
+            output_budget.waiting.add(self)
+        if self._slow_timer is None:
+            self._slow_timer = self.loop.call_later(
+                config.TERM_SLOW_CLIENT_TIMEOUT, self._on_slow_client
+            )
+
+    def maybe_resume(self) -> None:
+        if self._reading or self._reader_fd is None:
+            return
+        if output_budget.exhausted():
+            output_budget.waiting.add(self)
+            return
+        if self.pending_bytes <= self.buffer_limit // 2:
+            self._cancel_slow_timer()
+            self._resume_reading()
+
+    def _cancel_slow_timer(self) -> None:
+        if self._slow_timer is not None:
+            self._slow_timer.cancel()
+            self._slow_timer = None
+
+    def _release(self, n: int) -> None:
+        self.pending_bytes -= n
+        output_budget.release(n)
+        if not self._reading:
+            self.maybe_resume()
+
+    def _on_slow_client(self) -> None:
+        self._slow_timer = None
+        if self.slow_policy == "disconnect":
+            asyncio.ensure_future(self._close_ws(CLOSE_TOO_SLOW, "Client too slow"))
+        elif self.slow_policy == "drop":
+            self._drop_to_latest()
+        else:
+            # "pause": keep the remote side blocked for as long as it takes.
+            pass
+
+    def _drop_to_latest(self) -> None:
+        keep = self.buffer_limit // 4
+        chunks = []
+        while not self.queue.empty():
+            chunks.append(self.queue.get_nowait())
+
+        kept = []
+        kept_bytes = 0
+        eof = chunks and chunks[-1] is None
+        for data in reversed(chunks):
+            if data is None:
+                continue
+            if kept_bytes + len(data) > keep:
+                break
+            kept.append(data)
+            kept_bytes += len(data)
+
+        dropped = sum(len(d) for d in chunks if d is not None) - kept_bytes
+        self._enqueue(DROPPED_NOTICE)
+        for data in reversed(kept):
+            self.queue.put_nowait(data)
+        if eof:
+            self.queue.put_nowait(None)
+
+        self._release(dropped)
+
+    async def _close_ws(self, code: int, reason: str) -> None:
+        try:
+            await self.ws.close(code=code, reason=reason)
         except Exception:
             pass
 
+    def _on_readable(self):
+        try:
+            data = self.chan.recv(self.recv_size)
+        except socket.timeout:
+            # Only stderr is pending; a pty never uses it, but drain it so
+            # the pipe does not stay readable forever.
+            if self.chan.recv_stderr_ready():
+                data = self.chan.recv_stderr(1024)
+            else:
+                return
+        except Exception:
+            data = b""
+
+        if not data:
+            self._on_eof()
+            return
+
+        self.scrollback.write(data)
+
+        # Grow the read size while reads come back full and drop back to the
+        # minimum as soon as output looks interactive again.
+        if len(data) >= self.recv_size:
+            self.recv_size = min(self.recv_size * 2, self.recv_max)
+        elif len(data) < self.recv_size // 4:
+            self.recv_size = config.TERM_RECV_MIN
+
+        if self.renderer is not None:
+            # Screen state is bounded by its size, so there is nothing to
+            # hold back here; floods only cost parsing.
+            self.renderer.feed(data)
+            self._schedule_frame()
+            now = self.loop.time()
+            if now - self._parse_window >= self.frame_interval:
+                self._parse_window, self._parsed = now, 0
+            self._parsed += len(data)
+            if self._parsed >= config.TERM_SCREEN_PARSE_BYTES:
+                # A flood: leave the rest in the SSH window until the next
+                # frame interval, so the remote end waits instead of the loop.
+                self._pause_reading()
+                self._parse_timer = self.loop.call_later(self.frame_interval, self._next_parse_interval)
+            return
+
+        if self.ws is None:
+            # Detached: the scrollback is the only consumer.
+            return
+
+        self._enqueue(data)
+        if self._over_budget():
+            self._apply_backpressure()
+
+    def _next_parse_interval(self) -> None:
+        self._parse_timer = None
+        self._parse_window, self._parsed = self.loop.time(), 0
+        if self.ws is None or not self._over_budget():
+            self._resume_reading()
+
+    def _on_eof(self):
+        self.stop_reader()
+        self.stop_event.set()
+        self.queue.put_nowait(None)
+        if self.on_eof is not None:
+            self.on_eof()
+
+    async def write(self, data: bytes) -> None:
+        """Queue input for the channel, preserving order.
+
+        Input is sent straight away while the remote window has room; the
+        rest stays buffered and is retried from a timer.  Once more than
+        TERM_INPUT_BUFFER_BYTES is pending the caller waits, which stops it
+        reading further WebSocket messages.
+        """
+        if not self.feed(data):
+            self._input_drained.clear()
+            await self._input_drained.wait()
+
+    def feed(self, data: bytes) -> bool:
+        """Non-waiting variant of write(); returns False once the input
+        buffer is over its limit."""
+        self.bytes_in += len(data)
+        self.frames_in += 1
+        self.input_buffer += data
+        if self._input_retry is None:
+            self._flush_input()
+        return len(self.input_buffer) < config.TERM_INPUT_BUFFER_BYTES
+
+    def _transport_ready(self) -> bool:
+        """Whether chan.send() can run without blocking the loop: paramiko
+        waits out a rekey on clear_to_send and writes whole packets with
+        sendall-like retries, so both must be clear before calling it."""
+        transport = self.chan.get_transport()
+        if transport is None or not transport.is_active():
+            # send() on a dead transport fails straight away.
+            return True
+        if not transport.clear_to_send.is_set():
+            return False
+        # poll(), not select(): descriptors past FD_SETSIZE are routine
+        # with thousands of sessions.  Anything odd counts as not ready.
+        try:
+            poller = select.poll()
+            poller.register(transport.sock, select.POLLOUT)
+            events = poller.poll(0)
+        except (OSError, TypeError, ValueError):
+            return False
+        return any(mask == select.POLLOUT for _, mask in events)
+
+    def _flush_input(self) -> None:
+        """Sends at most INPUT_CHUNK bytes, then yields to the loop before
+        sending more."""
+        self._input_retry = None
+        if not self.input_buffer:
+            return
+        if not self._transport_ready():
+            self._input_retry = self.loop.call_later(INPUT_RETRY_DELAY, self._flush_input)
+            return
+        try:
+            n = self.chan.send(bytes(self.input_buffer[:INPUT_CHUNK]))
+        except socket.timeout:
+            # Remote window is full; try again shortly.
+            self._input_retry = self.loop.call_later(INPUT_RETRY_DELAY, self._flush_input)
+            return
+        except Exception:
+            n = 0
+
+        if n == 0:
+            # Channel closed or EOF sent: nothing will accept the rest.
+            self.input_buffer.clear()
+        else:
+            del self.input_buffer[:n]
+            if self.input_buffer:
+                self._input_retry = self.loop.call_soon(self._flush_input)
+
+        if len(self.input_buffer) < config.TERM_INPUT_BUFFER_BYTES:
+            self._input_drained.set()
+
+    def _drain_into(self, buf: bytearray) -> None:
+        while len(buf) < self.coalesce_bytes and not self.queue.empty():
+            data = self.queue.get_nowait()
+            if data is None:
+                self._eof = True
+                return
+            buf += data
+            self._held += len(data)
+
+    async def _coalesce(self, data: bytes) -> bytes:
+        if self.queue.empty() and self.recv_size <= config.TERM_RECV_MIN:
+            # Interactive output (a keystroke echo): nothing to merge it with.
+            return data
+
+        buf = bytearray(data)
+        self._drain_into(buf)
+        if (
+            not self._eof
+            and len(buf) < self.coalesce_bytes
+            and self.recv_size > config.TERM_RECV_MIN
+        ):
+            # Output is streaming; give the reader one window to catch up.
+            await asyncio.sleep(self.coalesce_window)
+            self._drain_into(buf)
+        return bytes(buf)
+
     async def ws_writer(self):
         try:
-            while True:
+            while not self._eof:
                 data = await self.queue.get()
-                await self.ws.send_bytes(data)
+                if data is None:
+                    break
+                self._held = len(data)
+                if self.coalesce_bytes:
+                    data = await self._coalesce(data)
+                try:
+                    await self.ws.send_bytes(data)
+                finally:
+                    self._held = 0
+                    self._release(len(data))
+                self.bytes_out += len(data)
+                self.frames_out += 1
+                if self.timer is not None:
+                    self.timer.finish("first_byte")
+                    self.timer = None
         except asyncio.CancelledError:
-            pass
+            return
+        finally:
+            # Cancelled while coalescing: these bytes left the queue but
+            # were never sent, and still count against the budget.
+            if self._held:
+                self._held, held = 0, self._held
+                self._release(held)
+
+        await self._close_ws(1000, "SSH session closed")
 
     async def close(self):
+        # The reader must be unregistered before the channel closes its pipe.
+        self.stop_reader()
+        if self._frame_timer is not None:
+            self._frame_timer.cancel()
+            self._frame_timer = None
+        if self._input_retry is not None:
+            self._input_retry.cancel()
+            self._input_retry = None
+        if self._input_drained is not None:
+            self._input_drained.set()
+        self._held = 0
+        if self.pending_bytes:
+            self.pending_bytes, pending = 0, self.pending_bytes
+            output_budget.release(pending)
+        if self in live_sessions:
+            live_sessions.discard(self)
+            for name in closed_totals:
+                closed_totals[name] += getattr(self, name)
         try:
             if self.chan:
                 try:
                     self.chan.close()
                 except Exception:
                     pass
-            if self.ssh:
-                try:
-                    self.ssh.close()
-                except Exception:
-                    pass
+            if self.pooled:
+                transport_pool.release(self.pooled)
+                self.pooled = None
         except Exception:
             pass
@@ -0,0 +1,175 @@
+from collections import OrderedDict
+from db.env import config
+from utils.metrics import ssh_connect_seconds
+from time import perf_counter
+
+import paramiko
+import asyncio
+import socket
+
+
+def _observe(phase: str, start: float) -> float:
+    now = perf_counter()
+    ssh_connect_seconds.observe(now - start, phase)
+    return now
+
+
+def open_transport(host: str, port: int, username: str,
+                   password: str = None, pkey: paramiko.PKey = None) -> paramiko.Transport:
+    """Blocking TCP connect, key exchange and authentication."""
+    start = perf_counter()
+    sock = socket.create_connection((host, port), timeout=config.SSH_CONNECT_TIMEOUT)
+    start = _observe("tcp", start)
+    transport = paramiko.Transport(sock)
+    try:
+        transport.start_client(timeout=config.SSH_CONNECT_TIMEOUT)
+        start = _observe("kex", start)
+
+        # Same order SSHClient.connect uses: key first, then password.
+        if pkey is not None:
+            try:
+                transport.auth_publickey(username, pkey)
+            except paramiko.AuthenticationException:
+                if not password:
+                    raise
+        if not transport.is_authenticated() and password:
+            transport.auth_password(username, password)
+        if not transport.is_authenticated():
+            raise paramiko.AuthenticationException("No authentication methods available")
+        _observe("auth", start)
+
+        if config.SSH_KEEPALIVE:
+            transport.set_keepalive(config.SSH_KEEPALIVE)
+        return transport
+
+    except Exception:
+        transport.close()
+        raise
+
+
+def open_shell(transport: paramiko.Transport, cols: int, rows: int) -> paramiko.Channel:
+    """Blocking channel open + pty + shell on an authenticated transport."""
+    start = perf_counter()
+    chan = transport.open_session(timeout=config.SSH_CONNECT_TIMEOUT)
+    try:
+        chan.get_pty(term="xterm", width=cols, height=rows)
+        chan.invoke_shell()
+        _observe("shell", start)
+        return chan
+    except Exception:
+        chan.close()
+        raise
+
+
+class PooledTransport:
+    def __init__(self, key: tuple, transport: paramiko.Transport):
+        self.key = key
+        self.transport = transport
+        self.refs = 0
+        self.stale = False
+        self.idle_timer: asyncio.TimerHandle | None = None
+
+    def usable(self) -> bool:
+        return (
+            not self.stale
+            and self.transport.is_active()
+            and self.refs < config.TERM_POOL_MAX_CHANNELS
+        )
+
+
+class TransportPool:
+    """Authenticated SSH transports shared by every terminal opened to the
+    same virtual user.
+
+    Each transport carries up to TERM_POOL_MAX_CHANNELS shell channels.
+    Once its last channel closes it stays open for TERM_POOL_IDLE_TTL
+    seconds; at most TERM_POOL_MAX_IDLE idle transports are kept, least
+    recently used first out.
+    """
+
+    def __init__(self):
+        self._entries: dict[tuple, list[PooledTransport]] = {}
+        self._idle: OrderedDict[int, PooledTransport] = OrderedDict()
+        self._locks: dict[tuple, asyncio.Lock] = {}
+
+    async def acquire(self, key: tuple, opener) -> PooledTransport:
+        """Reserve a channel slot on a pooled transport for ``key``,
+        calling the blocking ``opener()`` in a thread if none is usable."""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            for entry in self._entries.get(key, []):
+                if entry.usable():
+                    self._hold(entry)
+                    return entry
+
+            transport = await asyncio.to_thread(opener)
+            entry = PooledTransport(key, transport)
+            self._entries.setdefault(key, []).append(entry)
+            self._hold(entry)
+            return entry
+
+    def release(self, entry: PooledTransport) -> None:
+        entry.refs -= 1
+        if entry.refs > 0:
+            return
+        if entry.stale or not entry.transport.is_active():
+            self._discard(entry)
+            return
+
+        loop = asyncio.get_running_loop()
+        entry.idle_timer = loop.call_later(
+            config.TERM_POOL_IDLE_TTL, self._discard, entry
+        )
+        self._idle[id(entry)] = entry
+        while len(self._idle) > config.TERM_POOL_MAX_IDLE:
+            _, oldest = self._idle.popitem(last=False)
+            self._discard(oldest)
+
+    def discard(self, entry: PooledTransport) -> None:
+        """Stop handing out ``entry``; it closes once its channels do."""
+        entry.stale = True
+        if entry.refs <= 0:
+            self._discard(entry)
+
+    def invalidate(self, virtual_user_id: int) -> None:
+        for key in [k for k in self._entries if k[0] == virtual_user_id]:
+            for entry in list(self._entries.get(key, [])):
+                self.discard(entry)
+
+    def stats(self) -> dict:
+        entries = [e for es in self._entries.values() for e in es]
+        return {
+            "transports": len(entries),
+            "idle": len(self._idle),
+            "channels": sum(e.refs for e in entries),
+        }
+
+    def _hold(self, entry: PooledTransport) -> None:
+        entry.refs += 1
+        if entry.idle_timer is not None:
+            entry.idle_timer.cancel()
+            entry.idle_timer = None
+        self._idle.pop(id(entry), None)
+
+    def _discard(self, entry: PooledTransport) -> None:
+        if entry.idle_timer is not None:
+            entry.idle_timer.cancel()
+            entry.idle_timer = None
+        self._idle.pop(id(entry), None)
+
+        entries = self._entries.get(entry.key, [])
+        if entry in entries:
+            entries.remove(entry)
+        if not entries:
+            self._entries.pop(entry.key, None)
+            lock = self._locks.get(entry.key)
+            if lock is not None and not lock.locked():
+                del self._locks[entry.key]
+
+        try:
+            entry.transport.close()
+        except Exception:
+            pass
+
+
+transport_pool = TransportPool()
@@ -1,54 +1,100 @@
 const lists_assoc = {
   users: {
     listId: "users_list",
+    table: "web_users",
+    columns: "id,username,group_id",
     title: (i) => i.username,
     removeType: "user",
   },
   groups: {
     listId: "groups_list",
+    table: "groups",
+    columns: "id,name",
     title: (i) => i.name,
     removeType: "group",
   },
   servers: {
     listId: "servers_list",
+    table: "virtual_users",
+    columns: "id,username,domain",
     title: (i) => `${i.username}@${i.domain}`,
     removeType: "virtual_user",
   },
 };
 
-document.addEventListener("DOMContentLoaded", loadLists);
+// Rows currently shown, per list type: Map of id -> row.
+const list_rows = {};
+let feed = null;
+// Changes that arrive while the lists reload; applied once they are in.
+let pending_changes = null;
 
+document.addEventListener("DOMContentLoaded", connectFeed);
+
+// Without a live feed, the list that changed is fetched again.
 document.addEventListener("admin:list:update", async (e) => {
   const { type } = e.detail;
   if (!type) return;
+  if (feed && feed.readyState === EventSource.OPEN) return;
 
-  const response = await fetch("/admin/view-tables");
-  const dbInfo = await response.json();
+  loadList(type);
+});
 
-  const dataMap = {
-    users: dbInfo.web_users,
-    groups: dbInfo.groups,
-    servers: dbInfo.virtual_users,
-  };
+// /admin/changes pushes every change made through the admin API. The
+// browser resumes from the last event by itself after a reconnect; the
+// server sends "reset" when it cannot, and the lists are loaded again.
+function connectFeed() {
+  feed = new EventSource("/admin/changes");
+
+  feed.addEventListener("reset", async () => {
+    pending_changes = [];
+    await loadLists();
+    const queued = pending_changes;
+    pending_changes = null;
+    queued.forEach(applyChange);
+  });
 
-  loadLists();
-});
+  feed.addEventListener("change", (e) => {
+    const change = JSON.parse(e.data);
+    if (pending_changes) pending_changes.push(change);
+    else applyChange(change);
+  });
+}
+
+function applyChange(change) {
+  const type = Object.keys(lists_assoc).find(
+    (key) => lists_assoc[key].table === change.table
+  );
+  const rows = list_rows[type];
+  if (!rows) return;
+
+  if (change.op === "reload") {
+    loadList(type);
+    return;
+  }
 
+  if (change.op === "delete") {
+    rows.forEach((row, id) => {
+      const matches = Object.entries(change.where).every(
+        ([col, value]) => String(row[col]) === String(value)
+      );
+      if (matches) rows.delete(id);
+    });
+  } else {
+    rows.set(change.row.id, change.row);
+  }
+
+  renderList(type, [...rows.values()]);
+}
 
 async function loadLists() {
-  const response = await fetch("/admin/view-tables");
-  const dbInfo = await response.json();
-
-  Object.entries(lists_assoc).forEach(([type, cfg]) => {
-    const dataKey =
-      type === "users"
-        ? "web_users"
-        : type === "servers"
-          ? "virtual_users"
-          : type;
-
-    renderList(type, dbInfo[dataKey]);
-  });
+  await Promise.all(Object.keys(lists_assoc).map(loadList));
+}
+
+async function loadList(type) {
+  const cfg = lists_assoc[type];
+  const rows = await fetchTable(cfg.table, { columns: cfg.columns });
+  list_rows[type] = new Map(rows.map((row) => [row.id, row]));
+  renderList(type, rows);
 }
 
 function renderList(type, data) {
@@ -0,0 +1,23 @@
+// Reads /admin/tables/{name}, following keyset pages until the last one.
+// `params` takes the endpoint's query parameters: columns, filters
+// (column=value), prefix, limit.
+async function fetchTable(name, params = {}) {
+  const items = [];
+  let after = null;
+
+  do {
+    const query = new URLSearchParams({ limit: 1000, ...params });
+    if (after !== null) query.set("after", after);
+
+    const response = await fetch(`/admin/tables/${name}?${query}`);
+    if (!response.ok) {
+      console.error(`Error fetching ${name}:`, response.status);
+      break;
+    }
+    const page = await response.json();
+    items.push(...page.items);
+    after = page.next;
+  } while (after !== null);
+
+  return items;
+}
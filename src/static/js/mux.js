@@ -0,0 +1,123 @@
+// Client for /ws/mux: many terminals over one WebSocket.
+// Frame layout and message types are documented in src/mux.py.
+const MUX_OPEN = 1;
+const MUX_DATA = 2;
+const MUX_RESIZE = 3;
+const MUX_CLOSE = 4;
+const MUX_CREDIT = 5;
+const MUX_OPENED = 6;
+
+// Hand credit back once this much output has been written to the terminal.
+const MUX_CREDIT_STEP = 65536;
+
+class TerminalMux {
+  constructor() {
+    const wsProtocol = window.location.protocol === "https:" ? "wss:" : "ws:";
+    this.socket = new WebSocket(`${wsProtocol}//${window.location.host}/ws/mux`);
+    this.socket.binaryType = "arraybuffer";
+    this.channels = new Map();
+    this.nextId = 1;
+    this.ready = new Promise((resolve) => (this.socket.onopen = resolve));
+
+    this.socket.addEventListener("message", (event) => this._onFrame(event.data));
+    this.socket.addEventListener("close", () => {
+      this.channels.forEach((ch) => ch.onclose("Connection closed"));
+      this.channels.clear();
+    });
+  }
+
+  // Opens a shell on serverId. `term` is an xterm.js Terminal.
+  async open(serverId, term, { token = null, mode = null } = {}) {
+    await this.ready;
+    const id = this.nextId++;
+    const channel = {
+      id,
+      term,
+      unacked: 0,
+      token: null,
+      // Input waits here until the server has credit for it (none before
+      // OPENED), so a large paste is sent as the shell takes it.
+      inputCredit: 0,
+      pendingInput: [],
+      onclose: (reason) => term.write(`\r\n${reason}\r\n`),
+      send: (data) => {
+        channel.pendingInput.push(new TextEncoder().encode(data));
+        this._flushInput(channel);
+      },
+      resize: (cols, rows) => {
+        const payload = new DataView(new ArrayBuffer(4));
+        payload.setUint16(0, cols);
+        payload.setUint16(2, rows);
+        this._send(id, MUX_RESIZE, new Uint8Array(payload.buffer));
+      },
+      close: () => {
+        this._send(id, MUX_CLOSE, new Uint8Array());
+        this.channels.delete(id);
+      },
+    };
+    this.channels.set(id, channel);
+
+    const request = { server_id: serverId, cols: term.cols, rows: term.rows };
+    if (token) request.token = token;
+    if (mode) request.mode = mode;
+    this._send(id, MUX_OPEN, new TextEncoder().encode(JSON.stringify(request)));
+    return channel;
+  }
+
+  _flushInput(channel) {
+    while (channel.pendingInput.length && channel.inputCredit > 0) {
+      let chunk = channel.pendingInput[0];
+      if (chunk.length > channel.inputCredit) {
+        channel.pendingInput[0] = chunk.subarray(channel.inputCredit);
+        chunk = chunk.subarray(0, channel.inputCredit);
+      } else {
+        channel.pendingInput.shift();
+      }
+      channel.inputCredit -= chunk.length;
+      this._send(channel.id, MUX_DATA, chunk);
+    }
+  }
+
+  _send(id, type, payload) {
+    const frame = new Uint8Array(3 + payload.length);
+    const header = new DataView(frame.buffer);
+    header.setUint16(0, id);
+    header.setUint8(2, type);
+    frame.set(payload, 3);
+    this.socket.send(frame);
+  }
+
+  _onFrame(buffer) {
+    const header = new DataView(buffer, 0, 3);
+    const id = header.getUint16(0);
+    const type = header.getUint8(2);
+    const payload = new Uint8Array(buffer, 3);
+    const channel = this.channels.get(id);
+    if (!channel) return;
+
+    if (type === MUX_DATA) {
+      // Credit goes back only once xterm.js has actually consumed the
+      // output, so a slow tab throttles its own channel only.
+      channel.term.write(payload.slice(), () => {
+        channel.unacked += payload.length;
+        if (channel.unacked >= MUX_CREDIT_STEP) {
+          const credit = new DataView(new ArrayBuffer(4));
+          credit.setUint32(0, channel.unacked);
+          channel.unacked = 0;
+          this._send(id, MUX_CREDIT, new Uint8Array(credit.buffer));
+        }
+      });
+    } else if (type === MUX_OPENED) {
+      const opened = JSON.parse(new TextDecoder().decode(payload));
+      channel.token = opened.token;
+      channel.inputCredit = opened.input_window;
+      this._flushInput(channel);
+    } else if (type === MUX_CREDIT) {
+      channel.inputCredit += new DataView(buffer, 3, 4).getUint32(0);
+      this._flushInput(channel);
+    } else if (type === MUX_CLOSE) {
+      this.channels.delete(id);
+      channel.onclose(new TextDecoder().decode(payload) || "Connection closed");
+    }
+  }
+}
@@ -1,7 +1,34 @@
-document.addEventListener("DOMContentLoaded", renderList);
+document.addEventListener("DOMContentLoaded", () => {
+  const search = document.getElementById("termsSearch");
+  const more = document.getElementById("termsMore");
+  let timer = null;
 
-async function renderList() {
-  const servers = await fetch("/term/get_servers_by_user_id", {
+  search.addEventListener("input", () => {
+    clearTimeout(timer);
+    timer = setTimeout(() => renderList(search.value), 250);
+  });
+  more.addEventListener("click", () => renderList(search.value, more.dataset.after));
+
+  renderList("");
+});
+
+// Renders one page of /term/servers; `after` continues the current list.
+// The browser revalidates each page with If-None-Match, so an unchanged
+// list comes back as a 304 without a body.
+async function renderList(query, after = null) {
+  const termsList = document.getElementById("termsList");
+  const more = document.getElementById("termsMore");
+
+  if (!termsList) {
+    console.error('Element with ID "termsList" not found.');
+    return;
+  }
+
+  const params = new URLSearchParams({ limit: 100 });
+  if (query) params.set("q", query);
+  if (after) params.set("after", after);
+
+  const page = await fetch(`/term/servers?${params}`, {
     method: "GET",
     headers: {
       "Content-Type": "application/json",
@@ -12,22 +39,18 @@ async function renderList() {
       console.error("Error fetching servers:", error);
     });
 
-  if (servers) {
-    servers.forEach((srv) => {
-      renderVirtUser(srv);
-    });
-  }
-}
+  if (!page) return;
+  if (!after) termsList.replaceChildren();
 
-function renderVirtUser(srv) {
-  const termsList = document.getElementById("termsList");
-  console.log(srv);
+  page.items.forEach((srv) => {
+    renderVirtUser(termsList, srv);
+  });
 
-  if (!termsList) {
-    console.error('Element with ID "termsList" not found.');
-    return;
-  }
+  more.dataset.after = page.next ?? "";
+  more.classList.toggle("hidden", page.next === null);
+}
 
+function renderVirtUser(termsList, srv) {
   const el = document.createElement("a");
   el.href = `/term/${srv.id}`;
   el.classList.add('term-list-elem')
@@ -38,4 +61,38 @@ function renderVirtUser(srv) {
 
   el.appendChild(virtUser);
   termsList.appendChild(el);
+
+  const openHere = document.createElement("button");
+  openHere.innerText = "Open here";
+  openHere.addEventListener("click", () => openPane(srv));
+  termsList.appendChild(openHere);
+}
+
+// Terminals opened on this page share one /ws/mux socket (see mux.js)
+// instead of a WebSocket each.
+let mux = null;
+
+async function openPane(srv) {
+  if (!mux || mux.socket.readyState > WebSocket.OPEN) mux = new TerminalMux();
+
+  const pane = document.createElement("div");
+  const title = document.createElement("div");
+  title.innerText = `${srv.username}@${srv.domain} `;
+  const close = document.createElement("button");
+  close.innerText = "Close";
+  title.appendChild(close);
+  const termEl = document.createElement("div");
+  pane.append(title, termEl);
+  document.getElementById("termPanes").appendChild(pane);
+
+  const term = new Terminal({ rows: 24, cols: 120, cursorBlink: true });
+  term.open(termEl);
+  const channel = await mux.open(srv.id, term);
+  term.onData((data) => channel.send(data));
+  close.addEventListener("click", () => {
+    channel.close();
+    term.dispose();
+    pane.remove();
+  });
+  term.focus();
 }
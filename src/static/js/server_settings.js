@@ -94,7 +94,7 @@ async function server_settings(title, serverId) {
   });
   mBody.appendChild(search);
 
-  const { groups, links } = await take_sg_info();
+  const { groups, links } = await take_sg_info(serverId);
 
   const groupsContainer = document.createElement("div");
   groupsContainer.style.cssText = `
@@ -148,13 +148,15 @@ async function server_settings(title, serverId) {
   });
 }
 
-async function take_sg_info() {
-  const response = await fetch("/admin/view-tables");
-  const dbInfo = await response.json();
+async function take_sg_info(serverId) {
+  const [groups, links] = await Promise.all([
+    fetchTable("groups", { columns: "id,name" }),
+    fetchTable("group_to_server", { server_id: serverId }),
+  ]);
 
   const dataMap = {
-    groups: dbInfo.groups,
-    links: dbInfo.group_to_server,
+    groups: groups,
+    links: links,
   };
 
   return dataMap;
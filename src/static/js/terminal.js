@@ -14,40 +14,78 @@ const term = new Terminal({
 term.open(termEl);
 
 const serverId = termEl?.dataset?.serverId || null;
-console.log("Connecting to WebSocket...");
-console.log("Server ID:", serverId);
-const wsProtocol = window.location.protocol === "https:" ? "wss:" : "ws:";
-const wsUrl = `${wsProtocol}//${window.location.host}/ws/ssh/${serverId}`;
-console.log("WebSocket URL:", wsUrl);
-const socket = new WebSocket(wsUrl);
-socket.binaryType = "arraybuffer";
-
-socket.onopen = () => {
-  term.write("Connected to SSH server\r\n");
-  try {
-    socket.send(JSON.stringify({ cols: cols, rows: rows }));
-  } catch (error) {
-    console.error("Error sending window size:", error);
-    term.write("Error: Failed to send window size\r\n");
-  }
-  term.focus();
-};
+const tokenKey = `wst:session:${serverId}`;
+// ?mode=screen on the page asks the server for rendered screen diffs
+// instead of the raw byte stream (useful on slow links).
+const mode = new URLSearchParams(window.location.search).get("mode");
+const maxReconnects = 5;
+let reconnects = 0;
+let socket = null;
 
-socket.addEventListener("message", (event) => {
-  term.write(new TextDecoder().decode(event.data));
-});
+function connect() {
+  const wsProtocol = window.location.protocol === "https:" ? "wss:" : "ws:";
+  const token = sessionStorage.getItem(tokenKey);
+  const params = new URLSearchParams();
+  if (token) params.set("token", token);
+  if (mode) params.set("mode", mode);
+  const query = params.toString() ? `?${params}` : "";
+  const wsUrl = `${wsProtocol}//${window.location.host}/ws/ssh/${serverId}${query}`;
+  console.log("WebSocket URL:", wsUrl);
 
-socket.onerror = (error) => {
-  console.error("WebSocket error:", error);
-  term.write("Error: Connection error\r\n");
-};
+  socket = new WebSocket(wsUrl);
+  socket.binaryType = "arraybuffer";
 
-socket.onclose = () => {
-  console.log("WebSocket connection closed");
-  term.write("Connection closed\r\n");
-};
+  socket.onopen = () => {
+    if (!token) term.write("Connected to SSH server\r\n");
+    try {
+      socket.send(JSON.stringify({ cols: cols, rows: rows }));
+    } catch (error) {
+      console.error("Error sending window size:", error);
+      term.write("Error: Failed to send window size\r\n");
+    }
+    term.focus();
+  };
+
+  socket.addEventListener("message", (event) => {
+    if (typeof event.data === "string") {
+      const msg = JSON.parse(event.data);
+      if (msg.type === "session") {
+        sessionStorage.setItem(tokenKey, msg.token);
+        reconnects = 0;
+      }
+      return;
+    }
+    // Hand xterm the raw bytes: its parser keeps a UTF-8 sequence split across
+    // frames, where decoding each frame on its own would turn it into U+FFFD.
+    term.write(new Uint8Array(event.data));
+  });
+
+  socket.onerror = (error) => {
+    console.error("WebSocket error:", error);
+  };
+
+  socket.onclose = (event) => {
+    console.log("WebSocket connection closed", event.code);
+    // 1000: the shell exited, 1008: refused. Anything else (including
+    // 4000, dropped for reading too slowly) is a dropped connection the
+    // server keeps the shell around for.
+    if (event.code === 1000 || event.code === 1008 || reconnects >= maxReconnects) {
+      sessionStorage.removeItem(tokenKey);
+      term.write("Connection closed\r\n");
+      return;
+    }
+    reconnects += 1;
+    term.reset();
+    setTimeout(connect, 1000 * reconnects);
+  };
+}
+
+console.log("Connecting to WebSocket...");
+console.log("Server ID:", serverId);
+connect();
 
 term.onData((data) => {
+  if (!socket || socket.readyState !== WebSocket.OPEN) return;
   try {
     socket.send(new TextEncoder().encode(data));
   } catch (error) {
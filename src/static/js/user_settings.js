@@ -94,9 +94,10 @@ async function user_settings(username, userId) {
   });
   mBody.appendChild(search);
 
-  const { groups, web_users } = await (
-    await fetch("/admin/view-tables")
-  ).json();
+  const [groups, web_users] = await Promise.all([
+    fetchTable("groups", { columns: "id,name" }),
+    fetchTable("web_users", { id: userId, columns: "id,group_id" }),
+  ]);
   const currentUser = web_users.find((u) => String(u.id) === String(userId));
   const currentGroupId = currentUser ? currentUser.group_id : null;
 
@@ -1,103 +1,153 @@
-from time import time
 from fastapi import WebSocket, APIRouter
 from starlette.websockets import WebSocketDisconnect
-from db.db import get_session_by_session_str, decrypt_string, get_virtual_user_by_id, get_group_by_user_id, is_group_linked
+from db.db import get_valid_session, decrypt_virtual_user, check_terminal_access
 from ssh import SSHSession
+from detach import detached_sessions
+from mux import MuxConnection
+from utils.timing import PhaseTimer, terminal_open_stats
+from utils.metrics import terminal_access
 
 import asyncio
 
 router = APIRouter(prefix="/ws", tags=["WebSocket"])
 
-@router.websocket("/ssh/{virtual_user_id}")
-async def websocket_endpoint(ws: WebSocket, virtual_user_id: int):
-    try:
-        virt_usr = await get_virtual_user_by_id(virtual_user_id)
-    except Exception:
-        await ws.close(code=1008, reason="Virtual user not found")
-        return
 
-    if not virt_usr:
-        await ws.close(code=1008, reason="Virtual user not found")
-        return
+async def attach_or_connect(ws, virt_usr, termsize: dict, web_user_id: int,
+                            token: str | None = None, mode: str = "raw",
+                            timer: PhaseTimer | None = None) -> SSHSession | None:
+    """Reattach the detached session behind ``token`` or open a new one.
+
+    Returns None if the SSH connection failed (``ws`` is closed by then).
+    """
+    ssh_session = None
+    if token:
+        ssh_session = detached_sessions.reattach(token, web_user_id, virt_usr.id, ws)
+
+    if ssh_session is not None:
+        ssh_session.resize(termsize["cols"], termsize["rows"])
+        if timer is not None:
+            timer.mark("reattach")
+            ssh_session.timer = timer
+        return ssh_session
+
+    password, key, passphrase = await decrypt_virtual_user(virt_usr)
+    if timer is not None:
+        timer.mark("decrypt")
+    ssh_session = SSHSession(
+        ws=ws,
+        host=virt_usr.domain,
+        port=virt_usr.port,
+        username=virt_usr.username,
+        password=password,
+        pkey=key,
+        key_type=virt_usr.ssh_key_type,
+        passphrase=passphrase,
+        termsize=termsize,
+        virtual_user_id=virt_usr.id,
+        owner_id=web_user_id,
+        mode=mode,
+    )
+    ssh_session.timer = timer
 
-    host = virt_usr.domain
-    user = virt_usr.username
-    port = virt_usr.port
-    password = await decrypt_string(virt_usr.password) if virt_usr.password else None
-    key = await decrypt_string(virt_usr.ssh_key) if virt_usr.ssh_key else None
-    passphrase = await decrypt_string(virt_usr.passphrase) if virt_usr.passphrase else None
-    key_type = virt_usr.ssh_key_type
+    ok = await ssh_session.connect()
+
+    if not ok:
+        return None
+
+    ssh_session.start_reader()
+    return ssh_session
+
+
+async def end_session(ssh_session: SSHSession, ws_writer_task: asyncio.Task | None,
+                      detach: bool = True) -> None:
+    if ws_writer_task is not None:
+        ws_writer_task.cancel()
+        try:
+            await ws_writer_task
+        except asyncio.CancelledError:
+            pass
+
+    # Keep the shell running for a browser that comes back with the
+    # token; close it right away if it already exited.
+    if not detach or not detached_sessions.detach(ssh_session):
+        await ssh_session.close()
+
+
+@router.websocket("/ssh/{virtual_user_id}")
+async def websocket_endpoint(ws: WebSocket, virtual_user_id: int):
+    timer = PhaseTimer(terminal_open_stats)
 
     session_cookie = ws.cookies.get("session")
     if not session_cookie:
         await ws.close(code=1008, reason="No session cookie found")
         return
 
-    session = await get_session_by_session_str(session_cookie)
-    if not session or session.expires_at < int(time()):
-        await ws.close(code=1008, reason="Invalid or expired session")
-        return
-
-    web_user_id = session.user_id
-    group_id = await get_group_by_user_id(web_user_id)
-    if not await is_group_linked(group_id, virtual_user_id):
-        await ws.close(code=1008, reason="Access denied")
+    access = await check_terminal_access(virtual_user_id, session_str=session_cookie)
+    timer.mark("auth")
+    terminal_access.inc(access.denied or "ok")
+    if access.denied:
+        await ws.close(code=1008, reason=access.denied)
         return
 
     await ws.accept()
+    timer.mark("accept")
 
     try:
         termsize = await ws.receive_json()
     except Exception:
         await ws.close(code=1008, reason="No term size")
         return
+    timer.mark("termsize")
 
-    ssh_session = SSHSession(
-        ws=ws,
-        host=host,
-        port=port,
-        username=user,
-        password=password,
-        pkey=key,
-        key_type=key_type,
-        passphrase=passphrase,
-        termsize=termsize,
+    ssh_session = await attach_or_connect(
+        ws, access.virtual_user, termsize, access.user_id,
+        token=ws.query_params.get("token"),
+        mode=ws.query_params.get("mode", "raw"),
+        timer=timer,
     )
-
-    ok = await ssh_session.connect()
-    
-    if not ok:
+    if ssh_session is None:
         return
 
-    ssh_reader_task = asyncio.create_task(asyncio.to_thread(ssh_session.ssh_reader))
-    ws_writer_task = asyncio.create_task(ssh_session.ws_writer())
-
+    ws_writer_task = None
     try:
+        await ws.send_json({"type": "session", "token": ssh_session.token})
+        ws_writer_task = asyncio.create_task(ssh_session.ws_writer())
+
         while True:
             data = await ws.receive_bytes()
-            await asyncio.to_thread(ssh_session.chan.send, data)
+            await ssh_session.write(data)
 
     except WebSocketDisconnect:
         pass
 
     finally:
-        if ssh_session.stop_event:
-            ssh_session.stop_event.set()
+        await end_session(ssh_session, ws_writer_task)
 
-        try:
-            ssh_session.chan.close()
-        except Exception:
-            pass
 
-        try:
-            await ssh_reader_task
-        except Exception:
-            pass
+@router.websocket("/mux")
+async def mux_endpoint(ws: WebSocket):
+    session_cookie = ws.cookies.get("session")
+    if not session_cookie:
+        await ws.close(code=1008, reason="No session cookie found")
+        return
 
-        ws_writer_task.cancel()
-        try:
-            await ws_writer_task
-        except asyncio.CancelledError:
-            pass
+    session = await get_valid_session(session_cookie)
+    if not session:
+        await ws.close(code=1008, reason="Invalid or expired session")
+        return
 
-        await ssh_session.close()
+    await ws.accept()
+
+    mux = MuxConnection(
+        ws,
+        web_user_id=session.user_id,
+        expires_at=session.expires_at,
+        open_session=attach_or_connect,
+        end_session=end_session,
+    )
+    try:
+        await mux.run()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await mux.close()
@@ -0,0 +1,79 @@
+from bench.fakes import FakeWebSocket
+from ssh_pool import transport_pool
+
+import asyncio
+import pytest
+import ssh
+
+
+class FakeTransport:
+    def __init__(self):
+        self.closed = False
+
+    def is_active(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def entries():
+    return [e for es in transport_pool._entries.values() for e in es]
+
+
+def run_connect(monkeypatch, opener, open_shell, acquired: list) -> bool:
+    acquire = transport_pool.acquire
+
+    async def recording_acquire(key, opener):
+        acquired.append(await acquire(key, opener))
+        return acquired[-1]
+
+    monkeypatch.setattr(transport_pool, "acquire", recording_acquire)
+    monkeypatch.setattr(ssh, "open_transport", opener)
+    monkeypatch.setattr(ssh, "open_shell", open_shell)
+    session = ssh.SSHSession(FakeWebSocket(), "example.com", 22, "root", password="pw", virtual_user_id=1)
+    ok = asyncio.run(session.connect())
+    assert session.pooled is None
+    return ok
+
+
+def fail_shell(transport, cols, rows):
+    raise OSError("channel open failed")
+
+
+@pytest.fixture(autouse=True)
+def empty_pool():
+    yield
+    for entry in entries():
+        transport_pool._discard(entry)
+
+
+def test_retry_shell_fails(monkeypatch):
+    opened = []
+
+    def opener(*args, **kwargs):
+        opened.append(FakeTransport())
+        return opened[-1]
+
+    acquired = []
+    assert not run_connect(monkeypatch, opener, fail_shell, acquired)
+    assert len(opened) == 2
+    assert [e.refs for e in acquired] == [0, 0]
+    # The first transport is retired; the fresh one idles in the pool.
+    assert opened[0].closed and not opened[1].closed
+
+
+def test_retry_acquire_fails(monkeypatch):
+    opened = []
+
+    def opener(*args, **kwargs):
+        if opened:
+            raise OSError("connection refused")
+        opened.append(FakeTransport())
+        return opened[-1]
+
+    acquired = []
+    assert not run_connect(monkeypatch, opener, fail_shell, acquired)
+    assert [e.refs for e in acquired] == [0]
+    assert transport_pool.stats() == {"transports": 0, "idle": 0, "channels": 0}
+    assert opened[0].closed
@@ -0,0 +1,34 @@
+from db.tokens import TokenSigner
+
+import time
+
+
+def signer() -> TokenSigner:
+    return TokenSigner("secret", "1")
+
+
+def test_round_trip():
+    now = int(time.time())
+    sess = signer().issue(7, 3, now, now + 60)
+    verified = signer().verify(sess.session)
+    assert verified is not None
+    assert (verified.user_id, verified.group_id, verified.jti) == (7, 3, sess.jti)
+
+
+def test_tampered_signature():
+    now = int(time.time())
+    token = signer().issue(7, 3, now, now + 60).session
+    assert signer().verify(token[:-1] + ("A" if token[-1] != "A" else "B")) is None
+
+
+def test_non_ascii_token():
+    assert signer().verify("v1.1.e30.\xe9") is None
+    now = int(time.time())
+    token = signer().issue(7, 3, now, now + 60).session
+    assert signer().verify(token + "\xe9") is None
+    assert signer().verify(token.replace(".", ".\xe9", 2)) is None
+
+
+def test_expired():
+    now = int(time.time())
+    assert signer().verify(signer().issue(7, 3, now - 120, now - 60).session) is None
@@ -0,0 +1,190 @@
+"""Counters and histograms rendered in the Prometheus text format.
+
+Instruments are plain dicts keyed by label values.  Counters are only
+touched from the event loop thread, so they take no lock; histograms may
+be observed from worker threads (SSH connects) and take a short one per
+observation.  Per-byte counting stays on the objects doing the work (see
+SSHSession.bytes_in) and is summed only when /metrics is scraped.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import bisect
+import functools
+import math
+import os
+import threading
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return "+Inf" if value == math.inf else repr(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, n: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + n
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, values)} {_number(total)}")
+        return lines
+
+
+class Sampled:
+    """A gauge or counter whose values are read from ``collect()`` at scrape
+    time: a number, or a dict of label values -> number."""
+
+    def __init__(self, name: str, help: str, collect, kind: str = "gauge", labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.kind = kind
+        self.labels = labels
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.labels = labels
+        # label values -> [per-bucket counts..., sum]
+        self.values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *labels) -> None:
+        with self._lock:
+            row = self.values.get(labels)
+            if row is None:
+                row = self.values[labels] = [0] * len(self.buckets) + [0.0]
+            row[bisect.bisect_left(self.buckets, seconds)] += 1
+            row[-1] += seconds
+
+    def timed(self, fn, *labels):
+        """Wraps coroutine function ``fn`` to observe its duration."""
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.observe(perf_counter() - start, *labels)
+        return wrapper
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            rows = sorted((values, list(row)) for values, row in self.values.items())
+        for values, row in rows:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {row[-1]!r}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+class TrackedExecutor(ThreadPoolExecutor):
+    """A ThreadPoolExecutor that counts its running and queued calls
+    itself, so /metrics need not read the pool's private state."""
+
+    def __init__(self, max_workers: int | None = None, thread_name_prefix: str = ""):
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        super().__init__(self.max_workers, thread_name_prefix)
+        self.running = 0
+        self.queued = 0
+        self._count_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            with self._count_lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._count_lock:
+                    self.running -= 1
+
+        with self._count_lock:
+            self.queued += 1
+        try:
+            future = super().submit(run)
+        except BaseException:
+            with self._count_lock:
+                self.queued -= 1
+            raise
+        # Only a future still in the queue can be cancelled; run() never starts.
+        future.add_done_callback(lambda f: f.cancelled() and self._unqueue())
+        return future
+
+    def _unqueue(self) -> None:
+        with self._count_lock:
+            self.queued -= 1
+
+    def stats(self) -> dict:
+        return {"max": self.max_workers, "busy": self.running, "queued": self.queued}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+SSH_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+ssh_connect_seconds = registry.register(Histogram(
+    "wst_ssh_connect_seconds", "SSH connect time per phase (tcp, kex, auth, shell).",
+    SSH_BUCKETS, ("phase",),
+))
+db_query_seconds = registry.register(Histogram(
+    "wst_db_call_seconds", "Latency of db.db query functions.", DB_BUCKETS, ("function",),
+))
+auth_attempts = registry.register(Counter(
+    "wst_auth_attempts_total", "Admin and user login attempts by outcome.", ("scope", "outcome"),
+))
+terminal_access = registry.register(Counter(
+    "wst_terminal_access_total", "Terminal open checks by outcome.", ("outcome",),
+))
@@ -0,0 +1,100 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from time import monotonic
+
+import ipaddress
+
+
+def parse_networks(spec: str) -> list:
+    """Comma-separated addresses or CIDR blocks, e.g. "10.0.0.0/8,::1"."""
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in spec.split(",") if part.strip()]
+
+
+def client_ip(request, trusted: list, header: str = "x-forwarded-for") -> str:
+    """The address to charge for ``request``.
+
+    Behind a reverse proxy request.client is the proxy itself, so when it
+    is in ``trusted`` the forwarded ``header`` is read from the right,
+    skipping further trusted hops, and the first other address wins.  A
+    client can prepend anything to that header; only what trusted proxies
+    appended is believed.
+    """
+    host = request.client.host if request.client else "unknown"
+    hops = [hop.strip() for hop in request.headers.get(header, "").split(",") if hop.strip()]
+    while hops and _is_trusted(host, trusted):
+        host = hops.pop()
+    return host
+
+
+def _is_trusted(host: str, trusted: list) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in trusted)
+
+
+class BucketStore(ABC):
+    """Where token buckets live.
+
+    The limiter only calls ``take``, so a store shared by several workers
+    (Redis, a database table) can replace MemoryBucketStore by
+    implementing it.
+    """
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Takes one token from ``key``'s bucket, which refills at ``rate``
+        tokens per second up to ``burst``.  Returns 0 if there was one,
+        else the seconds until there will be."""
+
+
+class MemoryBucketStore(BucketStore):
+    """Token buckets in a bounded LRU dict.
+
+    Evicting the least recently used key only forgets a bucket that has
+    been idle the longest, i.e. the one closest to full anyway.
+    Not thread-safe; meant to be used from the event loop.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class RateLimiter:
+    def __init__(self, store: BucketStore, rate_per_min: float, burst: int):
+        self.store = store
+        self.rate = rate_per_min / 60
+        self.burst = burst
+        self.limited = 0
+
+    async def check(self, key: str) -> float:
+        """0 if ``key`` may go ahead, else the seconds it has to wait."""
+        wait = await self.store.take(key, self.rate, self.burst)
+        if wait:
+            self.limited += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {"limited": self.limited}
@@ -1,9 +1,8 @@
-from fastapi import FastAPI, Request, status
+from fastapi import FastAPI, Request, Response, Query, status
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import JSONResponse
-from db.db import get_session_by_session_str, get_servers_by_user_id, get_group_by_user_id
-from time import time
+from db.db import get_valid_session, get_servers_by_group_id, get_servers_page, get_group_by_user_id, acl
 
 
 app = FastAPI()
@@ -19,8 +18,8 @@ async def add_process_time_header(request: Request, call_next):
             content={"detail": "No session cookie found"}
         )
     
-    session = await get_session_by_session_str(current_session)
-    if not session or session.expires_at < int(time()):
+    session = await get_valid_session(current_session)
+    if not session:
         return JSONResponse(
             status_code=status.HTTP_401_UNAUTHORIZED,
             content={"detail": "Invalid or expired session"}
@@ -32,13 +31,38 @@ async def add_process_time_header(request: Request, call_next):
 @app.get('/get_servers_by_user_id')
 async def get_servers_by_user(request: Request,):
     current_session = request.cookies.get("session")
-    session = await get_session_by_session_str(current_session)
+    session = await get_valid_session(current_session)
 
     group_id = await get_group_by_user_id(session.user_id)
     if group_id is None:
         return []
 
-    return await get_servers_by_user_id(user_id=group_id)
+    return await get_servers_by_group_id(group_id)
+
+@app.get('/servers')
+async def list_servers(
+    request: Request,
+    after: int = 0,
+    limit: int = Query(50, ge=1, le=500),
+    q: str = Query("", max_length=255),
+    match: str = Query("substring", pattern="^(prefix|substring)$"),
+):
+    """Keyset-paginated, searchable list of the caller's terminals."""
+    session = await get_valid_session(request.cookies.get("session"))
+    group_id = await get_group_by_user_id(session.user_id)
+
+    items, next_after = await get_servers_page(group_id, after, limit, q, prefix=match == "prefix")
+    # The list only changes with the ACL version or the caller's group;
+    # the query string is part of the cache key already.
+    etag = f'W/"{acl.version}-{group_id}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return JSONResponse({"items": [
+        {"id": srv.id, "username": srv.username, "domain": srv.domain, "port": srv.port}
+        for srv in items
+    ], "next": next_after}, headers=headers)
 
 @app.get('/', name='List of available terminals', tags=['Views'])
 def terms_list(
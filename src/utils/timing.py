@@ -0,0 +1,56 @@
+from time import perf_counter
+
+
+class PhaseStats:
+    """Running per-phase averages and maxima over many PhaseTimers."""
+
+    def __init__(self):
+        self.count = 0
+        self.totals: dict[str, float] = {}
+        self.maxima: dict[str, float] = {}
+
+    def record(self, phases: list[tuple[str, float]]) -> None:
+        self.count += 1
+        for name, seconds in phases + [("total", sum(s for _, s in phases))]:
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+            self.maxima[name] = max(self.maxima.get(name, 0.0), seconds)
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "phases": {
+                name: {
+                    "avg_ms": round(total / self.count * 1000, 3),
+                    "max_ms": round(self.maxima[name] * 1000, 3),
+                }
+                for name, total in self.totals.items()
+            },
+        }
+
+
+class PhaseTimer:
+    """Splits one operation into consecutive named phases.
+
+    ``mark(name)`` closes the phase that ran since the previous mark;
+    ``finish`` records the whole breakdown into ``stats`` once.
+    """
+
+    def __init__(self, stats: PhaseStats | None = None):
+        self.stats = stats
+        self.phases: list[tuple[str, float]] = []
+        self._last = perf_counter()
+
+    def mark(self, name: str) -> None:
+        now = perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def finish(self, name: str) -> None:
+        self.mark(name)
+        if self.stats is not None:
+            self.stats.record(self.phases)
+            self.stats = None
+
+
+# Terminal open, from the WebSocket arriving to the first output byte sent.
+terminal_open_stats = PhaseStats()